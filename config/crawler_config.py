@@ -15,14 +15,54 @@ LOAD_TIMEOUT = 30
 PARSE_TIMEOUT = 120
 BROWSER_PAGE_TIMEOUT = 30
 
+# Deadlines (seconds) of the explicit waits in the consent flow. Each wait polls
+# its condition and returns as soon as it holds.
+WAIT_DEADLINES = {
+    "page_ready": 15,
+    "cmp_loaded": 10,
+    "banner_visible": 5,
+    "cookies_changed": 5,
+    "settle": 3
+}
+
 # User agent string for HTTP requests
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"
 
-# Browser profile paths
+# Error messages of failed consent crawls that are worth retrying with --resume --retry-failed
+# (regular expressions, case-insensitive). Other failures, e.g. unknown hosts, are final.
+RETRYABLE_ERROR_PATTERNS = [
+    r"page load timeout",
+    r"timed out",
+    r"NS_ERROR_NET_(TIMEOUT|RESET|INTERRUPT)",
+    r"NS_ERROR_CONNECTION_REFUSED",
+    r"netTimeout|connectionFailure|netReset",
+    r"Failed to decode response from marionette",
+    r"Tried to run command without establishing a connection",
+    r"browsing context has been discarded",
+    r"invalid session id|session deleted",
+    r"Process unexpectedly closed",
+    r"Worker killed: no result within"
+]
+
+# Path to the geckodriver binary. If unset, geckodriver is looked up on PATH
+# and otherwise installed through webdriver-manager, once per process.
+GECKODRIVER_PATH = os.environ.get("GECKODRIVER_PATH")
+
+# Browser profile paths, Firefox profile directories to be created before crawling with
+# them. The no_interaction baseline runs in a fresh profile.
 BROWSER_PROFILES = {
     "accept_all": "./config/browser_profiles/accept_all/",
     "accept_none": "./config/browser_profiles/accept_none/", 
-    "without_consentomatic": "./config/browser_profiles/without_consentomatic/"
+    "without_consentomatic": "./config/browser_profiles/without_consentomatic/",
+    "no_interaction": None
+}
+
+# Consent mode of the consent crawler in each browser profile: accept or reject the
+# banner, or leave it untouched for a baseline. Profiles not listed accept.
+PROFILE_CONSENT_MODES = {
+    "accept_all": "accept",
+    "accept_none": "reject",
+    "no_interaction": "none"
 }
 
 # Firefox preferences for consent crawling
@@ -39,6 +79,56 @@ FIREFOX_PREFERENCES = {
     "network.cookie.sameSite.laxByDefault": True,
 }
 
+# Page load profiles of the consent crawler. Each sets extra Firefox preferences and
+# hosts whose requests are refused (through a PAC file), while scripts and
+# cookie-setting requests of all other hosts are loaded as usual.
+#   full:    everything is loaded
+#   lean:    no web fonts, no media autoplay or streaming, no heavy non-tracking hosts
+#   minimal: lean without images; tracking pixels are images, so check the cookie
+#            counts with --compare-profile before using it for a study
+# Only hosts that serve fonts, media or images alone belong here. Shared CDNs such as
+# akamaihd.net, or video platforms such as brightcove.net whose players run scripts,
+# also serve trackers and CMP scripts.
+HEAVY_HOSTS = [
+    "fonts.googleapis.com", "fonts.gstatic.com", "use.typekit.net", "use.fontawesome.com",
+    "googlevideo.com", "ytimg.com", "vimeocdn.com", "jwpcdn.com", "cloudinary.com", "imgix.net"
+]
+
+LEAN_PREFERENCES = {
+    "gfx.downloadable_fonts.enabled": False,
+    "browser.display.use_document_fonts": 0,
+    "media.autoplay.default": 5,
+    "media.autoplay.blocking_policy": 2,
+    "media.mediasource.enabled": False,
+    "network.prefetch-next": False,
+    "network.http.speculative-parallel-limit": 0
+}
+
+LOAD_PROFILES = {
+    "full": {
+        "preferences": {},
+        "blocked_hosts": []
+    },
+    "lean": {
+        "preferences": LEAN_PREFERENCES,
+        "blocked_hosts": HEAVY_HOSTS
+    },
+    "minimal": {
+        "preferences": {**LEAN_PREFERENCES, "permissions.default.image": 2},
+        "blocked_hosts": HEAVY_HOSTS
+    }
+}
+
+# Hosts of third-party CMP and tracker assets that are fetched through the local asset
+# cache proxy (run_consent_crawl.py --asset-cache), including their subdomains
+CACHED_ASSET_HOSTS = [
+    "consent.cookiebot.com", "consent.cookiebot.eu", "consentcdn.cookiebot.com",
+    "cdn.cookielaw.org", "optanon.blob.core.windows.net", "app.termly.io",
+    "www.googletagmanager.com", "www.google-analytics.com", "connect.facebook.net",
+    "static.hotjar.com", "script.hotjar.com", "snap.licdn.com", "static.ads-twitter.com",
+    "ajax.googleapis.com", "code.jquery.com", "cdnjs.cloudflare.com", "cdn.jsdelivr.net"
+]
+
 # CMP detection patterns
 CMP_PATTERNS = {
     "cookiebot": [
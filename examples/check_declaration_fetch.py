@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+This example runs the declaration fetcher against a local stand-in server of the
+canned CDN responses in examples/declaration_fixtures and checks what it stores:
+the rows parsed from a Cookiebot cc.js and from a OneTrust ruleset/language file,
+and one failed result each for a malformed language file and a missing cc.js.
+"""
+
+import sys
+import os
+import sqlite3
+import tempfile
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from crawlers.shared_utils import retrieve_cmp_site_ids
+from crawlers.declaration_fetcher import DeclarationFetcher
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "declaration_fixtures")
+
+# (name, domain, category) of the declaration rows expected per site
+EXPECTED_ROWS = {
+    "https://shop.example": {
+        ("CookieConsent", "shop.example", "Necessary"),
+        ("__cf_bm", "cdn.example.net", "Necessary"),
+        ("lang", "shop.example", "Preferences"),
+        ("_ga", "shop.example", "Statistics"),
+        ("_ga_#", "shop.example", "Statistics"),
+        ("_fbp", "shop.example", "Marketing"),
+        ("IDE", "doubleclick.net", "Marketing")
+    },
+    "https://news.example": {
+        ("OptanonConsent", "news.example", "Strictly Necessary Cookies"),
+        ("_gid", "news.example", "Performance Cookies"),
+        ("_hjSessionUser_#", "hotjar.com", "Performance Cookies"),
+        ("uuid2", "adnxs.com", "Personalised advertising")
+    }
+}
+
+EXPECTED_FAILED = {"https://broken.example", "https://missing.example"}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serves the fixtures without logging each request"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    """Fetch the canned declarations and compare the stored rows"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=FIXTURES))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    site_ids = retrieve_cmp_site_ids([FIXTURES])
+    fetcher = DeclarationFetcher(num_threads=4, timeout=5,
+                                 cdn_bases={"cookiebot": f"{base}/cookiebot", "onetrust": f"{base}/onetrust"})
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "declarations.sqlite")
+        try:
+            stats = fetcher.fetch_all(site_ids, db_path)
+        finally:
+            server.shutdown()
+
+        conn = sqlite3.connect(db_path)
+        try:
+            stored = {}
+            for site, name, domain, category in conn.execute(
+                    "SELECT cr.domain, cd.cookie_name, cd.cookie_domain, cd.purpose_category "
+                    "FROM crawl_results cr JOIN consent_data cd ON cr.id = cd.crawl_id"):
+                stored.setdefault(site, set()).add((name, domain, category))
+            failed = {row[0] for row in conn.execute("SELECT domain FROM crawl_results WHERE success = 0")}
+        finally:
+            conn.close()
+
+    for site, rows in EXPECTED_ROWS.items():
+        if stored.get(site, set()) != rows:
+            problems.append(f"{site}: missing {rows - stored.get(site, set())}, "
+                            f"unexpected {stored.get(site, set()) - rows}")
+    if failed != EXPECTED_FAILED:
+        problems.append(f"failed sites {sorted(failed)}, expected {sorted(EXPECTED_FAILED)}")
+
+    print(f"Fetched: {stats['fetched']}, failed: {stats['failed']}, declarations: {stats['declarations']}")
+    for problem in problems:
+        print(f"MISMATCH {problem}")
+    print("Declaration fetch check " + ("failed" if problems else "passed"))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    exit(main())
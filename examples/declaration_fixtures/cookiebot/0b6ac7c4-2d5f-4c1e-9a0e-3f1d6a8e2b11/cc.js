@@ -0,0 +1,7 @@
+var CookieConsentDialog = CookieConsentDialog || {};
+CookieConsentDialog.cookieTableNecessary = [["CookieConsent","shop.example","Stores the user's cookie consent state for the current domain","1 year","HTTP Cookie","1"],["__cf_bm","cdn.example.net","This cookie is used to distinguish between humans and bots.","1 day","HTTP Cookie","1"]];
+CookieConsentDialog.cookieTablePreference = [["lang","shop.example","Remembers the user's selected language version of a website","Session","HTTP Cookie","2"]];
+CookieConsentDialog.cookieTableStatistics = [["_ga","shop.example","Registers a unique ID that is used to generate statistical data on how the visitor uses the website.","2 years","HTTP Cookie","3"],["_ga_#","shop.example","Used by Google Analytics to collect data on the number of times a user has visited the website as well as dates for the first and most recent visit. ","2 years","HTTP Cookie","3"]];
+CookieConsentDialog.cookieTableAdvertising = [["_fbp","shop.example","Used by Facebook to deliver a series of advertisement products such as real time bidding from third party advertisers.","3 months","HTTP Cookie","4"],["IDE","doubleclick.net","Used by Google DoubleClick to register and report the website user's actions after viewing or clicking one of the advertiser's ads with the purpose of <b>measuring the efficacy</b> of an ad.","1 year","HTTP Cookie","4"]];
+CookieConsentDialog.cookieTableUnclassified = [];
+CookieConsentDialog.cookieTableUnclassifiedCount = 0;
@@ -3,33 +3,235 @@
 Browser-based crawler that collects detailed cookie and consent data.
 
 Usage:
-    run_consent_crawl.py -n <NUM> (-f <fpath> | -u <url> | -p <fpkl> | -c <csvpath>)... [--headless]
+    run_consent_crawl.py -n <NUM> (-f <fpath> | -u <url> | -p <fpkl> | -c <csvpath> | -r <ppath>)... [--headless]
+        [--seen <SEENFILE> [--seen-days <DAYS>] [--seen-fpr <RATE>] [--defer-seen]]
+        [--prioritize [--eu]] [--time-budget <SECONDS>] [--max-pages <PAGES>] [--max-memory <MB>] [--tabs <TABS>]
+        [--spares <SPARES>] [--geckodriver <GPATH>] [--load-profile <LPROFILE> [--compare-profile <SAMPLE>]]
+        [--db <DBPATH> [--resume [--retry-failed]]] [--supervised [--domain-timeout <SECONDS>] [--worker-memory <MB>]]
+        [--profiles <PROFILES>] [--asset-cache <MB>] [--cookie-store] [--record]
     run_consent_crawl.py -h | --help
 
 Options:
-    -n --num_browsers <NUM>     Number of browser instances to use (recommend 1-2).
+    -n --num_browsers <NUM>     Number of parallel browser workers (limited by CPU and RAM).
     -u --url <u>                URL string to crawl.
     -p --pkl <fpkl>             Path to pickled list of urls to crawl.
     -f --file <fpath>           Path to file containing one URL per line.
     -c --csv <csvpath>          Path to csv containing domains in second column.
+    -r --presence <ppath>       Presence crawl output (results directory or presence_results.csv).
+                                Only CMP-positive domains are crawled, using the detected CMP type.
     --headless                  Run browsers in headless mode.
+    --max-pages <PAGES>         Restart a pooled browser after this many domains. [default: 50]
+    --max-memory <MB>           Restart a pooled browser whose processes exceed this resident
+                                memory. [default: 2048]
+    --spares <SPARES>           Warm spare browsers started in the background, swapped in when
+                                a browser is recycled or crashes. [default: 1]
+    --tabs <TABS>               Domains visited at once by each browser, in separate tabs with
+                                separate cookie jars. Requires WebDriver BiDi in Firefox and a
+                                Selenium release with the BiDi storage module, otherwise one tab
+                                is used. [default: 1]
+    --seen <SEENFILE>           Seen-domain filter file, shared across runs. Domains crawled within
+                                its freshness window are skipped, newly crawled domains are added.
+    --seen-days <DAYS>          Freshness window of a new seen-domain filter. Its halves expire
+                                whole, so domains are remembered for 1 to 1.5 times as long.
+                                [default: 30]
+    --seen-fpr <RATE>           False-positive rate of a new seen-domain filter. [default: 0.01]
+    --defer-seen                Crawl recently seen domains last instead of skipping them.
+    --prioritize                Crawl in order of priority score (rank, presence verdict, TLD,
+                                cluster representatives) instead of alphabetically.
+    --eu                        With --prioritize, boost EU/EEA and UK country-code TLDs.
+    --time-budget <SECONDS>     Stop cleanly after this many seconds; with --prioritize, the
+                                highest-scoring domains are crawled first.
+    --geckodriver <GPATH>       Path to the geckodriver binary (default: GECKODRIVER_PATH from
+                                config/crawler_config.py, then PATH, then webdriver-manager).
+    --load-profile <LPROFILE>   Page load profile from config/crawler_config.py: full, lean or
+                                minimal. Lighter profiles block fonts, media, heavy hosts and
+                                (minimal) images. [default: full]
+    --compare-profile <SAMPLE>  Instead of crawling, visit the first SAMPLE domains with both the
+                                full profile and --load-profile, and compare cookie counts. The
+                                visits are stored with the load profile as their profile, in the
+                                database given by --db or in one new database per load profile.
+    --db <DBPATH>               Write to this database instead of a new timestamped one in
+                                data/results, creating it if needed.
+    --resume                    Skip domains already finished in the --db database.
+    --retry-failed              With --resume, crawl failed domains again if their error matches
+                                RETRYABLE_ERROR_PATTERNS in config/crawler_config.py.
+    --supervised                Run each browser worker in its own subprocess. A worker that hangs
+                                on a domain or exceeds --worker-memory is killed with its browsers,
+                                and the domain is retried once.
+    --domain-timeout <SECONDS>  Wall-clock limit per domain in supervised mode. [default: 120]
+    --worker-memory <MB>        Resident memory limit of a supervised worker and its browsers.
+                                [default: 4096]
+    --profiles <PROFILES>       Comma-separated browser profiles from BROWSER_PROFILES in
+                                config/crawler_config.py (accept_all, accept_none,
+                                without_consentomatic, and the no_interaction baseline that leaves
+                                the banner untouched). Their profile directories must exist. Each
+                                domain is visited under every profile, concurrently with -n
+                                browsers per profile, and the results are stored per profile in
+                                the same database.
+    --asset-cache <MB>          Run a local caching proxy of this size for the static scripts and
+                                stylesheets of CACHED_ASSET_HOSTS in config/crawler_config.py,
+                                shared by all browsers. Responses with cookies are not cached.
+                                The proxy's CA is trusted in the browser profiles only, which
+                                needs NSS certutil (libnss3-tools).
+    --cookie-store              Complete the cookies of each visit from the cookies.sqlite of the
+                                browser profile, which includes third-party cookies of embedded
+                                frames that WebDriver does not return. Not used with --tabs.
+    --record                    Record the banner and declaration regions, CMP verdicts and cookies
+                                of each visit into <database>_snapshots.sqlite, for replaying the
+                                extractors without a browser (scripts/run_replay.py).
     -h --help                   Display this help message.
 
 Examples:
     python scripts/run_consent_crawl.py -n 1 -f data/domains/sample_domains.txt
     python scripts/run_consent_crawl.py -n 2 -u https://example.com --headless
+    python scripts/run_consent_crawl.py -n 1 -r data/results --headless
+    python scripts/run_consent_crawl.py -n 2 -f data/domains/sample_domains.txt --headless --tabs 4
+    python scripts/run_consent_crawl.py -n 1 -f data/domains/sample_domains.txt --load-profile lean --compare-profile 50
+    python scripts/run_consent_crawl.py -n 2 -r data/results --db data/results/consent_crawl.sqlite --resume --retry-failed
+    python scripts/run_consent_crawl.py -n 2 -r data/results --headless --profiles accept_all,accept_none,no_interaction
+    python scripts/run_consent_crawl.py -n 4 -r data/results --headless --asset-cache 512
+    python scripts/run_consent_crawl.py -n 2 -r data/results --headless --record
 """
 
 import sys
 import os
+import time
+import shutil
 import logging
+import threading
+from datetime import datetime
 from docopt import docopt
 
-# Add src to path for imports
+# Add src and the project root (for config) to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from crawlers.shared_utils import retrieve_cmdline_urls, filter_bad_urls_and_sort, setup_output_directory
+from crawlers.shared_utils import (retrieve_cmdline_urls, filter_bad_urls_and_sort, setup_output_directory,
+                                   retrieve_presence_verdicts, retrieve_seen_filter, retrieve_csv_ranks,
+                                   retrieve_finished_domains, CMP_CATEGORIES)
 from crawlers.consent_crawler import ConsentCrawler
+from crawlers.caching_proxy import CachingProxy
+from crawlers.result_writer import ResultWriter
+from crawlers.scheduler import CrawlScheduler, EU_TLDS
+from crawlers.seen_filter import domain_key
+from config import crawler_config
+
+
+def compare_load_profiles(crawlers, domains, cmp_hints):
+    """
+    Visit each sample domain with the full profile and with the lighter profile, one
+    after the other, and print cookie counts and visit times side by side. The results
+    are written to each crawler's database with the load profile as their profile.
+    @param crawlers: {"full": crawler, profile name: crawler}
+    @param domains: sample domains
+    @param cmp_hints: CMP types from the presence crawl, by domain key
+    """
+    (full_name, full), (name, light) = crawlers.items()
+    totals = {full_name: [0, 0.0], name: [0, 0.0]}
+    matching = 0
+    compared = 0
+    writers = {profile: ResultWriter(crawler.db_path, snapshot_path=crawler.snapshot_path)
+               for profile, crawler in crawlers.items()}
+    for writer in writers.values():
+        writer.start()
+    print(f"\n{'domain':<40} {full_name:>8} {name:>8}")
+    try:
+        for domain in domains:
+            counts = {}
+            for profile, crawler in ((full_name, full), (name, light)):
+                started = time.time()
+                result = crawler.crawl_domain(domain, cmp_hint=cmp_hints.get(domain_key(domain)))
+                result.profile = profile
+                writers[profile].put(result)
+                counts[profile] = result.cookies_collected if result.success else None
+                totals[profile][1] += time.time() - started
+            
+            if None in counts.values():
+                shown = ["failed" if c is None else c for c in counts.values()]
+                print(f"{domain:<40} {shown[0]:>8} {shown[1]:>8}")
+                continue
+            compared += 1
+            matching += counts[name] >= counts[full_name]
+            for profile in counts:
+                totals[profile][0] += counts[profile]
+            marker = "" if counts[name] >= counts[full_name] else "  <"
+            print(f"{domain:<40} {counts[full_name]:>8} {counts[name]:>8}{marker}")
+    finally:
+        for profile, writer in writers.items():
+            writer.close()
+            if writer.error is not None:
+                print(f"Error: {writer.unwritten} results of {profile} could not be written: {writer.error}",
+                      file=sys.stderr)
+    
+    print("\n" + "="*50)
+    print(f"LOAD PROFILE COMPARISON: {full_name} vs {name}")
+    print("="*50)
+    print(f"Domains compared: {compared} of {len(domains)}")
+    print(f"Domains with no fewer cookies: {matching}")
+    for profile, (cookies, seconds) in totals.items():
+        print(f"{profile}: {cookies} cookies, {seconds / max(1, len(domains)):.2f}s per visit")
+    print("="*50)
+
+
+def crawl_browser_profiles(crawlers, domains_by_profile, **crawl_args):
+    """
+    Crawl the domains under several browser profiles at the same time, one crawler
+    (with its own browsers) per profile.
+    @param crawlers: {profile name: crawler}, all writing to the same database
+    @param domains_by_profile: {profile name: domains still to crawl with it}
+    @param crawl_args: further arguments of ConsentCrawler.crawl_domains
+    @return: {profile name: summary statistics}
+    """
+    all_results = {}
+    errors = {}
+    
+    def crawl(name):
+        try:
+            all_results[name] = crawlers[name].crawl_domains(domains_by_profile[name], **crawl_args)
+        except Exception as e:
+            errors[name] = e
+    
+    threads = [threading.Thread(target=crawl, args=(name,), name=f"profile-{name}") for name in crawlers]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        print("\nStopping all profiles, waiting for running browsers to finish")
+        for crawler in crawlers.values():
+            crawler.stop()
+        for thread in threads:
+            thread.join()
+        raise
+    
+    for name, error in errors.items():
+        print(f"Error during crawl of profile {name}: {error}", file=sys.stderr)
+    return all_results
+
+
+def print_summary(results, title, db_path):
+    """Print the summary statistics of a crawl"""
+    print("\n" + "="*50)
+    print(title)
+    print("="*50)
+    print(f"Total domains: {results['total_domains']}")
+    print(f"Successful crawls: {results['successful_crawls']}")
+    print(f"Failed crawls: {results['failed_crawls']}")
+    print(f"Total cookies collected: {results['total_cookies']}")
+    print(f"Domains with consent data: {results['domains_with_consent_data']}")
+    print(f"Crawl time: {results['crawl_time_seconds']:.2f} seconds")
+    if results.get('uncrawled_domains'):
+        print(f"Not crawled (time budget): {results['uncrawled_domains']}")
+    
+    if results.get('cmp_types'):
+        print(f"\nCMP Distribution:")
+        for cmp_type, count in results['cmp_types'].items():
+            print(f"  {cmp_type}: {count}")
+    
+    print(f"\nDatabase location: {db_path}")
+    print("="*50)
 
 
 def main():
@@ -43,13 +245,69 @@ def main():
     )
     
     # Retrieve and process URLs
-    sites = retrieve_cmdline_urls(args)
+    seen_filter = retrieve_seen_filter(args)
+    defer_seen = args.get("--defer-seen", False)
+    sites = retrieve_cmdline_urls(args, seen_filter=None if defer_seen else seen_filter)
     filtered_sites = filter_bad_urls_and_sort(sites)
     
+    # Use presence crawl verdicts to skip non-CMP domains and avoid re-detection. The
+    # presence crawl records the url after redirects, so verdicts are matched by domain key,
+    # a CMP verdict winning over others of the same key
+    cmp_hints = {}
+    verdicts = {}
+    if args.get("--presence"):
+        for url, category in retrieve_presence_verdicts(args["--presence"]).items():
+            key = domain_key(url)
+            if verdicts.get(key) not in CMP_CATEGORIES:
+                verdicts[key] = category
+        cmp_hints = {key: cat for key, cat in verdicts.items() if cat in CMP_CATEGORIES}
+        filtered_sites = [url for url in filtered_sites
+                          if domain_key(url) not in verdicts or domain_key(url) in cmp_hints]
+        print(f"Loaded {len(verdicts)} presence verdicts, {len(cmp_hints)} CMP-positive")
+    
+    browser_profiles = [name.strip() for name in (args.get("--profiles") or "").split(",") if name.strip()]
+    for name in browser_profiles:
+        if name not in crawler_config.BROWSER_PROFILES:
+            print(f"Error: Unknown browser profile: {name}", file=sys.stderr)
+            return 1
+        template = crawler_config.BROWSER_PROFILES[name]
+        if template and not os.path.isdir(template):
+            print(f"Error: Directory of browser profile {name} not found: {template}. "
+                  "Create it from a Firefox profile, see BROWSER_PROFILES in config/crawler_config.py",
+                  file=sys.stderr)
+            return 1
+    if browser_profiles and args.get("--compare-profile"):
+        print("Error: --compare-profile cannot be combined with --profiles", file=sys.stderr)
+        return 1
+    
+    # Skip domains finished in the database of an interrupted crawl, per browser profile
+    finished_by_profile = {}
+    if args.get("--resume"):
+        if not os.path.exists(args["--db"]):
+            print(f"Error: Database to resume not found: {args['--db']}", file=sys.stderr)
+            return 1
+        for name in browser_profiles or [None]:
+            finished_by_profile[name] = retrieve_finished_domains(
+                args["--db"], args.get("--retry-failed", False),
+                crawler_config.RETRYABLE_ERROR_PATTERNS, profile=name)
+        finished = set.intersection(*finished_by_profile.values())
+        remaining = [url for url in filtered_sites if domain_key(url) not in finished]
+        print(f"Resuming: {len(filtered_sites) - len(remaining)} domains already finished")
+        if filtered_sites and not remaining:
+            print("All domains are finished, nothing to crawl")
+            return 0
+        filtered_sites = remaining
+    
     if not filtered_sites:
         print("Error: No valid domains to crawl. Please check your input.", file=sys.stderr)
         return 1
     
+    if args.get("--prioritize"):
+        scheduler = CrawlScheduler(ranks=retrieve_csv_ranks(args), verdicts=verdicts,
+                                   boosted_tlds=EU_TLDS if args.get("--eu") else None)
+        filtered_sites = scheduler.order(filtered_sites)
+    time_budget = float(args["--time-budget"]) if args.get("--time-budget") else None
+    
     # Set up crawler
     num_browsers = int(args["--num_browsers"])
     headless = args.get("--headless", False)
@@ -57,39 +315,100 @@ def main():
     output_dir = setup_output_directory("./data/results")
     
     print(f"Starting consent crawl of {len(filtered_sites)} domains")
-    print(f"Using {num_browsers} browser(s), headless: {headless}")
+    print(f"Using {num_browsers} browser(s), headless: {headless}, load profile: {args['--load-profile']}")
+    if browser_profiles:
+        print(f"Browser profiles: {', '.join(browser_profiles)}, {num_browsers} browser(s) each")
     print(f"Output directory: {output_dir}")
     print("\nNote: This may take a while as each domain is crawled with a real browser...")
     
-    try:
-        crawler = ConsentCrawler(
+    load_profile = args["--load-profile"]
+    if load_profile not in crawler_config.LOAD_PROFILES:
+        print(f"Error: Unknown load profile: {load_profile}", file=sys.stderr)
+        return 1
+    
+    def make_crawler(profile, browser_profile=None, db_path=args.get("--db")):
+        return ConsentCrawler(
             num_browsers=num_browsers,
             headless=headless,
-            output_dir=output_dir
+            output_dir=output_dir,
+            max_pages_per_browser=int(args["--max-pages"]),
+            max_browser_memory_mb=int(args["--max-memory"]),
+            spare_browsers=int(args["--spares"]),
+            geckodriver_path=args.get("--geckodriver") or crawler_config.GECKODRIVER_PATH,
+            wait_deadlines=crawler_config.WAIT_DEADLINES,
+            load_profile=crawler_config.LOAD_PROFILES[profile],
+            db_path=db_path,
+            supervised=args.get("--supervised", False),
+            domain_timeout=float(args["--domain-timeout"]),
+            max_worker_memory_mb=int(args["--worker-memory"]),
+            tabs_per_browser=int(args["--tabs"]),
+            consent_mode=crawler_config.PROFILE_CONSENT_MODES.get(browser_profile, "accept"),
+            profile_name=browser_profile,
+            profile_template=crawler_config.BROWSER_PROFILES.get(browser_profile),
+            cache_proxy=asset_cache.address if asset_cache else None,
+            cache_ca=asset_cache.ca_cert_path if asset_cache else None,
+            cached_hosts=crawler_config.CACHED_ASSET_HOSTS,
+            use_cookie_store=args.get("--cookie-store", False),
+            record_snapshots=args.get("--record", False)
         )
+    
+    asset_cache = None
+    try:
+        if args.get("--asset-cache"):
+            if shutil.which("certutil") is None:
+                print("Error: --asset-cache needs NSS certutil to trust the proxy CA in the browser profiles",
+                      file=sys.stderr)
+                return 1
+            asset_cache = CachingProxy(max_cache_mb=int(args["--asset-cache"]))
+            asset_cache.start()
         
-        # Run the crawl
-        results = crawler.crawl_domains(filtered_sites)
+        if args.get("--compare-profile"):
+            if load_profile == "full":
+                print("Error: --compare-profile needs a --load-profile other than full", file=sys.stderr)
+                return 1
+            # Both crawlers start within the same second, so their timestamped
+            # databases are told apart by the load profile
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            crawlers = {
+                profile: make_crawler(profile, db_path=args.get("--db") or os.path.join(
+                    output_dir, f"consent_crawl_{stamp}_{profile}.sqlite"))
+                for profile in ("full", load_profile)
+            }
+            try:
+                compare_load_profiles(crawlers, filtered_sites[:int(args["--compare-profile"])], cmp_hints)
+            finally:
+                for crawler in crawlers.values():
+                    crawler.browser_pool.close()
+                    crawler.remove_profiles()
+            for profile, crawler in crawlers.items():
+                print(f"Database of {profile}: {crawler.db_path}")
+            return 0
         
-        # Print summary
-        print("\n" + "="*50)
-        print("CONSENT CRAWL SUMMARY")
-        print("="*50)
-        print(f"Total domains: {results['total_domains']}")
-        print(f"Successful crawls: {results['successful_crawls']}")
-        print(f"Failed crawls: {results['failed_crawls']}")
-        print(f"Total cookies collected: {results['total_cookies']}")
-        print(f"Domains with consent data: {results['domains_with_consent_data']}")
-        print(f"Crawl time: {results['crawl_time_seconds']:.2f} seconds")
+        if browser_profiles:
+            # One crawler per browser profile, all writing to the database of the first
+            crawlers = {}
+            db_path = args.get("--db")
+            for name in browser_profiles:
+                crawlers[name] = make_crawler(load_profile, name, db_path)
+                db_path = crawlers[name].db_path
+            domains_by_profile = {name: [url for url in filtered_sites
+                                         if domain_key(url) not in finished_by_profile.get(name, set())]
+                                  for name in browser_profiles}
+            all_results = crawl_browser_profiles(crawlers, domains_by_profile, cmp_hints=cmp_hints,
+                                                 seen_filter=seen_filter, defer_seen=defer_seen,
+                                                 time_budget=time_budget)
+            for name, results in all_results.items():
+                print_summary(results, f"CONSENT CRAWL SUMMARY: {name}", db_path)
+            return 0
         
-        if results.get('cmp_types'):
-            print(f"\nCMP Distribution:")
-            for cmp_type, count in results['cmp_types'].items():
-                print(f"  {cmp_type}: {count}")
+        crawler = make_crawler(load_profile)
         
-        print(f"\nDatabase location: {crawler.db_path}")
-        print("="*50)
+        # Run the crawl
+        results = crawler.crawl_domains(filtered_sites, cmp_hints=cmp_hints,
+                                        seen_filter=seen_filter, defer_seen=defer_seen,
+                                        time_budget=time_budget)
         
+        print_summary(results, "CONSENT CRAWL SUMMARY", crawler.db_path)
         return 0
         
     except KeyboardInterrupt:
@@ -99,6 +418,12 @@ def main():
         print(f"Error during crawl: {e}", file=sys.stderr)
         logging.exception("Detailed error information:")
         return 1
+    finally:
+        if asset_cache is not None:
+            asset_cache.stop()
+            stats = asset_cache.stats()
+            print(f"Asset cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['bytes_served'] / (1024 * 1024):.1f} MB served from cache")
 
 
 if __name__ == "__main__":
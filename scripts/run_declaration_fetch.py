@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Fetch the cookie declarations of Cookiebot and OneTrust sites directly from the CMP's CDN,
+without a browser, using the site IDs found by a presence crawl.
+
+Usage:
+    run_declaration_fetch.py -r <ppath>... [-n <NUM>] [--db <DBPATH>] [--timeout <SECONDS>]
+        [--language <LANG>] [--cookiebot-cdn <URL>] [--onetrust-cdn <URL>]
+    run_declaration_fetch.py -h | --help
+
+Options:
+    -r --presence <ppath>       Presence crawl output (results directory or cmp_site_ids.csv).
+    -n --numthreads <NUM>       Number of concurrent requests. [default: 16]
+    --db <DBPATH>               Write to this database instead of a new timestamped one in
+                                data/results, creating it if needed.
+    --timeout <SECONDS>         Timeout of each request. [default: 30]
+    --language <LANG>           Preferred language of OneTrust declarations. [default: en]
+    --cookiebot-cdn <URL>       Base URL serving Cookiebot cc.js files, e.g. a local stand-in server.
+                                [default: https://consent.cookiebot.com]
+    --onetrust-cdn <URL>        Base URL serving OneTrust consent files. [default: https://cdn.cookielaw.org]
+    -h --help                   Display this help message.
+
+Examples:
+    python scripts/run_declaration_fetch.py -r data/results
+    python scripts/run_declaration_fetch.py -r data/results -n 32 --db data/results/consent_crawl.sqlite
+"""
+
+import sys
+import os
+import logging
+from datetime import datetime
+from docopt import docopt
+
+# Add src to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from crawlers.shared_utils import setup_output_directory, retrieve_cmp_site_ids
+from crawlers.declaration_fetcher import DeclarationFetcher
+
+
+def main():
+    """Main function for the declaration fetcher"""
+    args = docopt(__doc__)
+
+    # Set up logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    site_ids = retrieve_cmp_site_ids(args["--presence"])
+    if not site_ids:
+        print("Error: No CMP site IDs found. Please check the presence crawl output.", file=sys.stderr)
+        return 1
+
+    db_path = args.get("--db")
+    if not db_path:
+        output_dir = setup_output_directory("./data/results")
+        db_path = os.path.join(output_dir, f"declarations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sqlite")
+
+    fetcher = DeclarationFetcher(
+        num_threads=int(args["--numthreads"]),
+        timeout=float(args["--timeout"]),
+        cdn_bases={"cookiebot": args["--cookiebot-cdn"].rstrip("/"),
+                   "onetrust": args["--onetrust-cdn"].rstrip("/")},
+        language=args["--language"]
+    )
+
+    print(f"Fetching declarations of {len(site_ids)} sites with {fetcher.num_threads} threads")
+    try:
+        stats = fetcher.fetch_all(site_ids, db_path)
+    except KeyboardInterrupt:
+        print("\nFetch interrupted by user")
+        return 1
+
+    print("\n" + "="*50)
+    print("DECLARATION FETCH SUMMARY")
+    print("="*50)
+    print(f"Total sites: {stats['total_sites']}")
+    print(f"Fetched: {stats['fetched']} ({stats['empty']} without declarations)")
+    print(f"Failed: {stats['failed']}")
+    print(f"Declarations: {stats['declarations']}")
+    for cmp_type, count in stats['cmp_types'].items():
+        print(f"  {cmp_type}: {count}")
+    print(f"\nDatabase location: {db_path}")
+    print("="*50)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -3,21 +3,42 @@
 Fast presence crawl to check whether websites use supported CMPs.
 
 Usage:
-    run_presence_crawl.py -n <NUM> (-f <fpath> | -u <url> | -p <fpkl> | -c <csvpath>)... [-b <BCOUNT>]
+    run_presence_crawl.py -n <NUM> (-f <fpath> | -u <url> | -p <fpkl> | -c <csvpath>)... [-b <BCOUNT>] [-s <SCOUNT>] [--cookies]
+        [--seen <SEENFILE> [--seen-days <DAYS>] [--seen-fpr <RATE>] [--defer-seen]]
+        [--prioritize [--eu] [--prior <ppath>]...] [--time-budget <SECONDS>]
     run_presence_crawl.py -h | --help
 
 Options:
     -n --numthreads <NUM>       Number of worker processes.
     -b --batches <BCOUNT>       Number of batches to split the input into. [default: 1]
+    -s --scan-scripts <SCOUNT>  External scripts to scan per page when no CMP is found inline,
+                                e.g. tag manager containers. Cached by url for the run. [default: 0]
+    --cookies                   Record the Set-Cookie headers of the redirect chain into
+                                presence_cookies_<timestamp>.sqlite (consent crawl schema).
     -u --url <u>                Domain string to check for reachability.
     -p --pkl <fpkl>             Path to pickled domains.
     -f --file <fpath>           Path to file containing one domain per line.
     -c --csv <csvpath>          Path to csv containing domains in second column. Separator is ",".
+    --seen <SEENFILE>           Seen-domain filter file, shared across runs. Domains crawled within
+                                its freshness window are skipped, newly crawled domains are added.
+    --seen-days <DAYS>          Freshness window of a new seen-domain filter. Its halves expire
+                                whole, so domains are remembered for 1 to 1.5 times as long.
+                                [default: 30]
+    --seen-fpr <RATE>           False-positive rate of a new seen-domain filter. [default: 0.01]
+    --defer-seen                Crawl recently seen domains last instead of skipping them.
+    --prioritize                Crawl in order of priority score (rank, prior CMP likelihood, TLD,
+                                cluster representatives) instead of alphabetically.
+    --eu                        With --prioritize, boost EU/EEA and UK country-code TLDs.
+    --time-budget <SECONDS>     Stop cleanly after this many seconds; with --prioritize, the
+                                highest-scoring domains are crawled first.
+    --prior <ppath>             With --prioritize, earlier presence output (results directory or
+                                presence_results.csv) used as prior CMP likelihood.
     -h --help                   Display this help message.
 
 Examples:
     python scripts/run_presence_crawl.py -n 4 -f data/domains/sample_domains.txt
     python scripts/run_presence_crawl.py -n 8 -u https://example.com -u https://test.org
+    python scripts/run_presence_crawl.py -n 8 -f data/domains/sample_domains.txt -s 5
 """
 
 import sys
@@ -28,8 +49,10 @@ from docopt import docopt
 # Add src to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from crawlers.shared_utils import retrieve_cmdline_urls, filter_bad_urls_and_sort, setup_output_directory
+from crawlers.shared_utils import (retrieve_cmdline_urls, filter_bad_urls_and_sort, setup_output_directory,
+                                   retrieve_seen_filter, retrieve_csv_ranks, retrieve_presence_verdicts)
 from crawlers.presence_crawler import PresenceCrawler
+from crawlers.scheduler import CrawlScheduler, EU_TLDS
 
 
 def main():
@@ -43,19 +66,30 @@ def main():
     )
     
     # Retrieve and process URLs
-    sites = retrieve_cmdline_urls(args)
+    seen_filter = retrieve_seen_filter(args)
+    defer_seen = args.get("--defer-seen", False)
+    sites = retrieve_cmdline_urls(args, seen_filter=None if defer_seen else seen_filter)
     filtered_sites = filter_bad_urls_and_sort(sites)
     
     if not filtered_sites:
         print("Error: No valid domains to crawl. Please check your input.", file=sys.stderr)
         return 1
     
+    if args.get("--prioritize"):
+        scheduler = CrawlScheduler(ranks=retrieve_csv_ranks(args),
+                                   verdicts=retrieve_presence_verdicts(args.get("--prior") or []),
+                                   boosted_tlds=EU_TLDS if args.get("--eu") else None)
+        filtered_sites = scheduler.order(filtered_sites)
+    time_budget = float(args["--time-budget"]) if args.get("--time-budget") else None
+    
     # Set up crawler
     num_threads = int(args["--numthreads"])
     batches = int(args.get("--batches", 1))
+    scan_scripts = int(args.get("--scan-scripts", 0))
     
     output_dir = setup_output_directory("./data/results")
-    crawler = PresenceCrawler(num_threads=num_threads, output_dir=output_dir)
+    crawler = PresenceCrawler(num_threads=num_threads, output_dir=output_dir,
+                              scan_scripts=scan_scripts, harvest_cookies=args.get("--cookies", False))
     
     print(f"Starting presence crawl of {len(filtered_sites)} domains")
     print(f"Using {num_threads} threads and {batches} batches")
@@ -63,7 +97,9 @@ def main():
     
     try:
         # Run the crawl
-        results = crawler.crawl_domains(filtered_sites, batches=batches)
+        results = crawler.crawl_domains(filtered_sites, batches=batches,
+                                        seen_filter=seen_filter, defer_seen=defer_seen,
+                                        time_budget=time_budget)
         
         # Save results
         crawler.save_results(results)
@@ -75,6 +111,10 @@ def main():
         for result_type, urls in results.items():
             if result_type != 'uncrawled':
                 print(f"{result_type.capitalize()}: {len(urls)}")
+        if results.get('uncrawled'):
+            print(f"Not crawled (interrupted or out of time): {len(results['uncrawled'])}")
+        if crawler.cookie_db_path:
+            print(f"Set-Cookie database: {crawler.cookie_db_path}")
         print("="*50)
         
         return 0
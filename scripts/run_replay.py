@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Replay the declaration extractors and the purpose label mapping over the snapshots
+recorded by a consent crawl (run_consent_crawl.py --record), without a browser.
+
+Usage:
+    run_replay.py <SNAPSHOTS> [-n <NUM>] [--cmp <CMP>] [--db <DBPATH>] [--crawl-db <CPATH>] [--changed]
+    run_replay.py -h | --help
+
+Options:
+    <SNAPSHOTS>                 Snapshot store of a crawl (<crawl database>_snapshots.sqlite).
+    -n --numprocs <NUM>         Number of worker processes, all cores if 0. [default: 0]
+    --cmp <CMP>                 Only replay visits of this CMP type (cookiebot, onetrust, termly).
+    --db <DBPATH>               Write the replayed results with their cookies to this crawl
+                                database, e.g. for src/database/extract_cookies.py. Rows keep the
+                                profile of their visit, so this must not be the crawl database
+                                the snapshots were recorded with.
+    --crawl-db <CPATH>          Crawl database the snapshots were recorded with, to count visits
+                                without a snapshot. Defaults to <SNAPSHOTS> without "_snapshots".
+    --changed                   List the visits whose replayed declarations differ from the
+                                recorded ones.
+    -h --help                   Display this help message.
+
+Examples:
+    python scripts/run_replay.py data/results/consent_crawl_20240101_120000_snapshots.sqlite
+    python scripts/run_replay.py data/results/consent_crawl_snapshots.sqlite --cmp termly --changed
+"""
+
+import sys
+import os
+import time
+import logging
+from functools import partial
+from docopt import docopt
+from pebble import ProcessPool
+
+# Add src and the project root (for config) to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from crawlers.replay import replay_snapshots
+from crawlers.result_writer import connect_wal, write_results
+from crawlers.shared_utils import init_crawl_database, CrawlResult
+from crawlers.snapshot_store import snapshot_ids, crawl_database_path, missing_snapshot_ids
+from database.extract_cookies import CookieExtractor
+from config import crawler_config
+
+# Snapshots replayed per task of a worker process
+REPLAY_CHUNK_SIZE = 200
+
+
+def main():
+    """Main function for the replay of consent crawl snapshots"""
+    args = docopt(__doc__)
+
+    # Set up logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    store_path = args["<SNAPSHOTS>"]
+    if not os.path.exists(store_path):
+        print(f"Error: Snapshot store not found: {store_path}", file=sys.stderr)
+        return 1
+
+    crawl_db = args.get("--crawl-db") or crawl_database_path(store_path)
+    if crawl_db and not os.path.exists(crawl_db):
+        if args.get("--crawl-db"):
+            print(f"Error: Crawl database not found: {crawl_db}", file=sys.stderr)
+            return 1
+        crawl_db = ""
+    db_path = args.get("--db")
+    if db_path and os.path.exists(db_path) and any(
+            path and os.path.samefile(db_path, path) for path in (crawl_db, store_path)):
+        print(f"Error: Replayed results would be mixed with the recorded visits in {db_path}, "
+              f"use another --db", file=sys.stderr)
+        return 1
+
+    crawl_ids = snapshot_ids(store_path, args.get("--cmp"))
+    if not crawl_ids:
+        print("Error: No snapshots to replay.", file=sys.stderr)
+        return 1
+
+    num_procs = int(args["--numprocs"]) or os.cpu_count() or 1
+    chunks = [crawl_ids[i:i + REPLAY_CHUNK_SIZE] for i in range(0, len(crawl_ids), REPLAY_CHUNK_SIZE)]
+    replay = partial(replay_snapshots, store_path, CookieExtractor._map_purpose_category,
+                     with_cookies=bool(db_path))
+
+    print(f"Replaying {len(crawl_ids)} snapshots with {num_procs} processes")
+    started = time.time()
+    results = []
+    with ProcessPool(max_workers=num_procs) as pool:
+        for chunk_results in pool.map(replay, chunks).result():
+            results.extend(chunk_results)
+    elapsed = time.time() - started
+
+    if db_path:
+        init_crawl_database(db_path)
+        conn = connect_wal(db_path)
+        try:
+            write_results(conn, [CrawlResult(domain=r["domain"], success=True, cmp_type=r["cmp_type"],
+                                             cookies_collected=len(r["cookies"]), consent_data=r["consent_data"],
+                                             cookies=r["cookies"], pre_consent_cookies=r["pre_consent_cookies"],
+                                             profile=r["profile"])
+                                 for r in results])
+        finally:
+            conn.close()
+
+    # Visits of the whole crawl, not only of --cmp, lack a snapshot if writing it failed
+    missing = missing_snapshot_ids(store_path, crawl_db) if crawl_db else None
+    if missing:
+        logging.warning(f"{len(missing)} successful visits have no snapshot and were not replayed")
+
+    changed = [r for r in results if r["added"] or r["removed"]]
+    labels = {}
+    for r in results:
+        for row in r["consent_data"]:
+            name = crawler_config.PURPOSE_CATEGORIES.get(row["label"], "unknown")
+            labels[name] = labels.get(name, 0) + 1
+    banners_found = sum(r["banner_found"] for r in results)
+    banners_visible = sum(bool(r["verdicts"].get("banner_visible")) for r in results)
+
+    if args.get("--changed"):
+        for r in changed:
+            print(f"\n{r['domain']} ({r['cmp_type']}, crawl {r['crawl_id']}): "
+                  f"{r['recorded_rows']} recorded, +{len(r['added'])} -{len(r['removed'])}")
+            for name, domain, category in r["added"]:
+                print(f"  + {name} | {domain} | {category}")
+            for name, domain, category in r["removed"]:
+                print(f"  - {name} | {domain} | {category}")
+
+    print("\n" + "="*50)
+    print("REPLAY SUMMARY")
+    print("="*50)
+    print(f"Snapshots replayed: {len(results)} in {elapsed:.2f} seconds")
+    print(f"Declarations: {sum(len(r['consent_data']) for r in results)} replayed, "
+          f"{sum(r['recorded_rows'] for r in results)} recorded")
+    print(f"Visits with changed declarations: {len(changed)}")
+    print(f"Banners found in the regions: {banners_found} (visible during the crawl: {banners_visible})")
+    if missing is not None:
+        print(f"Successful visits without a snapshot: {len(missing)}"
+              + (f" (crawl ids {', '.join(map(str, missing[:10]))}{', ...' if len(missing) > 10 else ''})"
+                 if missing else ""))
+    else:
+        print("Successful visits without a snapshot: unknown, crawl database not found (see --crawl-db)")
+    if len(results) < len(crawl_ids):
+        print(f"Snapshots that could not be replayed: {len(crawl_ids) - len(results)}")
+    if labels:
+        print(f"\nLabel Distribution:")
+        for name, count in sorted(labels.items(), key=lambda item: -item[1]):
+            print(f"  {name}: {count}")
+    if db_path:
+        print(f"\nDatabase location: {db_path}")
+    print("="*50)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
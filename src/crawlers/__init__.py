@@ -1,11 +1,13 @@
 from .shared_utils import retrieve_cmdline_urls, filter_bad_urls_and_sort
 from .presence_crawler import PresenceCrawler, QuickCrawlResult
 from .consent_crawler import ConsentCrawler
+from .seen_filter import SeenDomainFilter
 
 __all__ = [
     "retrieve_cmdline_urls",
     "filter_bad_urls_and_sort", 
     "PresenceCrawler",
     "QuickCrawlResult",
-    "ConsentCrawler"
+    "ConsentCrawler",
+    "SeenDomainFilter"
 ]
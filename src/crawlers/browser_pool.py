@@ -0,0 +1,225 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import psutil
+from selenium import webdriver
+
+logger = logging.getLogger("consent-crawl")
+
+# Clear-data flags used to reset a browser between visits. Looked up by name in the
+# browser, since the available flags differ between Firefox versions.
+RESET_CLEAR_FLAGS = [
+    "CLEAR_COOKIES",
+    "CLEAR_DOM_STORAGES",
+    "CLEAR_ALL_CACHES",
+    "CLEAR_AUTH_TOKENS",
+    "CLEAR_AUTH_CACHE",
+    "CLEAR_STORAGE_ACCESS",
+    "CLEAR_CLIENT_AUTH_REMEMBER_SERVICE"
+]
+
+# Runs in the privileged (chrome) context of Firefox
+RESET_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const flags = arguments[0].reduce((f, name) => f | (Ci.nsIClearDataService[name] || 0), 0);
+Services.clearData.deleteData(flags, { onDataDeleted: (failed) => done(failed) });
+"""
+
+
+@dataclass
+class PooledDriver:
+    """A long-lived driver with its usage counters"""
+    driver: webdriver.Firefox
+    created: float = field(default_factory=time.time)
+    pages: int = 0
+
+
+class BrowserPool:
+    """
+    Pool of long-lived Firefox drivers. Drivers are reset between domains (tabs,
+    cookies, storage and caches) instead of being restarted, and are recycled
+    after max_pages visits, when the browser exceeds max_memory_mb, or after any error.
+    
+    The pool keeps up to `spares` freshly started drivers ready, started in the
+    background, so that replacing a driver does not wait for a Firefox launch.
+    """
+
+    def __init__(self, create_driver: Callable[[], webdriver.Firefox],
+                 max_pages: int = 50, max_memory_mb: int = 2048, spares: int = 0,
+                 on_quit: Optional[Callable[[webdriver.Firefox], None]] = None):
+        """
+        @param create_driver: factory for new drivers
+        @param max_pages: visits after which a driver is replaced
+        @param max_memory_mb: resident memory of the browser process tree above which it is replaced
+        @param spares: number of warm spare drivers to keep ready
+        @param on_quit: called with each driver once it has been shut down
+        """
+        self.create_driver = create_driver
+        self.on_quit = on_quit
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.spares = spares
+        self._idle: List[PooledDriver] = []
+        self._spares: "queue.Queue[PooledDriver]" = queue.Queue()
+        self._spares_pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closing = False
+        self._lock = threading.Lock()
+        self.started = 0
+        self.recycled = 0
+        self.spares_used = 0
+
+    def _start_driver(self) -> PooledDriver:
+        """Start a new driver"""
+        pooled = PooledDriver(self.create_driver())
+        with self._lock:
+            self.started += 1
+        return pooled
+
+    def _start_spare(self) -> None:
+        """Background task: start a spare driver and add it to the spares queue"""
+        try:
+            pooled = self._start_driver()
+        except Exception as e:
+            logger.warning(f"Failed to start spare browser: {e}")
+            return
+        finally:
+            with self._lock:
+                self._spares_pending -= 1
+
+        if self._closing:
+            self.quit(pooled)
+        else:
+            self._spares.put(pooled)
+
+    def warm_up(self) -> None:
+        """Start launching spare drivers in the background, to be called before crawling"""
+        self._closing = False
+        self._replenish()
+
+    def _replenish(self) -> None:
+        """Schedule background launches until ready and pending spares reach the target"""
+        with self._lock:
+            if self._closing or self.spares <= 0:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.spares,
+                                                    thread_name_prefix="browser-spare")
+            missing = self.spares - self._spares.qsize() - self._spares_pending
+            for _ in range(max(0, missing)):
+                self._spares_pending += 1
+                self._executor.submit(self._start_spare)
+
+    def acquire(self) -> PooledDriver:
+        """Take an idle driver, then a warm spare, and only start a new one if neither is available"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+        try:
+            pooled = self._spares.get_nowait()
+            with self._lock:
+                self.spares_used += 1
+        except queue.Empty:
+            pooled = None
+
+        # Replace the spare (or cover the shortfall) in the background
+        self._replenish()
+        return pooled if pooled is not None else self._start_driver()
+
+    def release(self, pooled: PooledDriver, failed: bool = False, visits: int = 1) -> None:
+        """
+        Return a driver after a visit. It is reset and kept for the next visit,
+        unless the visit failed or a recycling threshold is reached.
+        @param pooled: driver returned by acquire
+        @param failed: whether the visit raised an error
+        @param visits: number of visits made since acquire, e.g. in several tabs
+        """
+        pooled.pages += visits
+        reason = None
+        if failed:
+            reason = "error during visit"
+        elif pooled.pages >= self.max_pages:
+            reason = f"{pooled.pages} pages visited"
+        else:
+            memory_mb = self.driver_memory_mb(pooled.driver)
+            if memory_mb > self.max_memory_mb:
+                reason = f"{memory_mb:.0f} MB resident"
+
+        if reason is None:
+            try:
+                self.reset(pooled.driver)
+            except Exception as e:
+                reason = f"reset failed: {e}"
+
+        if reason is not None:
+            logger.debug(f"Recycling browser: {reason}")
+            with self._lock:
+                self.recycled += 1
+            self.quit(pooled)
+            self._replenish()
+            return
+
+        with self._lock:
+            self._idle.append(pooled)
+
+    def reset(self, driver: webdriver.Firefox) -> None:
+        """
+        Bring a driver back to a clean state: a single fresh tab on about:blank,
+        and cookies, site storage and caches cleared for all sites.
+        """
+        old_handles = driver.window_handles
+        driver.switch_to.new_window("tab")
+        fresh_handle = driver.current_window_handle
+        for handle in old_handles:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(fresh_handle)
+
+        with driver.context(driver.CONTEXT_CHROME):
+            failed = driver.execute_async_script(RESET_SCRIPT, RESET_CLEAR_FLAGS)
+        if failed:
+            logger.debug(f"Browser reset could not clear all data (flags {failed})")
+
+    @staticmethod
+    def driver_memory_mb(driver: webdriver.Firefox) -> float:
+        """Resident memory of the browser process tree (geckodriver, Firefox and its content processes)"""
+        try:
+            root = psutil.Process(driver.service.process.pid)
+            processes = [root] + root.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes if p.is_running()) / (1024 * 1024)
+        except (psutil.Error, AttributeError):
+            return 0.0
+
+    def quit(self, pooled: PooledDriver) -> None:
+        """Shut down a driver, ignoring errors from an already dead browser"""
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        if self.on_quit is not None:
+            self.on_quit(pooled.driver)
+
+    def close(self) -> None:
+        """Shut down all idle and spare drivers, waiting for spares still starting"""
+        with self._lock:
+            self._closing = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+        while not self._spares.empty():
+            idle.append(self._spares.get_nowait())
+        for pooled in idle:
+            self.quit(pooled)
+
+        if self.started:
+            logger.info(f"Browser pool closed: {self.started} browsers started, "
+                        f"{self.recycled} recycled, {self.spares_used} spares used")
@@ -0,0 +1,421 @@
+import os
+import re
+import ssl
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import http.client
+import ipaddress
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("consent-crawl")
+
+# Responses that may be cached: static scripts and stylesheets
+CACHEABLE_CONTENT_TYPES = ("javascript", "ecmascript", "text/css")
+CACHEABLE_EXTENSIONS = (".js", ".mjs", ".css")
+
+# Request headers that make a response specific to the visitor, never cached
+PRIVATE_REQUEST_HEADERS = ("cookie", "authorization", "range")
+
+# Headers that apply to a single connection, not forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "proxy-connection",
+    "te", "trailer", "transfer-encoding", "upgrade", "alt-svc"
+}
+
+# Subject and certutil nickname of the proxy CA
+CA_NAME = "consent-crawler asset cache CA"
+
+# Cached response: status, reason, headers, body
+CachedResponse = Tuple[int, str, List[Tuple[str, str]], bytes]
+
+
+def generate_ca(cert_dir: str) -> Tuple[str, str]:
+    """
+    Create the CA certificate of the proxy with openssl, which issues the certificate of
+    each intercepted host. Browsers using the proxy trust it, see install_ca_certificate.
+
+    @param cert_dir: directory to write the certificate and key to
+    @return: paths of the CA certificate and its key
+    """
+    cert_path = os.path.join(cert_dir, "ca.pem")
+    key_path = os.path.join(cert_dir, "ca-key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30",
+                    "-subj", f"/CN={CA_NAME}",
+                    "-addext", "basicConstraints=critical,CA:TRUE,pathlen:0",
+                    "-addext", "keyUsage=critical,keyCertSign,cRLSign",
+                    "-keyout", key_path, "-out", cert_path],
+                   check=True, capture_output=True)
+    return cert_path, key_path
+
+
+def issue_certificate(cert_dir: str, ca: Tuple[str, str], key_path: str, host: str) -> str:
+    """
+    Issue the certificate of one intercepted host, signed by the proxy CA.
+
+    @param cert_dir: directory to write the certificate to
+    @param ca: paths of the CA certificate and its key, see generate_ca
+    @param key_path: key of the host certificates, shared by all hosts
+    @param host: hostname or IP address the certificate is valid for
+    @return: path of the certificate
+    """
+    name = re.sub(r"[^a-z0-9.-]", "_", host.lower())
+    csr_path = os.path.join(cert_dir, f"{name}.csr")
+    ext_path = os.path.join(cert_dir, f"{name}.ext")
+    cert_path = os.path.join(cert_dir, f"{name}.pem")
+    try:
+        san = f"IP:{ipaddress.ip_address(host)}"
+    except ValueError:
+        san = f"DNS:{host}"
+    with open(ext_path, "w") as fd:
+        fd.write(f"subjectAltName={san}\nextendedKeyUsage=serverAuth\n"
+                 f"basicConstraints=critical,CA:FALSE\n")
+    subprocess.run(["openssl", "req", "-new", "-key", key_path, "-subj", "/CN=" + host[:64], "-out", csr_path],
+                   check=True, capture_output=True)
+    subprocess.run(["openssl", "x509", "-req", "-in", csr_path, "-CA", ca[0], "-CAkey", ca[1],
+                    "-set_serial", str(int.from_bytes(os.urandom(16), "big") >> 1), "-days", "30",
+                    "-extfile", ext_path, "-out", cert_path],
+                   check=True, capture_output=True)
+    return cert_path
+
+
+def install_ca_certificate(profile_dir: str, ca_cert_path: str) -> None:
+    """
+    Trust the proxy CA for websites in a Firefox profile, by adding it to the profile's
+    certificate database (cert9.db) with NSS certutil. The trust is limited to browsers
+    running on this profile.
+
+    @param profile_dir: Firefox profile directory, its certificate database is created if missing
+    @param ca_cert_path: CA certificate, see generate_ca
+    """
+    db = f"sql:{profile_dir}"
+    if not os.path.exists(os.path.join(profile_dir, "cert9.db")):
+        subprocess.run(["certutil", "-N", "--empty-password", "-d", db], check=True, capture_output=True)
+    subprocess.run(["certutil", "-A", "-n", CA_NAME, "-t", "C,,", "-i", ca_cert_path, "-d", db],
+                   check=True, capture_output=True)
+
+
+def is_cacheable_response(path: str, status: int, headers: List[Tuple[str, str]]) -> bool:
+    """
+    Whether an upstream response is a static script or stylesheet that can be replayed
+    to any visit: a 200 without cookies and without private or no-store caching.
+    """
+    if status != 200:
+        return False
+    fields = {name.lower(): value.lower() for name, value in headers}
+    if "set-cookie" in fields or "set-cookie2" in fields:
+        return False
+    cache_control = fields.get("cache-control", "")
+    if "no-store" in cache_control or "private" in cache_control:
+        return False
+    vary = {v.strip() for v in fields.get("vary", "").split(",") if v.strip()}
+    if vary - {"accept-encoding", "origin"}:
+        return False
+    content_type = fields.get("content-type", "")
+    return (any(t in content_type for t in CACHEABLE_CONTENT_TYPES)
+            or urlsplit(path).path.lower().endswith(CACHEABLE_EXTENSIONS))
+
+
+class AssetCache:
+    """In-memory LRU cache of responses, bounded by the total size of the bodies"""
+
+    def __init__(self, max_bytes: int):
+        """
+        @param max_bytes: total size of cached bodies above which the least recently used are evicted
+        """
+        self.max_bytes = max_bytes
+        # A single large response may not take more than a share of the cache
+        self.max_entry_bytes = max_bytes // 16
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.bytes_served = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Cached response for a key, marked as most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_served += len(entry[3])
+            return entry
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        """Cache a response, evicting the least recently used ones to stay within max_bytes"""
+        size = len(response[3])
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[3])
+            self._entries[key] = response
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[3])
+                self.evicted += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """Total size of the cached bodies in bytes"""
+        return self._size
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    """
+    Forward proxy handler. HTTPS requests are intercepted after CONNECT: the tunnel is
+    terminated with a certificate for the host, chosen by SNI, and its requests are
+    handled like plain ones.
+    """
+    protocol_version = "HTTP/1.1"
+    _tunnel: Optional[Tuple[str, int]] = None
+
+    def log_message(self, format, *args):
+        logger.debug("Asset cache: " + format % args)
+
+    def do_CONNECT(self):
+        host, _, port = self.path.rpartition(":")
+        self.send_response(200, "Connection Established")
+        self.end_headers()
+        self.wfile.flush()
+
+        # Clients send no SNI for IP addresses, the CONNECT target picks the certificate then
+        context = self.server.proxy.host_context(host.strip("[]"))
+        self.connection = context.wrap_socket(self.connection, server_side=True)
+        self.rfile = self.connection.makefile("rb", self.rbufsize)
+        self.wfile = self.connection.makefile("wb")
+        self._tunnel = (host.strip("[]"), int(port or 443))
+        self.close_connection = False
+
+    def _forward(self):
+        """Answer a request from the cache, or forward it upstream and cache the response if allowed"""
+        if self._tunnel is not None:
+            scheme = "https"
+            host, port = self._tunnel
+            path = self.path
+        else:
+            url = urlsplit(self.path)
+            scheme = url.scheme or "http"
+            host = url.hostname or ""
+            port = url.port or (443 if scheme == "https" else 80)
+            path = url.path + (f"?{url.query}" if url.query else "") or "/"
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        headers = [(name, value) for name, value in self.headers.items()
+                   if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != "content-length"]
+
+        proxy = self.server.proxy
+        key = None
+        if self.command == "GET" and not any(name.lower() in PRIVATE_REQUEST_HEADERS for name, _ in headers):
+            key = "|".join((f"{scheme}://{host}:{port}{path}", self.headers.get("Accept-Encoding", ""),
+                            self.headers.get("Origin", "")))
+            cached = proxy.cache.get(key)
+            if cached is not None:
+                self._reply(*cached)
+                return
+
+        try:
+            response = proxy.fetch(scheme, host, port, self.command, path, headers, body)
+        except (OSError, http.client.HTTPException) as e:
+            logger.debug(f"Asset cache: upstream request to {host} failed: {e}")
+            self.send_error(502, "Upstream request failed")
+            return
+
+        if key is not None and is_cacheable_response(path, response[0], response[2]):
+            proxy.cache.put(key, response)
+        self._reply(*response)
+
+    def _reply(self, status: int, reason: str, headers: List[Tuple[str, str]], body: bytes):
+        """Send a complete response, with the body length set explicitly"""
+        self.send_response(status, reason)
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered in HOP_BY_HOP_HEADERS or (lowered == "content-length" and self.command != "HEAD"):
+                continue
+            self.send_header(name, value)
+        if self.command != "HEAD":
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_HEAD = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = _forward
+
+
+class _ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    proxy: "CachingProxy"
+
+    def handle_error(self, request, client_address):
+        # Aborted tunnels and handshakes are routine while pages are stopped
+        logger.debug(f"Asset cache: connection from {client_address} failed", exc_info=True)
+
+
+class CachingProxy:
+    """
+    Local forward proxy shared by all browsers of a crawl, which caches static
+    third-party scripts and stylesheets (CMP loaders, tag managers, analytics
+    libraries) across browsers and visits.
+
+    Only responses to GET requests without cookies, that set no cookies themselves,
+    are cached; all other requests are forwarded unchanged. HTTPS is intercepted with a
+    certificate per host issued by a CA of the proxy, which the browsers must trust
+    (see install_ca_certificate and ca_cert_path).
+    """
+
+    def __init__(self, max_cache_mb: int = 256, host: str = "127.0.0.1", port: int = 0,
+                 upstream_timeout: float = 30):
+        """
+        @param max_cache_mb: size of the cache in MB
+        @param host: address to listen on
+        @param port: port to listen on, any free port if 0
+        @param upstream_timeout: seconds before an upstream request fails
+        """
+        self.cache = AssetCache(max_cache_mb * 1024 * 1024)
+        self.host = host
+        self.port = port
+        self.upstream_timeout = upstream_timeout
+        self._upstream_context = ssl.create_default_context()
+        self._connections = threading.local()
+        self._server: Optional[_ProxyServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._cert_dir: Optional[str] = None
+        self._ca: Optional[Tuple[str, str]] = None
+        self._host_key: Optional[str] = None
+        self._host_contexts: Dict[str, ssl.SSLContext] = {}
+        self._host_lock = threading.Lock()
+
+    @property
+    def address(self) -> str:
+        """host:port of the running proxy, for proxy configurations"""
+        return f"{self.host}:{self.port}"
+
+    @property
+    def ca_cert_path(self) -> Optional[str]:
+        """CA certificate of the running proxy, to be trusted by the browsers"""
+        return self._ca[0] if self._ca else None
+
+    def start(self) -> None:
+        """Create the CA and start serving on a background thread"""
+        self._cert_dir = tempfile.mkdtemp(prefix="consent-asset-cache-")
+        self._ca = generate_ca(self._cert_dir)
+        self._host_key = os.path.join(self._cert_dir, "host-key.pem")
+        subprocess.run(["openssl", "genpkey", "-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048",
+                        "-out", self._host_key], check=True, capture_output=True)
+
+        self._server = _ProxyServer((self.host, self.port), _ProxyHandler)
+        self._server.proxy = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="asset-cache", daemon=True)
+        self._thread.start()
+        logger.info(f"Asset cache proxy listening on {self.address}, "
+                    f"{self.cache.max_bytes // (1024 * 1024)} MB")
+
+    def host_context(self, host: str) -> ssl.SSLContext:
+        """TLS context with the certificate of a host, issued on first use"""
+        with self._host_lock:
+            context = self._host_contexts.get(host)
+            if context is None:
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                context.load_cert_chain(issue_certificate(self._cert_dir, self._ca, self._host_key, host),
+                                        self._host_key)
+                context.sni_callback = self._select_certificate
+                self._host_contexts[host] = context
+            return context
+
+    def _select_certificate(self, ssl_socket: ssl.SSLObject, server_name: Optional[str],
+                            context: ssl.SSLContext) -> None:
+        """SNI callback: present the certificate of the requested host"""
+        if not server_name:
+            return
+        try:
+            ssl_socket.context = self.host_context(server_name)
+        except (OSError, ssl.SSLError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Asset cache: no certificate for {server_name}: {e}")
+
+    def stop(self) -> None:
+        """Stop serving and remove the certificates"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._cert_dir is not None:
+            shutil.rmtree(self._cert_dir, ignore_errors=True)
+            self._cert_dir = None
+            self._ca = None
+            self._host_contexts = {}
+        logger.info(f"Asset cache proxy stopped: {self.stats()}")
+
+    def stats(self) -> Dict[str, int]:
+        """Cache hits, misses, evictions, bytes served from the cache and current size"""
+        return {
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "evicted": self.cache.evicted,
+            "bytes_served": self.cache.bytes_served,
+            "entries": len(self.cache),
+            "size_bytes": self.cache.size
+        }
+
+    def _connection(self, scheme: str, host: str, port: int, fresh: bool) -> http.client.HTTPConnection:
+        """Upstream connection of the current handler thread, reused across requests"""
+        pool = getattr(self._connections, "pool", None)
+        if pool is None:
+            pool = self._connections.pool = {}
+        key = (scheme, host, port)
+        conn = pool.get(key)
+        if conn is not None and fresh:
+            conn.close()
+            conn = None
+        if conn is None:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(host, port, timeout=self.upstream_timeout,
+                                                   context=self._upstream_context)
+            else:
+                conn = http.client.HTTPConnection(host, port, timeout=self.upstream_timeout)
+            pool[key] = conn
+        return conn
+
+    def fetch(self, scheme: str, host: str, port: int, method: str, path: str,
+              headers: List[Tuple[str, str]], body: Optional[bytes]) -> CachedResponse:
+        """
+        Forward a request upstream and read the complete response.
+        A reused connection closed by the server is retried once on a new connection.
+
+        @return: status, reason, headers and body of the response
+        """
+        for attempt in range(2):
+            conn = self._connection(scheme, host, port, fresh=attempt > 0)
+            try:
+                conn.putrequest(method, path, skip_host=True, skip_accept_encoding=True)
+                for name, value in headers:
+                    conn.putheader(name, value)
+                if body is not None:
+                    conn.putheader("Content-Length", str(len(body)))
+                conn.endheaders(body)
+                response = conn.getresponse()
+                data = response.read()
+                return response.status, response.reason, response.getheaders(), data
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if attempt:
+                    raise
+            except Exception:
+                conn.close()
+                raise
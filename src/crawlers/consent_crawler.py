@@ -1,54 +1,447 @@
 import logging
+import re
 import time
 import sqlite3
 import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import importlib
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
+from urllib.parse import quote
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator
 
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import WebDriverException, TimeoutException
 from webdriver_manager.firefox import GeckoDriverManager
 from selenium.webdriver.firefox.service import Service
 
+from .shared_utils import init_crawl_database, CrawlResult
+from .seen_filter import SeenDomainFilter, apply_seen_filter, domain_key
+from .browser_pool import BrowserPool
+from .result_writer import ResultWriter, connect_wal, write_results
+from .supervisor import SupervisedProcess, reap_orphaned_browsers
+from .cookie_store import read_cookie_store, merge_cookie_jars
+from .caching_proxy import install_ca_certificate
+from .declaration_extractors import extract_declarations
+from .snapshot_store import snapshot_store_path, init_snapshot_store, write_snapshots
+
 logger = logging.getLogger("consent-crawl")
 
+# CMP types that can be passed as a hint from the presence crawl
+KNOWN_CMP_TYPES = ("cookiebot", "onetrust", "termly")
+
+# Detects the CMP of the page from the globals, elements and script sources it leaves behind
+CMP_PROBE_SCRIPT = """
+const srcs = Array.from(document.querySelectorAll("script[src], iframe[src]"), (el) => el.src.toLowerCase());
+const hasSrc = (pattern) => srcs.some((src) => pattern.test(src));
+if (window.Cookiebot || document.getElementById("CybotCookiebotDialog")
+        || hasSrc(/consent\\.cookiebot\\.(com|eu)\\/|cb-main\\.js/)) {
+    return "cookiebot";
+}
+if (window.OneTrust || window.Optanon || typeof window.OptanonActiveGroups === "string"
+        || document.getElementById("onetrust-consent-sdk")
+        || hasSrc(/onetrust\\.com|cookielaw\\.org|optanon|cookiepro\\.com/)) {
+    return "onetrust";
+}
+if (window.Termly || window.TERMLY_CUSTOM_BLOCKING_MAP
+        || document.getElementById("termly-code-snippet-support")
+        || hasSrc(/app\\.termly\\.io\\//)) {
+    return "termly";
+}
+return "unknown";
+"""
+
+# Probe together with the loading state of the document, polled while the page loads
+CMP_PROBE_READY_SCRIPT = "const cmp = (() => {" + CMP_PROBE_SCRIPT + "})();\nreturn [cmp, document.readyState];"
+
+# Scripts returning true once the CMP script has loaded and initialised
+CMP_LOADED_SCRIPTS = {
+    "cookiebot": "return typeof window.Cookiebot === 'object' && window.Cookiebot !== null;",
+    "onetrust": "return typeof window.OneTrust === 'object' || typeof window.OptanonActiveGroups === 'string';",
+    "termly": "return typeof window.Termly === 'object' || !!document.querySelector('[class*=\"termly-styles\"]');"
+}
+
+# Elements of the consent banner, visible once the CMP has rendered it
+CMP_BANNER_SELECTORS = {
+    "cookiebot": "#CybotCookiebotDialog",
+    "onetrust": "#onetrust-banner-sdk, #onetrust-pc-sdk",
+    "termly": "[class*='termly-styles'] [role='dialog'], #termly-code-snippet-support"
+}
+
+# Banner and declaration regions of all supported CMPs, serialized per visit for the
+# declaration extractors and recorded for replay
+SNAPSHOT_REGION_SELECTORS = ", ".join([
+    "#CybotCookiebotDialog", "#CookieDeclaration", ".CookieDeclaration", "[data-cookiefirst-category]",
+    "#onetrust-consent-sdk", "#onetrust-banner-sdk", "#onetrust-pc-sdk", "#ot-sdk-cookie-policy",
+    ".ot-sdk-cookie-policy", ".ot-sdk-cookie",
+    "[class*='termly']", "[id*='termly']"
+])
+
+# Upper bound on the size of the regions recorded for one visit
+SNAPSHOT_MAX_CHARS = 2 * 1024 * 1024
+
+# Serializes the outermost elements matching the region selector. Headings of tables
+# that lie outside their region (used by the Termly extractor) are kept as an attribute.
+SNAPSHOT_SCRIPT = """
+const [selector, maxChars] = arguments;
+const regions = [];
+let size = 0;
+const heading = (table, region) => {
+    for (let el = table; el && el !== document.body; el = el.parentElement) {
+        if (el !== region && region.contains(el)) continue;
+        for (let sib = el.previousElementSibling; sib; sib = sib.previousElementSibling) {
+            if (/^H[1-6]$/.test(sib.tagName)) return (sib.textContent || "").replace(/\\s+/g, " ").trim();
+        }
+    }
+    return "";
+};
+for (const el of document.querySelectorAll(selector)) {
+    if (el.parentElement && el.parentElement.closest(selector)) continue;
+    const clone = el.cloneNode(true);
+    const tables = el.tagName === "TABLE" ? [el] : Array.from(el.querySelectorAll("table"));
+    const cloned = el.tagName === "TABLE" ? [clone] : Array.from(clone.querySelectorAll("table"));
+    tables.forEach((table, i) => {
+        const outside = heading(table, el);
+        if (outside) cloned[i].setAttribute("data-snapshot-heading", outside);
+    });
+    const html = clone.outerHTML;
+    if (size + html.length > maxChars) break;
+    regions.push(html);
+    size += html.length;
+}
+return regions;
+"""
+
+# Consent buttons of the supported CMPs, tried before any keyword match
+CONSENT_BUTTON_SELECTORS = {
+    "accept": {
+        "cookiebot": ["#CybotCookiebotDialogBodyLevelButtonLevelOptinAllowAll",
+                      "#CybotCookiebotDialogBodyButtonAccept"],
+        "onetrust": ["#onetrust-accept-btn-handler", "#accept-recommended-btn-handler"],
+        "termly": ["[data-tid='banner-accept']"]
+    },
+    "reject": {
+        "cookiebot": ["#CybotCookiebotDialogBodyButtonDecline"],
+        "onetrust": ["#onetrust-reject-all-handler", ".ot-pc-refuse-all-handler"],
+        "termly": ["[data-tid='banner-decline']"]
+    }
+}
+
+# Consent mode of baseline crawls, which leave the banner untouched
+NO_CONSENT_INTERACTION = "none"
+
+# Button labels by consent mode, in lowercase, matched at the start of a button label
+CONSENT_KEYWORDS = {
+    "accept": [
+        # en
+        "accept all cookies", "accept all", "accept cookies", "accept", "i accept", "allow all cookies",
+        "allow all", "allow cookies", "allow", "agree", "i agree", "agree and close", "got it", "ok",
+        # de
+        "alle cookies akzeptieren", "alle akzeptieren", "akzeptieren", "alle zulassen", "zustimmen",
+        "einverstanden", "annehmen", "alle annehmen",
+        # fr
+        "tout accepter", "accepter et fermer", "accepter", "j'accepte", "autoriser tous les cookies",
+        # es / pt / it
+        "aceptar todas", "aceptar todo", "aceptar", "aceitar todos", "aceitar", "accetta tutti",
+        "accetta", "accetto",
+        # nl / nordics
+        "alles accepteren", "accepteren", "akkoord", "godkänn alla", "acceptera alla",
+        "accepter alle", "tillad alle", "godta alle", "hyväksy kaikki",
+        # central / eastern europe
+        "zaakceptuj wszystkie", "akceptuję", "akceptuj", "přijmout vše", "souhlasím", "elfogadom",
+        "mindent elfogadok", "accept toate", "sutinku", "piekrītu", "nõustun", "приемам", "принять"
+    ],
+    "reject": [
+        # en
+        "reject all cookies", "reject all", "reject", "decline all", "decline", "deny all", "deny",
+        "refuse all", "refuse", "necessary cookies only", "only necessary", "use necessary cookies only",
+        "do not accept",
+        # de
+        "alle ablehnen", "ablehnen", "nur notwendige cookies", "nur notwendige", "nicht einverstanden",
+        # fr
+        "tout refuser", "refuser", "continuer sans accepter",
+        # es / pt / it
+        "rechazar todas", "rechazar todo", "rechazar", "rejeitar todos", "rejeitar", "rifiuta tutti",
+        "rifiuta",
+        # nl / nordics
+        "alles weigeren", "weigeren", "avvisa alla", "neka alla", "afvis alle", "avvis alle",
+        "hylkää kaikki",
+        # central / eastern europe
+        "odrzuć wszystkie", "odrzuć", "odmítnout vše", "elutasítom", "respinge toate", "отказ"
+    ]
+}
+
+# Keyword tables compiled once into a single pattern per mode (longest keywords first)
+CONSENT_KEYWORD_PATTERNS = {
+    mode: "^(" + "|".join(re.escape(k) for k in sorted(words, key=len, reverse=True)) + ")(?=$|[\\s.,:;!)])"
+    for mode, words in CONSENT_KEYWORDS.items()
+}
+
+# Finds the best visible consent control in the page, its same-origin frames and open
+# shadow roots, clicks it and returns a description of it (or null)
+CONSENT_CLICK_SCRIPT = """
+const [selectors, keywordPattern] = arguments;
+const keyword = new RegExp(keywordPattern, "i");
+const banner = /cookie|consent|gdpr|privacy|cmp|banner|notice/i;
+
+const roots = [];
+const collect = (root, where) => {
+    roots.push([root, where]);
+    root.querySelectorAll("*").forEach((el) => {
+        if (el.shadowRoot) collect(el.shadowRoot, "shadow");
+        if (el.tagName === "IFRAME") {
+            try {
+                if (el.contentDocument) collect(el.contentDocument, "iframe");
+            } catch (e) {}
+        }
+    });
+};
+collect(document, "page");
+
+const visible = (el) => {
+    if (el.disabled || el.getAttribute("aria-disabled") === "true") return false;
+    const rect = el.getBoundingClientRect();
+    if (rect.width === 0 || rect.height === 0) return false;
+    const style = el.ownerDocument.defaultView.getComputedStyle(el);
+    return style.visibility !== "hidden" && style.display !== "none" && parseFloat(style.opacity) > 0;
+};
+const label = (el) => (el.innerText || el.value || el.getAttribute("aria-label") || "")
+    .replace(/\\s+/g, " ").trim().toLowerCase();
+const inBanner = (el) => {
+    for (let node = el; node && node.nodeType === 1; node = node.parentElement) {
+        if (banner.test(node.id + " " + node.className)) return true;
+    }
+    return false;
+};
+
+let best = null;
+const consider = (el, score, source, where) => {
+    if ((!best || score > best.score) && visible(el)) best = {el, score, source, where};
+};
+for (const [root, where] of roots) {
+    selectors.forEach((selector, i) => {
+        root.querySelectorAll(selector).forEach((el) => consider(el, 1000 - i, selector, where));
+    });
+    if (best) continue;
+    root.querySelectorAll("button, a, [role='button'], input[type='button'], input[type='submit']").forEach((el) => {
+        const text = label(el);
+        if (!text || text.length > 60) return;
+        const match = text.match(keyword);
+        if (!match) return;
+        const score = 10 + (match[1].length === text.length ? 10 : 0) + (inBanner(el) ? 5 : 0)
+            + match[1].length / 100;
+        consider(el, score, "keyword", where);
+    });
+}
+
+if (!best) return null;
+best.el.click();
+return {source: best.source, where: best.where, label: label(best.el), tag: best.el.tagName.toLowerCase(),
+        id: best.el.id || null};
+"""
+
+# Deadline in seconds of each wait phase, any phase may end early once its condition holds
+WAIT_DEADLINES = {
+    "page_ready": 15,       # document.readyState complete, when the CMP is not known yet
+    "cmp_loaded": 10,       # CMP script loaded and initialised
+    "banner_visible": 5,    # consent banner displayed
+    "cookies_changed": 5,   # cookie jar changed after the consent click
+    "settle": 3             # cookie jar settled once the CMP is ready, before loading is stopped
+}
+
+# Polling interval of all waits, and quiet period after which the cookie jar counts as settled
+WAIT_POLL_INTERVAL = 0.2
+COOKIE_SETTLE_SECONDS = 1.0
+
+
+def pac_data_url(blocked_hosts: List[str], proxied_hosts: Optional[List[str]] = None,
+                 proxy: Optional[str] = None) -> str:
+    """
+    Build a proxy auto-config file, as a data: URL, that refuses requests to the given
+    hosts and their subdomains by sending them to a closed local port, and optionally
+    sends requests to other hosts and their subdomains through a proxy.
+    
+    @param blocked_hosts: hostnames to block
+    @param proxied_hosts: hostnames to send through the proxy
+    @param proxy: host:port of the proxy for proxied_hosts
+    @return: data: URL for network.proxy.autoconfig_url
+    """
+    hosts = ", ".join(f'"{h.lower()}"' for h in blocked_hosts)
+    proxied = ", ".join(f'"{h.lower()}"' for h in (proxied_hosts or []) if proxy)
+    pac = (
+        "function matches(host, hosts) {\n"
+        "  for (var i = 0; i < hosts.length; i++) {\n"
+        "    if (host == hosts[i] || dnsDomainIs(host, '.' + hosts[i])) return true;\n"
+        "  }\n"
+        "  return false;\n"
+        "}\n"
+        "function FindProxyForURL(url, host) {\n"
+        "  host = host.toLowerCase();\n"
+        f"  if (matches(host, [{hosts}])) return 'PROXY 127.0.0.1:1';\n"
+        f"  if (matches(host, [{proxied}])) return 'PROXY {proxy}';\n"
+        "  return 'DIRECT';\n"
+        "}\n"
+    )
+    return "data:application/x-ns-proxy-autoconfig," + quote(pac)
 
-@dataclass
-class CrawlResult:
-    """Result of a single domain crawl"""
-    domain: str
-    success: bool
-    cmp_type: str
-    cookies_collected: int
-    consent_data: List[Dict]
-    error_message: Optional[str] = None
+
+_geckodriver_paths: Dict[Optional[str], str] = {}
+_geckodriver_lock = threading.Lock()
+
+
+def resolve_geckodriver(explicit_path: Optional[str] = None) -> str:
+    """
+    Locate the geckodriver binary once per process and check that it runs.
+    An explicit path is used as is, otherwise geckodriver is looked up on PATH,
+    and only then installed through webdriver-manager (which may need the network).
+    
+    @param explicit_path: path to a geckodriver binary, e.g. from the configuration
+    @return: path to a working geckodriver binary
+    """
+    with _geckodriver_lock:
+        if explicit_path in _geckodriver_paths:
+            return _geckodriver_paths[explicit_path]
+        
+        if explicit_path:
+            path = explicit_path
+            if not os.path.isfile(path) or not os.access(path, os.X_OK):
+                raise FileNotFoundError(f"geckodriver not found or not executable: {path}")
+        else:
+            path = shutil.which("geckodriver") or GeckoDriverManager().install()
+        
+        # Preflight: fail at startup rather than on the first domain
+        try:
+            version = subprocess.run([path, "--version"], capture_output=True, text=True,
+                                     timeout=30, check=True).stdout.splitlines()[0]
+        except (OSError, subprocess.SubprocessError, IndexError) as e:
+            raise RuntimeError(f"geckodriver at {path} is not usable: {e}")
+        
+        logger.info(f"Using {version} at {path}")
+        _geckodriver_paths[explicit_path] = path
+        return path
 
 
 class ConsentCrawler:
     """Browser-based crawler for collecting cookie consent data"""
     
     def __init__(self, num_browsers: int = 1, headless: bool = False, 
-                 output_dir: str = "./data/results"):
+                 output_dir: str = "./data/results",
+                 max_pages_per_browser: int = 50, max_browser_memory_mb: int = 2048,
+                 spare_browsers: int = 1, geckodriver_path: Optional[str] = None,
+                 wait_deadlines: Optional[Dict[str, float]] = None,
+                 consent_mode: str = "accept", load_profile: Optional[Dict[str, Any]] = None,
+                 db_path: Optional[str] = None, supervised: bool = False,
+                 domain_timeout: float = 120, max_worker_memory_mb: int = 4096,
+                 tabs_per_browser: int = 1, profile_name: Optional[str] = None,
+                 profile_template: Optional[str] = None, cache_proxy: Optional[str] = None,
+                 cached_hosts: Optional[List[str]] = None, use_cookie_store: bool = False,
+                 record_snapshots: bool = False, cache_ca: Optional[str] = None,
+                 worker_process: bool = False):
+        if consent_mode not in CONSENT_KEYWORDS and consent_mode != NO_CONSENT_INTERACTION:
+            raise ValueError(f"Unknown consent mode: {consent_mode}")
+        if profile_template and not os.path.isdir(profile_template):
+            raise FileNotFoundError(f"Browser profile template not found: {profile_template}")
+        
+        # Supervised mode: each browser worker runs in its own subprocess, which is
+        # killed with its browsers when a domain exceeds domain_timeout or the process
+        # tree exceeds max_worker_memory_mb
+        self.supervised = supervised
+        self.domain_timeout = domain_timeout
+        self.max_worker_memory_mb = max_worker_memory_mb
+        # Multi-tab mode: each browser visits several domains at once, in isolated tabs
+        self.tabs_per_browser = max(1, tabs_per_browser)
         self.num_browsers = num_browsers
+        self.consent_mode = consent_mode
+        # Extra preferences and blocked hosts, see LOAD_PROFILES in config/crawler_config.py
+        self.load_profile = load_profile or {}
+        # host:port of a running CachingProxy, used for requests to cached_hosts
+        self.cache_proxy = cache_proxy
+        self.cached_hosts = list(cached_hosts or []) if cache_proxy else []
+        # CA certificate of the CachingProxy, trusted in the profile of each browser
+        self.cache_ca = cache_ca if self.cached_hosts else None
+        if self.cached_hosts and not self.cache_ca:
+            raise ValueError("cached_hosts need the CA certificate of the caching proxy")
+        # Complete the cookies of each visit from the profile's cookies.sqlite
+        self.use_cookie_store = use_cookie_store
+        # Record the banner/declaration regions of each visit for replay without a browser
+        self.record_snapshots = record_snapshots
+        self.wait_deadlines = {**WAIT_DEADLINES, **(wait_deadlines or {})}
         self.headless = headless
         self.output_dir = output_dir
+        # Crawler of a supervised worker process, whose parent has already checked the
+        # geckodriver binary, initialized the databases and opened the log file
+        self.worker_process = worker_process
         self.setup_logger()
         
+        # Browser profile: results are labelled with its name, and each browser runs on
+        # its own clone of the template, cloned up front and reused across restarts
+        self.profile_name = profile_name
+        self.profile_template = profile_template
+        self._profile_root: Optional[str] = None
+        self._profile_slots: "queue.Queue[Tuple[str, bool]]" = queue.Queue()
+        self._driver_profiles: Dict[int, str] = {}
+        self._profile_lock = threading.Lock()
+        self._ca_template: Optional[str] = None
+        self._stop_event = threading.Event()
+        self._blocking_checked = False
+        if (profile_template or self.cache_ca) and not supervised:
+            for _ in range(num_browsers + spare_browsers):
+                self._profile_slots.put((self._clone_profile(), False))
+        
+        # Resolve the driver binary once, shared by all browser workers
+        self.geckodriver_path = geckodriver_path if worker_process else resolve_geckodriver(geckodriver_path)
+        
+        # Long-lived browsers, reset between domains and recycled periodically
+        self.browser_pool = BrowserPool(self.create_driver, max_pages=max_pages_per_browser,
+                                        max_memory_mb=max_browser_memory_mb, spares=spare_browsers,
+                                        on_quit=self._return_profile_dir)
+        
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
         
-        # Initialize database
-        self.db_path = os.path.join(output_dir, f"consent_crawl_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sqlite")
-        self.init_database()
+        # Initialize database, a given database is created if needed or appended to
+        self.db_path = db_path or os.path.join(
+            output_dir, f"consent_crawl_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sqlite")
+        self.snapshot_path = snapshot_store_path(self.db_path) if record_snapshots else None
+        if not worker_process:
+            self.init_database()
+            if self.snapshot_path:
+                init_snapshot_store(self.snapshot_path)
+        
+        # Settings of the single-browser crawlers run by supervised worker processes
+        self.worker_settings = {
+            "headless": headless,
+            "output_dir": output_dir,
+            "max_pages_per_browser": max_pages_per_browser,
+            "max_browser_memory_mb": max_browser_memory_mb,
+            "spare_browsers": 0,
+            "geckodriver_path": self.geckodriver_path,
+            "wait_deadlines": self.wait_deadlines,
+            "consent_mode": consent_mode,
+            "load_profile": self.load_profile,
+            "db_path": self.db_path,
+            "profile_name": profile_name,
+            "profile_template": profile_template,
+            "cache_proxy": cache_proxy,
+            "cached_hosts": self.cached_hosts,
+            "cache_ca": self.cache_ca,
+            "use_cookie_store": use_cookie_store,
+            "record_snapshots": record_snapshots,
+            "worker_process": True
+        }
     
     def setup_logger(self):
         """Set up logger for consent crawler"""
         logger.setLevel(logging.DEBUG)
+        if logger.handlers:
+            # Already set up by another crawler of this process, e.g. of another profile
+            return
         
         # Console handler
         ch = logging.StreamHandler()
@@ -57,7 +450,9 @@ class ConsentCrawler:
         ch.setFormatter(formatter)
         logger.addHandler(ch)
         
-        # File handler
+        # File handler, opened by the parent of supervised worker processes only
+        if self.worker_process:
+            return
         log_path = os.path.join(self.output_dir, "consent_crawl.log")
         fh = logging.FileHandler(log_path)
         fh.setLevel(logging.DEBUG)
@@ -66,55 +461,68 @@ class ConsentCrawler:
     
     def init_database(self):
         """Initialize SQLite database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create tables for storing crawl results
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS crawl_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                domain TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                success BOOLEAN NOT NULL,
-                cmp_type TEXT,
-                cookies_collected INTEGER DEFAULT 0,
-                error_message TEXT
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS cookies (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                crawl_id INTEGER,
-                name TEXT NOT NULL,
-                domain TEXT NOT NULL,
-                value TEXT,
-                path TEXT,
-                expiry DATETIME,
-                secure BOOLEAN,
-                http_only BOOLEAN,
-                same_site TEXT,
-                FOREIGN KEY (crawl_id) REFERENCES crawl_results (id)
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS consent_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                crawl_id INTEGER,
-                cookie_name TEXT NOT NULL,
-                cookie_domain TEXT NOT NULL,
-                purpose_category TEXT,
-                purpose_description TEXT,
-                cmp_type TEXT,
-                FOREIGN KEY (crawl_id) REFERENCES crawl_results (id)
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
+        init_crawl_database(self.db_path)
         logger.info(f"Database initialized: {self.db_path}")
     
+    def _template_dir(self) -> str:
+        """
+        Directory the browser profiles are cloned from: the profile template, or with the
+        caching proxy a copy of it (or an empty profile) that trusts the proxy CA.
+        """
+        if not self.cache_ca:
+            return self.profile_template
+        with self._profile_lock:
+            if self._ca_template is None or not os.path.isdir(self._ca_template):
+                path = tempfile.mkdtemp(prefix="consent-ca-profile-")
+                if self.profile_template:
+                    shutil.copytree(self.profile_template, path, dirs_exist_ok=True,
+                                    ignore=shutil.ignore_patterns("lock", ".parentlock", "parent.lock"))
+                install_ca_certificate(path, self.cache_ca)
+                self._ca_template = path
+            return self._ca_template
+    
+    def _clone_profile(self, path: Optional[str] = None) -> str:
+        """
+        Copy the profile template to a new directory, or over an existing clone.
+        
+        @param path: clone to overwrite, a new directory if None
+        @return: path of the clone
+        """
+        with self._profile_lock:
+            if self._profile_root is None or not os.path.isdir(self._profile_root):
+                self._profile_root = tempfile.mkdtemp(prefix=f"consent-{self.profile_name or 'profile'}-")
+            if path is None:
+                path = tempfile.mkdtemp(dir=self._profile_root)
+        shutil.rmtree(path, ignore_errors=True)
+        shutil.copytree(self._template_dir(), path,
+                        ignore=shutil.ignore_patterns("lock", ".parentlock", "parent.lock"))
+        return path
+    
+    def _take_profile_dir(self) -> str:
+        """Profile clone for a new browser. A clone used by a previous browser is cloned again first."""
+        try:
+            path, used = self._profile_slots.get_nowait()
+        except queue.Empty:
+            return self._clone_profile()
+        return self._clone_profile(path) if used else path
+    
+    def _return_profile_dir(self, driver: webdriver.Firefox) -> None:
+        """Make the profile clone of a driver that has quit available to the next browser"""
+        with self._profile_lock:
+            path = self._driver_profiles.pop(id(driver), None)
+        if path is not None:
+            self._profile_slots.put((path, True))
+    
+    def remove_profiles(self) -> None:
+        """Delete all profile clones, to be called once all browsers have quit"""
+        with self._profile_lock:
+            root, self._profile_root = self._profile_root, None
+            ca_template, self._ca_template = self._ca_template, None
+            self._profile_slots = queue.Queue()
+        for path in (root, ca_template):
+            if path is not None:
+                shutil.rmtree(path, ignore_errors=True)
+    
     def create_driver(self) -> webdriver.Firefox:
         """Create and configure Firefox WebDriver"""
         options = FirefoxOptions()
@@ -122,30 +530,108 @@ class ConsentCrawler:
         if self.headless:
             options.add_argument("--headless")
         
+        # Return from navigation at DOMContentLoaded, the visit waits for the CMP instead
+        options.page_load_strategy = "eager"
+        
+        # Tabs with separate cookie jars (user contexts) are driven over WebDriver BiDi
+        if self.tabs_per_browser > 1:
+            options.enable_bidi = True
+        
+        # Privileged scripts are needed to reset pooled browsers between domains
+        options.add_argument("-remote-allow-system-access")
+        
         # Performance and privacy settings
         options.set_preference("network.cookie.maxNumber", 10000)
         options.set_preference("network.cookie.maxPerHost", 10000)
         options.set_preference("privacy.trackingprotection.enabled", False)
         options.set_preference("privacy.donottrackheader.enabled", False)
         
-        # Disable images for faster loading (optional)
-        # options.set_preference("permissions.default.image", 2)
+        # Resource blocking of the load profile
+        for name, value in self.load_profile.get("preferences", {}).items():
+            options.set_preference(name, value)
+        blocked_hosts = self.load_profile.get("blocked_hosts") or []
+        if blocked_hosts or self.cached_hosts:
+            options.set_preference("network.proxy.type", 2)
+            options.set_preference("network.proxy.autoconfig_url",
+                                   pac_data_url(blocked_hosts, self.cached_hosts, self.cache_proxy))
+            # Blocking relies on the PAC proxy being unreachable, which Firefox would
+            # otherwise retry without a proxy
+            options.set_preference("network.proxy.failover_direct", False)
+        
+        # Run on a clone of the profile template instead of a fresh temporary profile. The
+        # caching proxy intercepts HTTPS of cached hosts with certificates of its own CA,
+        # which only the profile clones trust, so browsers then always run on a clone.
+        profile_dir = None
+        if self.profile_template or self.cache_ca:
+            profile_dir = self._take_profile_dir()
+            options.add_argument("-profile")
+            options.add_argument(profile_dir)
         
         try:
-            service = Service(GeckoDriverManager().install())
+            service = Service(self.geckodriver_path)
             driver = webdriver.Firefox(
                 service=service,
                 options=options
             )
+            if profile_dir is not None:
+                with self._profile_lock:
+                    self._driver_profiles[id(driver)] = profile_dir
             driver.set_page_load_timeout(30)
-            driver.implicitly_wait(10)
+            # No implicit waits: lookups of absent elements return immediately,
+            # waiting is done explicitly per phase
+            driver.implicitly_wait(0)
+            if blocked_hosts and not self._blocking_checked:
+                self.check_blocking(driver, blocked_hosts[0])
             return driver
         except Exception as e:
             logger.error(f"Failed to create Firefox driver: {e}")
+            if profile_dir is not None:
+                self._profile_slots.put((profile_dir, True))
             raise
     
+    def check_blocking(self, driver: webdriver.Firefox, host: str) -> None:
+        """
+        Check that the browser refuses a request to a blocked host of the load profile,
+        so that a lighter load profile cannot silently load everything like the full one.
+        Done for the first browser of the crawler.
+        
+        @param driver: new driver with the load profile's PAC file
+        @param host: blocked host
+        @raise RuntimeError: if the host was not refused by the PAC proxy
+        """
+        try:
+            driver.get(f"https://{host}/")
+            error = "page loaded"
+        except WebDriverException as e:
+            error = e.msg or str(e)
+        finally:
+            try:
+                driver.get("about:blank")
+            except WebDriverException:
+                pass
+        if "proxyConnectFailure" not in error:
+            driver.quit()
+            raise RuntimeError(f"Load profile does not block {host} ({error})")
+        self._blocking_checked = True
+        logger.debug(f"Requests to blocked host {host} are refused")
+    
     def detect_cmp_type(self, driver: webdriver.Firefox) -> str:
-        """Detect which CMP is being used on the current page"""
+        """
+        Detect which CMP is being used on the current page by probing its globals,
+        elements and script sources in the page. The page source is only searched
+        if the probe cannot run.
+        """
+        try:
+            cmp_type = driver.execute_script(CMP_PROBE_SCRIPT)
+            if cmp_type in KNOWN_CMP_TYPES or cmp_type == "unknown":
+                return cmp_type
+        except WebDriverException as e:
+            logger.debug(f"CMP probe failed, falling back to page source: {e}")
+        
+        return self.detect_cmp_type_from_source(driver)
+    
+    def detect_cmp_type_from_source(self, driver: webdriver.Firefox) -> str:
+        """Detect which CMP is being used by searching the serialized page"""
         try:
             page_source = driver.page_source.lower()
             
@@ -178,193 +664,633 @@ class ConsentCrawler:
             logger.error(f"Error collecting cookies: {e}")
             return []
     
-    def extract_consent_data_cookiebot(self, driver: webdriver.Firefox) -> List[Dict[str, Any]]:
-        """Extract consent data from Cookiebot CMP"""
-        consent_data = []
+    def complete_from_cookie_store(self, driver: webdriver.Firefox, cookies: List[Dict[str, Any]],
+                                   visit_start: float) -> List[Dict[str, Any]]:
+        """
+        Merge cookies collected through WebDriver with the browser's own cookie store,
+        which also holds third-party cookies of embedded frames, with exact expiry and
+        SameSite. Cookies of the store win, cookies it does not hold yet are kept.
+        
+        @param driver: driver of a pooled browser, which is reset between visits
+        @param cookies: cookies collected with collect_cookies
+        @param visit_start: start of the visit; the store is written asynchronously, so it can
+                            still hold cookies of the browser's earlier visits, created before
+        @return: union of both
+        """
+        profile_dir = driver.capabilities.get("moz:profile")
+        if not profile_dir:
+            return cookies
         try:
-            # Look for Cookiebot declaration
-            declaration_elements = driver.find_elements(By.CSS_SELECTOR, "[data-cookiefirst-category]")
-            
-            for element in declaration_elements:
-                try:
-                    name = element.get_attribute("data-cookiefirst-name") or "unknown"
-                    domain = element.get_attribute("data-cookiefirst-domain") or "unknown"
-                    category = element.get_attribute("data-cookiefirst-category") or "unknown"
-                    purpose = element.text.strip() if element.text else "No description"
-                    
-                    consent_data.append({
-                        "name": name,
-                        "domain": domain,
-                        "category": category,
-                        "purpose": purpose,
-                        "cmp": "cookiebot"
-                    })
-                except Exception as e:
-                    logger.warning(f"Error extracting Cookiebot data: {e}")
-                    
+            stored = read_cookie_store(profile_dir, since=visit_start)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not read the cookie store of {profile_dir}: {e}")
+            return cookies
+        merged = merge_cookie_jars(stored, cookies)
+        logger.debug(f"Cookie store added {len(merged) - len(cookies)} cookies")
+        return merged
+    
+    def extract_consent_data(self, regions: List[str], cmp_type: str) -> List[Dict[str, Any]]:
+        """
+        Extract the cookie declarations of a CMP from the serialized regions of the page,
+        with the same extractors that replay uses.
+        
+        @param regions: regions as returned by record_snapshot
+        @param cmp_type: one of KNOWN_CMP_TYPES
+        @return: declaration rows with name, domain, category, purpose and cmp
+        """
+        try:
+            consent_data = extract_declarations(cmp_type, regions)
         except Exception as e:
-            logger.warning(f"No Cookiebot consent data found: {e}")
+            logger.warning(f"Error extracting {cmp_type} consent data: {e}")
+            return []
         
+        logger.debug(f"Extracted {len(consent_data)} {cmp_type} declarations")
         return consent_data
     
-    def extract_consent_data_onetrust(self, driver: webdriver.Firefox) -> List[Dict[str, Any]]:
-        """Extract consent data from OneTrust CMP"""
-        consent_data = []
+    def record_snapshot(self, driver: webdriver.Firefox) -> List[str]:
+        """
+        Serialize the banner and declaration regions of the page, for the declaration
+        extractors and for replaying them offline (see scripts/run_replay.py).
+        
+        @param driver: driver on the visited page
+        @return: outer HTML of the outermost matching regions
+        """
         try:
-            # Look for OneTrust cookie list
-            cookie_elements = driver.find_elements(By.CSS_SELECTOR, ".ot-sdk-cookie")
-            
-            for element in cookie_elements:
-                try:
-                    name_elem = element.find_element(By.CSS_SELECTOR, ".ot-sdk-cookie-policy-name")
-                    category_elem = element.find_element(By.CSS_SELECTOR, ".ot-sdk-cookie-policy-category")
-                    
-                    name = name_elem.text.strip() if name_elem else "unknown"
-                    category = category_elem.text.strip() if category_elem else "unknown"
-                    
-                    # Try to get domain and purpose
-                    domain = element.get_attribute("data-domain") or "unknown"
-                    purpose_elem = element.find_element(By.CSS_SELECTOR, ".ot-sdk-cookie-policy-description")
-                    purpose = purpose_elem.text.strip() if purpose_elem else "No description"
-                    
-                    consent_data.append({
-                        "name": name,
-                        "domain": domain,
-                        "category": category,
-                        "purpose": purpose,
-                        "cmp": "onetrust"
-                    })
-                except Exception as e:
-                    logger.warning(f"Error extracting OneTrust data: {e}")
-                    
-        except Exception as e:
-            logger.warning(f"No OneTrust consent data found: {e}")
+            return driver.execute_script(SNAPSHOT_SCRIPT, SNAPSHOT_REGION_SELECTORS, SNAPSHOT_MAX_CHARS) or []
+        except WebDriverException as e:
+            logger.debug(f"Could not record page snapshot: {e}")
+            return []
+    
+    def click_consent_button(self, driver: webdriver.Firefox, cmp_type: str,
+                             mode: str = "accept") -> Optional[Dict[str, Any]]:
+        """
+        Locate and click the consent control of the page in a single script call.
+        Buttons of the detected CMP are tried first, then those of the other CMPs,
+        then visible buttons whose label matches the multilingual keyword table.
         
-        return consent_data
+        @param driver: driver on the visited page
+        @param cmp_type: detected CMP type, its buttons are ranked first
+        @param mode: "accept" or "reject"
+        @return: description of the clicked element (source, where, label, tag, id), or None
+        """
+        by_cmp = CONSENT_BUTTON_SELECTORS[mode]
+        selectors = list(by_cmp.get(cmp_type, []))
+        for other, other_selectors in by_cmp.items():
+            if other != cmp_type:
+                selectors.extend(other_selectors)
+        
+        try:
+            clicked = driver.execute_script(CONSENT_CLICK_SCRIPT, selectors, CONSENT_KEYWORD_PATTERNS[mode])
+        except WebDriverException as e:
+            logger.debug(f"Consent button click failed: {e}")
+            return None
+        
+        if clicked:
+            logger.debug(f"Clicked {mode} control ({clicked['source']}, {clicked['where']}): {clicked['label']!r}")
+        return clicked
     
-    def crawl_domain(self, domain: str) -> CrawlResult:
-        """Crawl a single domain and collect cookie consent data"""
+    def _poll(self, condition: Callable[[], Any], phase: str) -> Iterator[None]:
+        """
+        Wait step: check the condition, yielding between checks, until it holds or the
+        deadline of the phase passes. Steps are run by _run_steps (one page at a time)
+        or interleaved across tabs by _multitab_worker.
+        
+        @return: (as the generator's return value) whether the condition held
+        """
+        deadline = time.time() + self.wait_deadlines[phase]
+        while True:
+            if condition():
+                return True
+            if time.time() >= deadline:
+                return False
+            yield
+    
+    @staticmethod
+    def _run_steps(steps: Iterator[None]) -> Any:
+        """Run wait steps to completion on the current page, sleeping between polls"""
+        while True:
+            try:
+                next(steps)
+            except StopIteration as done:
+                return done.value
+            time.sleep(WAIT_POLL_INTERVAL)
+    
+    def _cmp_or_load_steps(self, driver: webdriver.Firefox) -> Iterator[None]:
+        """
+        Wait steps that poll the CMP probe while the page loads, until a known CMP is
+        found or the document has finished loading, whichever comes first.
+        
+        @param driver: driver on the visited page
+        @return: (as the generator's return value) detected CMP type
+        """
+        probe = {}
+        
+        def cmp_or_complete():
+            probe["cmp"], ready_state = driver.execute_script(CMP_PROBE_READY_SCRIPT)
+            return probe["cmp"] in KNOWN_CMP_TYPES or ready_state == "complete"
+        
+        try:
+            if not (yield from self._poll(cmp_or_complete, "page_ready")):
+                logger.debug("Page still loading at the page_ready deadline")
+        except WebDriverException as e:
+            logger.debug(f"CMP probe failed while loading: {e}")
+            return self.detect_cmp_type(driver)
+        
+        if probe.get("cmp") in KNOWN_CMP_TYPES or probe.get("cmp") == "unknown":
+            return probe["cmp"]
+        return self.detect_cmp_type(driver)
+    
+    def _cmp_steps(self, driver: webdriver.Firefox, cmp_type: str) -> Iterator[None]:
+        """
+        Wait steps until the script of a known CMP has loaded, then until its banner is visible.
+        
+        @param driver: driver on the visited page
+        @param cmp_type: one of KNOWN_CMP_TYPES
+        @return: (as the generator's return value) True if the banner became visible
+                 before the phase deadlines
+        """
+        if not (yield from self._poll(lambda: driver.execute_script(CMP_LOADED_SCRIPTS[cmp_type]), "cmp_loaded")):
+            logger.debug(f"Timed out waiting for the {cmp_type} script")
+            return False
+        
+        banner_visible = EC.visibility_of_any_elements_located((By.CSS_SELECTOR, CMP_BANNER_SELECTORS[cmp_type]))
+        if not (yield from self._poll(lambda: banner_visible(driver), "banner_visible")):
+            # Consent may already be stored, or the banner is rendered elsewhere
+            logger.debug(f"Timed out waiting for the {cmp_type} banner")
+            return False
+        return True
+    
+    def _cookie_steps(self, read_cookies: Callable[[], List[Dict[str, Any]]], before: List[Dict[str, Any]],
+                      phase: str, require_change: bool) -> Iterator[None]:
+        """
+        Poll the cookie jar until it has not changed for COOKIE_SETTLE_SECONDS (after a
+        first change, if required) or the deadline of the phase is reached.
+        
+        @return: (as the generator's return value) last cookies seen, and whether the jar changed
+        """
+        def snapshot(cookies):
+            return {(c.get("name"), c.get("domain"), c.get("path"), c.get("value")) for c in cookies}
+        
+        state = {"cookies": before, "last": snapshot(before), "changed_at": None, "stable_since": time.time()}
+        
+        def settled():
+            state["cookies"] = read_cookies()
+            current = snapshot(state["cookies"])
+            if current != state["last"]:
+                state["last"] = current
+                state["changed_at"] = state["stable_since"] = time.time()
+                return False
+            return ((state["changed_at"] is not None or not require_change)
+                    and time.time() - state["stable_since"] >= COOKIE_SETTLE_SECONDS)
+        
+        yield
+        yield from self._poll(settled, phase)
+        return state["cookies"], state["changed_at"] is not None
+    
+    def _settle_steps(self, driver: webdriver.Firefox,
+                      read_cookies: Callable[[], List[Dict[str, Any]]]) -> Iterator[None]:
+        """
+        Wait steps that give trackers a bounded window to set their cookies, until the
+        cookie jar has not changed for COOKIE_SETTLE_SECONDS or the settle deadline, then
+        stop all loads still pending so that slow third parties do not hold up the visit.
+        
+        @param driver: driver on the visited page
+        @param read_cookies: returns the cookies of the page's cookie jar
+        @return: (as the generator's return value) cookies at the end of the window
+        """
+        cookies, _ = yield from self._cookie_steps(read_cookies, read_cookies(), "settle", require_change=False)
+        try:
+            driver.execute_script("window.stop();")
+        except WebDriverException as e:
+            logger.debug(f"Could not stop page loading: {e}")
+        return cookies
+    
+    def _visit_steps(self, driver: webdriver.Firefox, domain: str, cmp_hint: Optional[str],
+                     read_cookies: Callable[[], List[Dict[str, Any]]],
+                     cookie_store_since: Optional[float] = None) -> Iterator[None]:
+        """
+        Steps of a visit to a page that is already loading: wait for the CMP, collect the
+        pre-consent cookies, extract the declarations, interact with the banner and
+        collect the post-consent cookies.
+        
+        @param driver: driver whose current window shows the page
+        @param domain: url of the page
+        @param cmp_hint: CMP type already known from the presence crawl, skips detection
+        @param read_cookies: returns the cookies of the page's cookie jar
+        @param cookie_store_since: start of the visit, to complete both cookie snapshots from the
+                                   profile's cookie store, the pre-consent one before the consent click
+        @return: (as the generator's return value) crawl result for the domain
+        """
+        if cmp_hint in KNOWN_CMP_TYPES:
+            # CMP known from the presence crawl, wait for it directly
+            cmp_type = cmp_hint
+            logger.info(f"Using presence CMP hint: {cmp_type} for {domain}")
+        else:
+            # Detect CMP type while the page loads
+            cmp_type = yield from self._cmp_or_load_steps(driver)
+            logger.info(f"Detected CMP: {cmp_type} for {domain}")
+        
+        banner_visible = False
+        if cmp_type in KNOWN_CMP_TYPES:
+            banner_visible = yield from self._cmp_steps(driver, cmp_type)
+        
+        # Collect cookies once they settle, then stop loading the rest of the page
+        cookies = yield from self._settle_steps(driver, read_cookies)
+        
+        # Add the cookies not visible to the page, e.g. of third-party frames, before the
+        # consent click can change the store; polling below compares WebDriver cookies only
+        pre_consent_cookies = cookies
+        if cookie_store_since is not None:
+            pre_consent_cookies = self.complete_from_cookie_store(driver, cookies, cookie_store_since)
+        
+        # Extract consent data based on CMP type
+        consent_data = []
+        regions = None
+        if cmp_type in KNOWN_CMP_TYPES or self.record_snapshots:
+            regions = self.record_snapshot(driver)
+        if cmp_type in KNOWN_CMP_TYPES:
+            consent_data = self.extract_consent_data(regions, cmp_type)
+        
+        # Interact with consent banner if present
+        clicked = None
+        if self.consent_mode != NO_CONSENT_INTERACTION:
+            clicked = self.click_consent_button(driver, cmp_type, self.consent_mode)
+        
+        # Collect cookies again once consent has been processed
+        if clicked:
+            final_cookies, changed = yield from self._cookie_steps(read_cookies, cookies, "cookies_changed",
+                                                                   require_change=True)
+            if not changed:
+                logger.debug("Cookie jar unchanged after consent click")
+        else:
+            final_cookies = read_cookies()
+        
+        if cookie_store_since is not None:
+            final_cookies = self.complete_from_cookie_store(driver, final_cookies, cookie_store_since)
+        
+        snapshot = None
+        if self.record_snapshots:
+            snapshot = {
+                "regions": regions,
+                "verdicts": {
+                    "cmp_hint": cmp_hint,
+                    "banner_visible": banner_visible,
+                    "consent_mode": self.consent_mode,
+                    "clicked": clicked
+                }
+            }
+        
+        return CrawlResult(
+            domain=domain,
+            success=True,
+            cmp_type=cmp_type,
+            cookies_collected=len(final_cookies),
+            consent_data=consent_data,
+            cookies=final_cookies,
+            pre_consent_cookies=pre_consent_cookies,
+            profile=self.profile_name,
+            snapshot=snapshot
+        )
+    
+    def failed_result(self, domain: str, error: Exception) -> CrawlResult:
+        """Result of a visit that raised an error"""
+        return CrawlResult(
+            domain=domain,
+            success=False,
+            cmp_type="unknown",
+            cookies_collected=0,
+            consent_data=[],
+            error_message="Page load timeout" if isinstance(error, TimeoutException) else str(error),
+            profile=self.profile_name
+        )
+    
+    def crawl_domain(self, domain: str, cmp_hint: Optional[str] = None) -> CrawlResult:
+        """
+        Crawl a single domain and collect cookie consent data.
+        
+        @param domain: domain or url to crawl
+        @param cmp_hint: CMP type already known from the presence crawl, skips detection
+        @return: crawl result for the domain
+        """
         logger.info(f"Crawling domain: {domain}")
         
-        driver = None
+        pooled = None
+        failed = True
         try:
-            # Create browser driver
-            driver = self.create_driver()
+            # Take a browser from the pool
+            pooled = self.browser_pool.acquire()
+            driver = pooled.driver
             
             # Navigate to domain
             if not domain.startswith(("http://", "https://")):
                 domain = f"https://{domain}"
             
+            visit_start = time.time()
             driver.get(domain)
             
-            # Wait for page to load
-            WebDriverWait(driver, 15).until(
-                lambda d: d.execute_script("return document.readyState") == "complete"
-            )
+            result = self._run_steps(self._visit_steps(
+                driver, domain, cmp_hint, lambda: self.collect_cookies(driver),
+                cookie_store_since=visit_start if self.use_cookie_store else None))
+            failed = False
+            return result
             
-            # Detect CMP type
-            cmp_type = self.detect_cmp_type(driver)
-            logger.info(f"Detected CMP: {cmp_type} for {domain}")
+        except Exception as e:
+            return self.failed_result(domain, e)
+        finally:
+            if pooled is not None:
+                self.browser_pool.release(pooled, failed=failed)
+    
+    def save_crawl_result(self, result: CrawlResult) -> int:
+        """Save a single crawl result with its cookies and consent data, and return the crawl ID"""
+        conn = connect_wal(self.db_path)
+        try:
+            crawl_id = write_results(conn, [result])
+        finally:
+            conn.close()
+        if self.snapshot_path and result.snapshot is not None:
+            conn = sqlite3.connect(self.snapshot_path)
+            try:
+                write_snapshots(conn, crawl_id, [result])
+            finally:
+                conn.close()
+        return crawl_id
+    
+    def _browser_worker(self, worker_id: int, work_queue: "queue.Queue[str]",
+                        writer: ResultWriter,
+                        cmp_hints: Dict[str, str], stop_event: threading.Event,
+                        deadline: Optional[float]) -> None:
+        """
+        Browser worker: crawl domains from the shared queue until it is empty,
+        the crawl is stopped or the next domain is not expected to finish before the deadline.
+        """
+        crawl_times = []
+        while not stop_event.is_set():
+            if deadline is not None and crawl_times:
+                if time.time() + sum(crawl_times) / len(crawl_times) > deadline:
+                    logger.info(f"Worker {worker_id}: time budget reached")
+                    break
             
-            # Extract consent data based on CMP type
-            consent_data = []
-            if cmp_type == "cookiebot":
-                consent_data = self.extract_consent_data_cookiebot(driver)
-            elif cmp_type == "onetrust":
-                consent_data = self.extract_consent_data_onetrust(driver)
+            try:
+                domain = work_queue.get_nowait()
+            except queue.Empty:
+                break
             
-            # Collect cookies
-            cookies = self.collect_cookies(driver)
+            started = time.time()
+            result = self.crawl_domain(domain, cmp_hint=cmp_hints.get(domain_key(domain)))
+            writer.put(result)
+            crawl_times.append(time.time() - started)
+    
+    @staticmethod
+    def bidi_supported(driver: webdriver.Firefox) -> bool:
+        """
+        Whether tabs with isolated cookie jars can be used: the browser session has BiDi
+        enabled and the installed Selenium has the BiDi browser, browsing context and
+        storage modules, which releases older than the declared minimum lack.
+        """
+        if not driver.capabilities.get("webSocketUrl"):
+            return False
+        # Checked on the class, the properties open the BiDi connection
+        if not all(hasattr(type(driver), name) for name in ("browser", "browsing_context", "storage")):
+            return False
+        try:
+            importlib.import_module("selenium.webdriver.common.bidi.storage")
+        except ImportError:
+            return False
+        return True
+    
+    def bidi_cookies(self, driver: webdriver.Firefox, context: str) -> List[Dict[str, Any]]:
+        """
+        Collect the cookies of the cookie jar of a tab, in the format of collect_cookies.
+        
+        @param driver: driver with BiDi enabled, see bidi_supported
+        @param context: browsing context (window handle) of the tab
+        @return: cookies of the tab's user context
+        """
+        # Imported here, so that crawls without tabs run on Selenium releases without it
+        from selenium.webdriver.common.bidi.storage import BrowsingContextPartitionDescriptor, BytesValue
+        
+        cookies = []
+        partition = BrowsingContextPartitionDescriptor(context)
+        for cookie in driver.storage.get_cookies(partition=partition).cookies:
+            value = cookie.value.value if isinstance(cookie.value, BytesValue) else cookie.value
+            converted = {
+                "name": cookie.name,
+                "value": value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "secure": cookie.secure,
+                "httpOnly": cookie.http_only,
+                "sameSite": (cookie.same_site or "none").capitalize()
+            }
+            if cookie.expiry is not None:
+                converted["expiry"] = cookie.expiry
+            cookies.append(converted)
+        return cookies
+    
+    def _open_tab(self, driver: webdriver.Firefox, domain: str, cmp_hint: Optional[str]) -> Dict[str, Any]:
+        """
+        Start a visit in a new background tab, in a user context of its own so that
+        its cookies and storage are isolated from the other tabs.
+        
+        @return: tab state, with the visit steps to run on it
+        """
+        if not domain.startswith(("http://", "https://")):
+            domain = f"https://{domain}"
+        
+        user_context = driver.browser.create_user_context()
+        tab = {"domain": domain, "user_context": user_context, "context": None, "started": time.time()}
+        tab["context"] = driver.browsing_context.create(type="tab", background=True, user_context=user_context)
+        driver.browsing_context.navigate(context=tab["context"], url=domain, wait="none")
+        tab["steps"] = self._visit_steps(driver, domain, cmp_hint,
+                                         lambda: self.bidi_cookies(driver, tab["context"]))
+        return tab
+    
+    @staticmethod
+    def _close_tab(driver: webdriver.Firefox, tab: Dict[str, Any]) -> None:
+        """Close the tab of a finished visit and discard its cookie jar"""
+        try:
+            if tab["context"] is not None:
+                driver.browsing_context.close(context=tab["context"])
+            driver.browser.remove_user_context(user_context=tab["user_context"])
+        except WebDriverException as e:
+            logger.debug(f"Could not close tab of {tab['domain']}: {e}")
+    
+    def _multitab_worker(self, worker_id: int, work_queue: "queue.Queue[str]",
+                         writer: ResultWriter,
+                         cmp_hints: Dict[str, str], stop_event: threading.Event,
+                         deadline: Optional[float]) -> None:
+        """
+        Multi-tab browser worker: like _browser_worker, but each browser visits up to
+        tabs_per_browser domains at once, one tab and one user context (container) per
+        domain. Navigation is not awaited, and the wait steps of all tabs are interleaved.
+        Falls back to _browser_worker if the browser does not support WebDriver BiDi.
+        """
+        crawl_times = []
+        out_of_time = False
+        while not stop_event.is_set() and not out_of_time and not work_queue.empty():
+            pooled = self.browser_pool.acquire()
+            driver = pooled.driver
+            if not self.bidi_supported(driver):
+                logger.warning(f"Worker {worker_id}: WebDriver BiDi not available in the browser or in the "
+                               f"installed Selenium, crawling one tab at a time")
+                self.browser_pool.release(pooled, visits=0)
+                self._browser_worker(worker_id, work_queue, writer, cmp_hints, stop_event, deadline)
+                return
             
-            # Interact with consent banner if present (accept all)
+            tabs: List[Dict[str, Any]] = []
+            visits = 0
+            failed = False
             try:
-                # Look for common accept buttons
-                accept_selectors = [
-                    "[id*='accept']", "[class*='accept']",
-                    "[id*='agree']", "[class*='agree']",
-                    "[aria-label*='Accept']", "[aria-label*='Agree']"
-                ]
-                
-                for selector in accept_selectors:
-                    try:
-                        button = driver.find_element(By.CSS_SELECTOR, selector)
-                        if button.is_displayed() and button.is_enabled():
-                            button.click()
-                            logger.debug(f"Clicked consent button: {selector}")
-                            time.sleep(2)  # Wait for consent processing
+                while not failed:
+                    # Fill free tabs, up to the recycling threshold of the browser
+                    while (len(tabs) < self.tabs_per_browser and not stop_event.is_set() and not out_of_time
+                           and pooled.pages + visits + len(tabs) < self.browser_pool.max_pages):
+                        if deadline is not None and crawl_times:
+                            if time.time() + sum(crawl_times) / len(crawl_times) > deadline:
+                                # Only this worker stops, its open tabs still finish
+                                logger.info(f"Worker {worker_id}: time budget reached")
+                                out_of_time = True
+                                break
+                        try:
+                            domain = work_queue.get_nowait()
+                        except queue.Empty:
                             break
-                    except:
-                        continue
-            except Exception as e:
-                logger.debug(f"No consent banner interaction needed: {e}")
-            
-            # Collect cookies again after consent
-            final_cookies = self.collect_cookies(driver)
-            
-            return CrawlResult(
-                domain=domain,
-                success=True,
-                cmp_type=cmp_type,
-                cookies_collected=len(final_cookies),
-                consent_data=consent_data
-            )
-            
-        except TimeoutException:
-            return CrawlResult(
-                domain=domain,
-                success=False,
-                cmp_type="unknown",
-                cookies_collected=0,
-                consent_data=[],
-                error_message="Page load timeout"
-            )
-        except Exception as e:
-            return CrawlResult(
-                domain=domain,
-                success=False,
-                cmp_type="unknown", 
-                cookies_collected=0,
-                consent_data=[],
-                error_message=str(e)
-            )
-        finally:
-            if driver:
+                        logger.info(f"Crawling domain: {domain}")
+                        try:
+                            tabs.append(self._open_tab(driver, domain, cmp_hints.get(domain_key(domain))))
+                        except Exception as e:
+                            writer.put(self.failed_result(domain, e))
+                            failed = True
+                            break
+                    
+                    if not tabs:
+                        break
+                    
+                    # Advance each tab by one step
+                    for tab in list(tabs):
+                        try:
+                            driver.switch_to.window(tab["context"])
+                            next(tab["steps"])
+                            continue
+                        except StopIteration as done:
+                            result = done.value
+                        except Exception as e:
+                            result = self.failed_result(tab["domain"], e)
+                        tabs.remove(tab)
+                        self._close_tab(driver, tab)
+                        writer.put(result)
+                        visits += 1
+                        crawl_times.append(time.time() - tab["started"])
+                    time.sleep(WAIT_POLL_INTERVAL / max(1, len(tabs)))
+            finally:
+                # Visits still open when the browser failed are recorded as failed
+                for tab in tabs:
+                    writer.put(self.failed_result(tab["domain"], WebDriverException("browser failed")))
+                self.browser_pool.release(pooled, failed=failed or bool(tabs), visits=max(1, visits))
+    
+    def _supervised_worker(self, worker_id: int, work_queue: "queue.Queue[str]",
+                           writer: ResultWriter,
+                           cmp_hints: Dict[str, str], stop_event: threading.Event,
+                           deadline: Optional[float], attempts: Dict[str, int]) -> None:
+        """
+        Supervised browser worker: like _browser_worker, but each domain is crawled in a
+        worker subprocess. A domain whose subprocess hangs, runs out of memory or dies is
+        requeued once, then recorded as failed.
+        """
+        process = SupervisedProcess(_supervised_worker_main, (self.worker_settings,),
+                                    task_timeout=self.domain_timeout,
+                                    max_memory_mb=self.max_worker_memory_mb,
+                                    marker=self._crawl_marker)
+        crawl_times = []
+        try:
+            while not stop_event.is_set():
+                if deadline is not None and crawl_times:
+                    if time.time() + sum(crawl_times) / len(crawl_times) > deadline:
+                        logger.info(f"Worker {worker_id}: time budget reached")
+                        break
+                
                 try:
-                    driver.quit()
-                except:
-                    pass
+                    domain = work_queue.get_nowait()
+                except queue.Empty:
+                    break
+                
+                started = time.time()
+                result, failure = process.run((domain, cmp_hints.get(domain_key(domain))))
+                crawl_times.append(time.time() - started)
+                if failure is None:
+                    writer.put(result)
+                    continue
+                
+                attempts[domain] = attempts.get(domain, 0) + 1
+                logger.warning(f"Worker {worker_id}: killed while crawling {domain} ({failure})")
+                reap_orphaned_browsers(self._crawl_started, self._crawl_marker)
+                if attempts[domain] < 2:
+                    work_queue.put(domain)
+                else:
+                    if not domain.startswith(("http://", "https://")):
+                        domain = f"https://{domain}"
+                    writer.put(CrawlResult(domain=domain, success=False, cmp_type="unknown",
+                                           cookies_collected=0, consent_data=[],
+                                           error_message=f"Worker killed: {failure}",
+                                           profile=self.profile_name))
+        finally:
+            process.close()
     
-    def save_crawl_result(self, result: CrawlResult) -> int:
-        """Save crawl result to database and return the crawl ID"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Insert crawl result
-        cursor.execute("""
-            INSERT INTO crawl_results (domain, success, cmp_type, cookies_collected, error_message)
-            VALUES (?, ?, ?, ?, ?)
-        """, (result.domain, result.success, result.cmp_type, 
-              result.cookies_collected, result.error_message))
-        
-        crawl_id = cursor.lastrowid
-        
-        # Insert consent data
-        for consent in result.consent_data:
-            cursor.execute("""
-                INSERT INTO consent_data (crawl_id, cookie_name, cookie_domain, 
-                                        purpose_category, purpose_description, cmp_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (crawl_id, consent.get("name"), consent.get("domain"),
-                  consent.get("category"), consent.get("purpose"), consent.get("cmp")))
-        
-        conn.commit()
-        conn.close()
+    def _record_result(self, result: CrawlResult, results: Dict[str, Any],
+                       seen_filter: Optional[SeenDomainFilter]) -> None:
+        """
+        Aggregate the summary statistics of a result once it has been written.
+        Called on the result writer thread.
+        """
+        # Update statistics
+        if result.success:
+            if seen_filter is not None:
+                seen_filter.add(result.domain)
+            results["successful_crawls"] += 1
+            results["total_cookies"] += result.cookies_collected
+            
+            if result.consent_data:
+                results["domains_with_consent_data"] += 1
+            
+            cmp_type = result.cmp_type
+            results["cmp_types"][cmp_type] = results["cmp_types"].get(cmp_type, 0) + 1
+        else:
+            results["failed_crawls"] += 1
+            logger.warning(f"Failed to crawl {result.domain}: {result.error_message}")
         
-        return crawl_id
+        completed = results["successful_crawls"] + results["failed_crawls"]
+        logger.info(f"Progress: {completed}/{results['total_domains']} - {result.domain}")
+    
+    def stop(self) -> None:
+        """Let running visits of crawl_domains finish, but do not start new ones"""
+        self._stop_event.set()
     
-    def crawl_domains(self, domains: List[str]) -> Dict[str, Any]:
-        """Crawl multiple domains and return summary statistics"""
-        logger.info(f"Starting consent crawl of {len(domains)} domains")
+    def crawl_domains(self, domains: List[str],
+                      cmp_hints: Optional[Dict[str, str]] = None,
+                      seen_filter: Optional[SeenDomainFilter] = None,
+                      defer_seen: bool = False,
+                      time_budget: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Crawl multiple domains with num_browsers parallel browser workers, taking
+        domains from a shared queue in the given order, and return summary statistics.
+        
+        @param domains: list of domains to crawl
+        @param cmp_hints: optional mapping of domain to CMP type known from the presence crawl,
+                          looked up by domain_key
+        @param seen_filter: cross-run filter of recently crawled domains, updated with successful crawls
+        @param defer_seen: crawl recently crawled domains last instead of skipping them
+        @param time_budget: workers stop before a domain that is not expected to finish
+                            within this many seconds, based on their average crawl time so far
+        @return: summary statistics
+        """
+        cmp_hints = {domain_key(domain): cmp_type for domain, cmp_type in (cmp_hints or {}).items()}
+        domains = apply_seen_filter(domains, seen_filter, defer_seen)
+        logger.info(f"Starting consent crawl of {len(domains)} domains with {self.num_browsers} browser(s)")
+        if self.supervised and self.tabs_per_browser > 1:
+            logger.warning("Supervised workers crawl one tab at a time, ignoring tabs_per_browser")
+        elif self.use_cookie_store and self.tabs_per_browser > 1:
+            # The store mixes the cookie jars of all tabs, tabs read their own jar over BiDi
+            logger.warning("The cookie store is not read in multi-tab mode")
         
         results = {
             "total_domains": len(domains),
@@ -372,33 +1298,72 @@ class ConsentCrawler:
             "failed_crawls": 0,
             "cmp_types": {},
             "total_cookies": 0,
-            "domains_with_consent_data": 0
+            "domains_with_consent_data": 0,
+            "uncrawled_domains": 0
         }
         
         start_time = time.time()
+        deadline = start_time + time_budget if time_budget is not None else None
+        self._crawl_started = start_time
+        # Marks the browsers of this crawl's worker subprocesses, see reap_orphaned_browsers
+        self._crawl_marker = f"{os.getpid()}-{id(self)}-{start_time}"
+        if not self.supervised:
+            self.browser_pool.warm_up()
         
-        for i, domain in enumerate(domains, 1):
-            logger.info(f"Progress: {i}/{len(domains)} - {domain}")
+        work_queue: "queue.Queue[str]" = queue.Queue()
+        for domain in domains:
+            work_queue.put(domain)
+        stop_event = self._stop_event = threading.Event()
+        
+        # Results are written in batches by a single background writer
+        # A persistent write failure stops the crawl, as further results would be lost too
+        writer = ResultWriter(self.db_path, snapshot_path=self.snapshot_path,
+                              on_result=lambda result: self._record_result(result, results, seen_filter),
+                              on_failure=stop_event.set)
+        writer.start()
+        
+        workers = []
+        attempts: Dict[str, int] = {}
+        for worker_id in range(max(1, min(self.num_browsers, len(domains)))):
+            if self.supervised:
+                target = self._supervised_worker
+                args = (worker_id, work_queue, writer, cmp_hints, stop_event, deadline, attempts)
+            else:
+                target = self._multitab_worker if self.tabs_per_browser > 1 else self._browser_worker
+                args = (worker_id, work_queue, writer, cmp_hints, stop_event, deadline)
+            worker = threading.Thread(target=target, name=f"browser-{worker_id}", args=args, daemon=True)
+            worker.start()
+            workers.append(worker)
+        
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(timeout=1)
+        except KeyboardInterrupt:
+            # Let running visits finish, but do not start new ones
+            stop_event.set()
+            logger.warning("Crawl interrupted, waiting for running browsers to finish")
+            for worker in workers:
+                worker.join()
+            raise
+        finally:
+            writer.close()
             
-            result = self.crawl_domain(domain)
-            self.save_crawl_result(result)
+            results["uncrawled_domains"] = work_queue.qsize()
+            if results["uncrawled_domains"]:
+                logger.warning(f"{results['uncrawled_domains']} domains not crawled.")
             
-            # Update statistics
-            if result.success:
-                results["successful_crawls"] += 1
-                results["total_cookies"] += result.cookies_collected
-                
-                if result.consent_data:
-                    results["domains_with_consent_data"] += 1
-                
-                cmp_type = result.cmp_type
-                results["cmp_types"][cmp_type] = results["cmp_types"].get(cmp_type, 0) + 1
-            else:
-                results["failed_crawls"] += 1
-                logger.warning(f"Failed to crawl {domain}: {result.error_message}")
+            if seen_filter is not None and seen_filter.path:
+                seen_filter.save()
             
-            # Small delay between crawls
-            time.sleep(1)
+            self.browser_pool.close()
+            self.remove_profiles()
+            if self.supervised:
+                reap_orphaned_browsers(start_time, self._crawl_marker)
+        
+        if writer.error is not None:
+            raise RuntimeError(f"Crawl stopped, {writer.unwritten} crawl results could not be "
+                               f"written to {self.db_path}: {writer.error}") from writer.error
         
         elapsed = time.time() - start_time
         results["crawl_time_seconds"] = elapsed
@@ -407,3 +1372,26 @@ class ConsentCrawler:
         logger.info(f"Results: {results['successful_crawls']} successful, {results['failed_crawls']} failed")
         
         return results
+
+
+def _supervised_worker_main(settings: Dict[str, Any], conn) -> None:
+    """
+    Entry point of a supervised worker process: crawl the domains received on conn
+    with a single pooled browser and send back each CrawlResult, until a None task.
+    
+    @param settings: ConsentCrawler arguments, see ConsentCrawler.worker_settings
+    @param conn: pipe to the supervisor
+    """
+    crawler = ConsentCrawler(**settings)
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            domain, cmp_hint = task
+            conn.send(crawler.crawl_domain(domain, cmp_hint=cmp_hint))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        crawler.browser_pool.close()
+        crawler.remove_profiles()
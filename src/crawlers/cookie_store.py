@@ -0,0 +1,87 @@
+import os
+import shutil
+import sqlite3
+import logging
+import tempfile
+from urllib.parse import unquote
+from typing import List, Dict, Any, Iterable, Optional
+
+logger = logging.getLogger("consent-crawl")
+
+# Files of the cookie database of a Firefox profile, copied together so that
+# changes still in the write-ahead log are included
+COOKIE_STORE_FILES = ("cookies.sqlite", "cookies.sqlite-wal")
+
+# moz_cookies.sameSite values (nsICookie::SAMESITE_*)
+SAME_SITE_NAMES = {0: "None", 1: "Lax", 2: "Strict"}
+
+# Expiry values above this are in milliseconds (newer Firefox versions) instead of seconds
+EXPIRY_MS_THRESHOLD = 10 ** 11
+
+
+def read_cookie_store(profile_dir: str, since: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Read all cookies of a running browser from the cookies.sqlite of its profile, in one
+    query, including third-party and partitioned cookies of embedded frames. The database
+    is copied first, since the browser keeps it locked. Cookies set in the last moments
+    may not be written yet, and session cookies are not stored at all, so the result is
+    meant to be merged with driver.get_cookies() (see merge_cookie_jars).
+
+    @param profile_dir: profile directory of the browser, from its moz:profile capability
+    @param since: only cookies created at or after this time (seconds since the epoch), to
+                  skip those of earlier visits whose removal is not written to the file yet
+    @return: cookies in the format of driver.get_cookies(), with the partition key if partitioned
+    """
+    if not os.path.exists(os.path.join(profile_dir, COOKIE_STORE_FILES[0])):
+        return []
+
+    copy_dir = tempfile.mkdtemp(prefix="consent-cookies-")
+    try:
+        for name in COOKIE_STORE_FILES:
+            source = os.path.join(profile_dir, name)
+            if os.path.exists(source):
+                shutil.copyfile(source, os.path.join(copy_dir, name))
+
+        conn = sqlite3.connect(os.path.join(copy_dir, COOKIE_STORE_FILES[0]))
+        try:
+            # creationTime is in microseconds
+            rows = conn.execute("SELECT name, value, host, path, expiry, isSecure, isHttpOnly, "
+                                "sameSite, originAttributes FROM moz_cookies WHERE creationTime >= ?",
+                                (int((since or 0) * 1000000),)).fetchall()
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(copy_dir, ignore_errors=True)
+
+    cookies = []
+    for name, value, host, path, expiry, secure, http_only, same_site, origin_attributes in rows:
+        cookie = {
+            "name": name,
+            "value": value,
+            "domain": host,
+            "path": path,
+            "secure": bool(secure),
+            "httpOnly": bool(http_only),
+            "sameSite": SAME_SITE_NAMES.get(same_site, "None")
+        }
+        if expiry:
+            cookie["expiry"] = expiry // 1000 if expiry > EXPIRY_MS_THRESHOLD else expiry
+        # e.g. "^partitionKey=(https,example.com)" for third-party cookies under dFPI
+        if origin_attributes and "partitionKey=" in origin_attributes:
+            cookie["partitionKey"] = unquote(origin_attributes.split("partitionKey=", 1)[1].split("&", 1)[0])
+        cookies.append(cookie)
+    return cookies
+
+
+def merge_cookie_jars(primary: Iterable[Dict[str, Any]],
+                      secondary: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Union of two cookie lists, keyed on name, domain and path (and partition key).
+    Cookies of the primary list win over cookies of the secondary one.
+    """
+    merged = {}
+    for cookie in secondary:
+        merged[(cookie.get("name"), cookie.get("domain"), cookie.get("path"), cookie.get("partitionKey"))] = cookie
+    for cookie in primary:
+        merged[(cookie.get("name"), cookie.get("domain"), cookie.get("path"), cookie.get("partitionKey"))] = cookie
+    return list(merged.values())
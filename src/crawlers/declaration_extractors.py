@@ -0,0 +1,151 @@
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from bs4 import BeautifulSoup, Tag
+
+# Declaration extractors of the supported CMPs. They run over the banner and declaration
+# regions serialized from the page (SNAPSHOT_SCRIPT in consent_crawler.py), both during
+# a visit and when replaying recorded snapshots, and return all rows of the page as
+# {name, domain, category, purpose, cmp} dicts.
+
+
+def regions_soup(regions: List[str]) -> BeautifulSoup:
+    """Parse serialized regions into one document"""
+    return BeautifulSoup("<html><body>" + "".join(regions) + "</body></html>", "html.parser")
+
+
+def text(el: Optional[Tag]) -> str:
+    """textContent of an element with whitespace collapsed"""
+    return re.sub(r"\s+", " ", el.get_text() if el is not None else "").strip()
+
+
+class _Rows:
+    """Declaration rows, deduplicated on name, domain and category"""
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self._seen = set()
+
+    def add(self, row: Dict[str, Any]) -> None:
+        key = (row["name"], row["domain"], row["category"])
+        if key not in self._seen:
+            self._seen.add(key)
+            self.rows.append(row)
+
+
+def extract_cookiebot(soup: BeautifulSoup) -> List[Dict[str, Any]]:
+    """Cookiebot: attribute-tagged elements and the CookieDeclaration tables"""
+    rows = _Rows()
+    for el in soup.select("[data-cookiefirst-category]"):
+        rows.add({
+            "name": el.get("data-cookiefirst-name") or "unknown",
+            "domain": el.get("data-cookiefirst-domain") or "unknown",
+            "category": el.get("data-cookiefirst-category") or "unknown",
+            "purpose": text(el) or "No description",
+            "cmp": "cookiebot"
+        })
+    for section in soup.select(".CookieDeclarationType"):
+        header = text(section.select_one(".CookieDeclarationTypeHeader"))
+        category = re.sub(r"\s*\(\d+\)$", "", header) or "unknown"
+        for tr in section.select(".CookieDeclarationTable tbody tr"):
+            cells = tr.select("td")
+            if len(cells) < 3:
+                continue
+            rows.add({
+                "name": text(cells[0]) or "unknown",
+                "domain": text(cells[1]) or "unknown",
+                "category": category,
+                "purpose": text(cells[2]) or "No description",
+                "cmp": "cookiebot"
+            })
+    return rows.rows
+
+
+def extract_onetrust(soup: BeautifulSoup) -> List[Dict[str, Any]]:
+    """OneTrust: cookie list of the cookie policy / preference center"""
+    rows = _Rows()
+    for el in soup.select(".ot-sdk-cookie"):
+        name = el.select_one(".ot-sdk-cookie-policy-name")
+        if name is None:
+            continue
+        rows.add({
+            "name": text(name) or "unknown",
+            "domain": el.get("data-domain") or "unknown",
+            "category": text(el.select_one(".ot-sdk-cookie-policy-category")) or "unknown",
+            "purpose": text(el.select_one(".ot-sdk-cookie-policy-description")) or "No description",
+            "cmp": "onetrust"
+        })
+    return rows.rows
+
+
+def _heading(table: Tag) -> str:
+    """
+    Closest preceding heading of a table within its recorded region, or the heading
+    outside the region recorded with the snapshot
+    """
+    el = table
+    while el is not None and el.parent is not None and el.parent.name not in ("body", "[document]"):
+        for sib in el.find_previous_siblings(True):
+            if re.fullmatch(r"h[1-6]", sib.name):
+                return text(sib)
+        el = el.parent
+    return table.get("data-snapshot-heading", "")
+
+
+def _column(headers: List[str], pattern: str) -> int:
+    return next((i for i, h in enumerate(headers) if re.search(pattern, h)), -1)
+
+
+def extract_termly(soup: BeautifulSoup) -> List[Dict[str, Any]]:
+    """
+    Termly: cookie tables inside Termly-rendered content, columns matched by header,
+    the category taken from the closest preceding heading
+    """
+    rows = _Rows()
+    seen = set()
+    for table in soup.select("[class*='termly'] table, [id*='termly'] table"):
+        if id(table) in seen:
+            continue
+        seen.add(id(table))
+        headers = [text(th).lower() for th in table.select("th")]
+        name_col = _column(headers, "name|cookie")
+        if name_col < 0:
+            continue
+        domain_col = _column(headers, "domain|provider|host")
+        purpose_col = _column(headers, "purpose|description")
+        category_col = _column(headers, "category|type")
+        category = _heading(table)
+        for tr in table.select("tbody tr"):
+            cells = tr.select("td")
+            if len(cells) <= name_col:
+                continue
+
+            def cell(i):
+                return text(cells[i]) if 0 <= i < len(cells) else ""
+
+            rows.add({
+                "name": cell(name_col) or "unknown",
+                "domain": cell(domain_col) or "unknown",
+                "category": cell(category_col) or category or "unknown",
+                "purpose": cell(purpose_col) or "No description",
+                "cmp": "termly"
+            })
+    return rows.rows
+
+
+DECLARATION_EXTRACTORS: Dict[str, Callable[[BeautifulSoup], List[Dict[str, Any]]]] = {
+    "cookiebot": extract_cookiebot,
+    "onetrust": extract_onetrust,
+    "termly": extract_termly
+}
+
+
+def extract_declarations(cmp_type: str, regions: List[str]) -> List[Dict[str, Any]]:
+    """
+    Extract the cookie declarations of a CMP from the serialized regions of a page.
+
+    @param cmp_type: key of DECLARATION_EXTRACTORS
+    @param regions: outer HTML of the regions, as returned by SNAPSHOT_SCRIPT
+    @return: declaration rows with name, domain, category, purpose and cmp
+    """
+    return DECLARATION_EXTRACTORS[cmp_type](regions_soup(regions))
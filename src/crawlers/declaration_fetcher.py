@@ -0,0 +1,251 @@
+import re
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, quote
+from typing import Dict, List, Any, Optional, Tuple
+
+import requests
+
+from .result_writer import connect_wal, write_results
+from .shared_utils import init_crawl_database, CrawlResult, DECLARATION_PROFILE, request_headers
+
+logger = logging.getLogger("declaration-fetch")
+
+# CDNs serving the declarations, overridable e.g. with a local stand-in server
+DEFAULT_CDN_BASES = {
+    "cookiebot": "https://consent.cookiebot.com",
+    "onetrust": "https://cdn.cookielaw.org"
+}
+
+# Cookiebot cc.js assigns one JSON array of cookie entries per declaration category:
+# [[name, host, purpose, expiry, type, ...], ...]
+cb_table_pattern = re.compile(
+    r"CookieConsentDialog\.cookieTable(Necessary|Preference|Statistics|Advertising|Unclassified)"
+    r"\s*=\s*(\[.*?\]);\s*(?=CookieConsentDialog\.|$)", re.DOTALL | re.MULTILINE)
+
+# Category names as shown in the Cookiebot declaration, like the browser extractor records them
+CB_CATEGORIES = {
+    "Necessary": "Necessary",
+    "Preference": "Preferences",
+    "Statistics": "Statistics",
+    "Advertising": "Marketing",
+    "Unclassified": "Unclassified"
+}
+
+# OneTrust default group ids, for groups without a name
+OT_GROUP_NAMES = {
+    "C0001": "Strictly Necessary Cookies",
+    "C0002": "Performance Cookies",
+    "C0003": "Functional Cookies",
+    "C0004": "Targeting Cookies",
+    "C0005": "Social Media Cookies"
+}
+
+html_tag_pattern = re.compile(r"<[^>]+>")
+
+
+def strip_html(text: Optional[str]) -> str:
+    """Plain text of a purpose description that may contain markup"""
+    return re.sub(r"\s+", " ", html_tag_pattern.sub(" ", text or "")).strip()
+
+
+def parse_cookiebot_declaration(script: str) -> List[Dict[str, Any]]:
+    """
+    Parse the cookie tables of a Cookiebot cc.js response.
+
+    @param script: body of cc.js
+    @return: declaration rows with name, domain, category, purpose and cmp
+    """
+    rows = []
+    for table, data in cb_table_pattern.findall(script):
+        try:
+            entries = json.loads(data)
+        except json.JSONDecodeError as e:
+            logger.debug(f"Unparseable Cookiebot table {table}: {e}")
+            continue
+        for entry in entries:
+            if not isinstance(entry, list) or not entry:
+                continue
+            rows.append({
+                "name": entry[0] or "unknown",
+                "domain": (entry[1] if len(entry) > 1 else None) or "unknown",
+                "category": CB_CATEGORIES[table],
+                "purpose": strip_html(entry[2] if len(entry) > 2 else None) or "No description",
+                "cmp": "cookiebot"
+            })
+    return rows
+
+
+def parse_onetrust_declaration(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Parse the cookie groups of a OneTrust language file, including subgroups.
+
+    @param data: decoded {ruleset}/{language}.json
+    @return: declaration rows with name, domain, category, purpose and cmp
+    """
+    rows = []
+    groups = list((data.get("DomainData") or {}).get("Groups") or [])
+    while groups:
+        group = groups.pop(0)
+        groups.extend(group.get("SubGroups") or [])
+        category = (group.get("GroupName") or OT_GROUP_NAMES.get(group.get("OptanonGroupId"))
+                    or "unknown")
+        cookies = list(group.get("FirstPartyCookies") or [])
+        for host in group.get("Hosts") or []:
+            cookies.extend(dict(c, Host=c.get("Host") or host.get("HostName")) for c in host.get("Cookies") or [])
+        for cookie in cookies:
+            rows.append({
+                "name": cookie.get("Name") or "unknown",
+                "domain": cookie.get("Host") or "unknown",
+                "category": category,
+                "purpose": strip_html(cookie.get("description") or cookie.get("Description")) or "No description",
+                "cmp": "onetrust"
+            })
+    return rows
+
+
+def select_onetrust_ruleset(config: Dict[str, Any], language: str) -> Tuple[str, str]:
+    """
+    Ruleset and language file of a OneTrust site config: the default (global) ruleset,
+    in the requested language if it is offered, otherwise the ruleset's default language.
+
+    @param config: decoded {id}.json
+    @param language: preferred language code
+    @return: ruleset id and language code
+    """
+    rulesets = config.get("RuleSet") or []
+    if not rulesets:
+        raise ValueError("no rulesets in OneTrust config")
+    ruleset = next((r for r in rulesets if r.get("Default") or r.get("Global")), rulesets[0])
+    languages = ruleset.get("LanguageSwitcherPlaceholder") or {}
+    return ruleset["Id"], languages.get(language) or languages.get("default") or language
+
+
+class DeclarationFetcher:
+    """
+    Fetches the cookie declarations of Cookiebot and OneTrust sites directly from the
+    CMP's CDN, keyed by the site IDs found in the presence crawl, without a browser.
+    The declarations are written as consent_data rows, like those of the consent crawler.
+    """
+
+    def __init__(self, num_threads: int = 16, timeout: float = 30,
+                 cdn_bases: Optional[Dict[str, str]] = None, language: str = "en"):
+        """
+        @param num_threads: number of concurrent requests
+        @param timeout: seconds before a request fails
+        @param cdn_bases: base URL of each CMP's CDN, defaults to DEFAULT_CDN_BASES
+        @param language: preferred language of OneTrust declarations
+        """
+        self.num_threads = num_threads
+        self.timeout = timeout
+        self.cdn_bases = {**DEFAULT_CDN_BASES, **(cdn_bases or {})}
+        self.language = language
+        self._sessions = threading.local()
+
+    def _get(self, url: str) -> requests.Response:
+        """GET with the session of the current thread, raising on HTTP errors"""
+        session = getattr(self._sessions, "session", None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+            session.headers.update(request_headers)
+        r = session.get(url, timeout=self.timeout)
+        r.raise_for_status()
+        return r
+
+    def fetch_cookiebot(self, site_id: str, url: str) -> List[Dict[str, Any]]:
+        """
+        Cookie declaration of a Cookiebot site. The cc.js served for the site ID
+        depends on the referring domain, so the site's host is passed along.
+
+        @param site_id: Cookiebot cbid
+        @param url: url of the site
+        @return: declaration rows
+        """
+        host = urlsplit(url).hostname or url
+        r = self._get(f"{self.cdn_bases['cookiebot']}/{site_id}/cc.js?renew=false"
+                      f"&referer={quote(host)}&dnt=false&init=false")
+        return parse_cookiebot_declaration(r.text)
+
+    def fetch_onetrust(self, site_id: str) -> List[Dict[str, Any]]:
+        """
+        Cookie declaration of a OneTrust site, from the language file of its default ruleset.
+
+        @param site_id: OneTrust domain script id
+        @return: declaration rows
+        """
+        base = f"{self.cdn_bases['onetrust']}/consent/{site_id}"
+        ruleset, language = select_onetrust_ruleset(self._get(f"{base}/{site_id}.json").json(), self.language)
+        return parse_onetrust_declaration(self._get(f"{base}/{ruleset}/{language}.json").json())
+
+    def fetch(self, url: str, cmp_type: str, site_id: str) -> CrawlResult:
+        """
+        Fetch the declaration of one site.
+
+        @param url: url of the site
+        @param cmp_type: cookiebot or onetrust
+        @param site_id: site ID from the presence crawl
+        @return: result with the declaration rows as consent_data, failed if the fetch or parsing failed
+        """
+        try:
+            if cmp_type == "cookiebot":
+                rows = self.fetch_cookiebot(site_id, url)
+            elif cmp_type == "onetrust":
+                rows = self.fetch_onetrust(site_id)
+            else:
+                raise ValueError(f"no declaration source for CMP type {cmp_type}")
+        except (requests.RequestException, ValueError, KeyError, IndexError,
+                AttributeError, TypeError) as e:
+            # Malformed or unexpectedly shaped files fail this site only, not the whole fetch
+            logger.debug(f"Declaration fetch failed for {url}: {e}")
+            return CrawlResult(domain=url, success=False, cmp_type=cmp_type, cookies_collected=0,
+                               consent_data=[], error_message=f"Declaration fetch failed: {e}",
+                               profile=DECLARATION_PROFILE)
+
+        logger.debug(f"Fetched {len(rows)} {cmp_type} declarations for {url}")
+        return CrawlResult(domain=url, success=True, cmp_type=cmp_type, cookies_collected=0,
+                           consent_data=rows, profile=DECLARATION_PROFILE)
+
+    def fetch_all(self, site_ids: Dict[str, Tuple[str, str]], db_path: str,
+                  batch_size: int = 100) -> Dict[str, Any]:
+        """
+        Fetch the declarations of all sites concurrently and write them to a crawl
+        database, in transactions of batch_size results.
+
+        @param site_ids: mapping of url to (CMP type, site ID), see shared_utils.retrieve_cmp_site_ids
+        @param db_path: crawl database, created if needed
+        @param batch_size: number of results per transaction
+        @return: summary statistics
+        """
+        init_crawl_database(db_path)
+        stats = {"total_sites": len(site_ids), "fetched": 0, "failed": 0, "declarations": 0,
+                 "empty": 0, "cmp_types": {}}
+
+        conn = connect_wal(db_path)
+        pending: List[CrawlResult] = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+                futures = [pool.submit(self.fetch, url, cmp_type, site_id)
+                           for url, (cmp_type, site_id) in site_ids.items()]
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result.success:
+                        stats["fetched"] += 1
+                        stats["declarations"] += len(result.consent_data)
+                        stats["empty"] += not result.consent_data
+                        stats["cmp_types"][result.cmp_type] = stats["cmp_types"].get(result.cmp_type, 0) + 1
+                    else:
+                        stats["failed"] += 1
+                    pending.append(result)
+                    if len(pending) >= batch_size:
+                        write_results(conn, pending)
+                        pending = []
+            if pending:
+                write_results(conn, pending)
+        finally:
+            conn.close()
+
+        logger.info(f"Fetched {stats['declarations']} declarations of {stats['fetched']} sites, "
+                    f"{stats['failed']} failed")
+        return stats
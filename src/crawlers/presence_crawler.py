@@ -1,16 +1,26 @@
 import requests
 import requests.exceptions as rexcepts
 import re
+import os
+import html
 import logging
+import sqlite3
 import time
+from datetime import datetime
 from enum import IntEnum
-from urllib.parse import urlparse
+from http.cookiejar import http2time
+from multiprocessing import Manager
+from urllib.parse import urlparse, urljoin
 from typing import List, Tuple, Optional, Dict, Any
 from concurrent.futures import TimeoutError as CTimeoutError
 
 from pebble import ProcessPool
 from pebble.common import ProcessExpired
 
+from .shared_utils import (PRESENCE_RESULT_FILES, CMP_SITE_IDS_FILE, init_crawl_database, cookie_rows,
+                           COOKIE_INSERT_SQL, request_headers)
+from .seen_filter import SeenDomainFilter, apply_seen_filter
+
 logger = logging.getLogger("presence-crawl")
 
 # Cookiebot CDN domain patterns
@@ -31,10 +41,43 @@ onetrust_patterns = (
 # Termly CDN domain
 termly_url_pattern = re.compile(r"https://app\.termly\.io/", re.IGNORECASE)
 
+
+
+def cookiebot_referenced(psource: str) -> bool:
+    """Whether page or script source references the Cookiebot CDN"""
+    return cb_base_pat.search(psource) is not None or cb_script_name.search(psource) is not None
+
+
+def onetrust_referenced(psource: str) -> bool:
+    """Whether page or script source references a OneTrust CDN"""
+    return any(pattern.search(psource) for pattern in onetrust_patterns)
+
+
+def termly_referenced(psource: str) -> bool:
+    """Whether page or script source references the Termly CDN"""
+    return termly_url_pattern.search(psource) is not None
+
+
+# Site IDs in the CMP loader tags, which key the declarations on the CMP's CDN
+uuid_pattern = r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+cb_site_id_pattern = re.compile(
+    rf"(?:data-cbid\s*=\s*[\"']|[?&](?:amp;)?cbid=|consent\.cookiebot\.(?:com|eu)/)({uuid_pattern})", re.IGNORECASE)
+onetrust_site_id_pattern = re.compile(
+    rf"(?:data-domain-script\s*=\s*[\"']|/consent/)({uuid_pattern}(?:-test)?)", re.IGNORECASE)
+
+# External scripts and tag manager containers, for the second-level presence check
+script_src_pattern = re.compile(r"<script[^>]+?src\s*=\s*[\"']([^\"']+)[\"']", re.IGNORECASE)
+gtm_id_pattern = re.compile(r"\bGTM-[A-Z0-9]{4,10}\b")
+gtm_container_url = "https://www.googletagmanager.com/gtm.js?id={}"
+
 # Timeout settings
 connect_timeout = 20
 load_timeout = 30
 parse_timeout = 120
+script_timeout = 10
+
+# Upper bound on the bytes read from a single external script
+max_script_bytes = 2 * 1024 * 1024
 
 # Configuration
 check_cmp = True
@@ -54,12 +97,108 @@ class QuickCrawlResult(IntEnum):
     TERMLY = 7
 
 
+# Result category names, as used in the results dictionary and output files
+RESULT_CATEGORIES = {
+    QuickCrawlResult.COOKIEBOT: 'cookiebot',
+    QuickCrawlResult.ONETRUST: 'onetrust',
+    QuickCrawlResult.TERMLY: 'termly',
+    QuickCrawlResult.NOCMP: 'nocmp',
+    QuickCrawlResult.BOT: 'bot',
+    QuickCrawlResult.HTTP_ERROR: 'http_error'
+}
+
+
+def parse_set_cookie(header: str, response_url: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a single Set-Cookie header value into the cookie format returned by WebDriver.
+    
+    @param header: Set-Cookie header value
+    @param response_url: url of the response that set the cookie, for default domain and path
+    @return: cookie dictionary, or None if the header is malformed
+    """
+    parts = header.split(";")
+    name, sep, value = parts[0].partition("=")
+    name = name.strip()
+    if not sep or not name:
+        return None
+    
+    url_parts = urlparse(response_url)
+    cookie = {
+        "name": name,
+        "value": value.strip(),
+        "domain": url_parts.hostname or "",
+        "path": url_parts.path[:url_parts.path.rfind("/")] or "/",
+        "secure": False,
+        "httpOnly": False,
+        "sameSite": None
+    }
+    
+    max_age = None
+    expires = None
+    for attribute in parts[1:]:
+        key, _, attr_value = attribute.partition("=")
+        key = key.strip().lower()
+        attr_value = attr_value.strip()
+        if key == "domain" and attr_value:
+            cookie["domain"] = "." + attr_value.lstrip(".").lower()
+        elif key == "path" and attr_value.startswith("/"):
+            cookie["path"] = attr_value
+        elif key == "secure":
+            cookie["secure"] = True
+        elif key == "httponly":
+            cookie["httpOnly"] = True
+        elif key == "samesite" and attr_value:
+            cookie["sameSite"] = attr_value.capitalize()
+        elif key == "max-age":
+            try:
+                max_age = int(attr_value)
+            except ValueError:
+                pass
+        elif key == "expires":
+            expires = http2time(attr_value)
+    
+    # Max-Age takes precedence over Expires, session cookies have no expiry
+    if max_age is not None:
+        cookie["expiry"] = int(time.time()) + max_age
+    elif expires is not None:
+        cookie["expiry"] = int(expires)
+    
+    return cookie
+
+
+def harvest_set_cookies(resp: requests.Response) -> List[Dict[str, Any]]:
+    """
+    Collect the cookies set by every response along the redirect chain.
+    
+    @param resp: final response, with the redirects in resp.history
+    @return: parsed cookies in the order they were set
+    """
+    cookies = []
+    for hop in list(resp.history) + [resp]:
+        if hop.raw is None:
+            continue
+        for header in hop.raw.headers.getlist("Set-Cookie"):
+            cookie = parse_set_cookie(header, hop.url)
+            if cookie is not None:
+                cookies.append(cookie)
+    return cookies
+
+
 class PresenceCrawler:
     """Fast HTTP-based crawler to check CMP presence on websites"""
     
-    def __init__(self, num_threads: int = 4, output_dir: str = "./data/results"):
+    def __init__(self, num_threads: int = 4, output_dir: str = "./data/results",
+                 scan_scripts: int = 0, harvest_cookies: bool = False):
         self.num_threads = num_threads
         self.output_dir = output_dir
+        self.scan_scripts = scan_scripts
+        self.harvest_cookies = harvest_cookies
+        self.cookie_db_path: Optional[str] = None
+        # Final url -> (CMP category, site ID) of CMP-positive pages whose site ID was found,
+        # set once crawl_domains is done: the instance is pickled into every pool task
+        self.site_ids: Dict[str, Tuple[str, str]] = {}
+        # Script URL -> CMP verdict, shared across worker processes during a crawl
+        self._script_cache: Dict[str, int] = {}
         self.setup_logger()
     
     def setup_logger(self):
@@ -75,29 +214,105 @@ class PresenceCrawler:
     
     def check_cookiebot_presence(self, resp: requests.Response) -> bool:
         """Check whether Cookiebot is referenced on the website"""
-        psource = resp.text
-        return (cb_base_pat.search(psource) is not None or 
-                cb_script_name.search(psource) is not None)
+        return cookiebot_referenced(resp.text)
     
     def check_onetrust_presence(self, resp: requests.Response) -> bool:
         """Check whether a OneTrust pattern is referenced on the website"""
-        psource = resp.text
-        for pattern in onetrust_patterns:
-            if pattern.search(psource):
-                return True
-        return False
+        return onetrust_referenced(resp.text)
     
     def check_termly_presence(self, resp: requests.Response) -> bool:
         """Check whether a Termly pattern is referenced on the website"""
-        psource = resp.text
-        return termly_url_pattern.search(psource) is not None
+        return termly_referenced(resp.text)
     
-    def run_reachability_check(self, input_domain: str) -> Tuple[Optional[str], int]:
+    def classify_source(self, psource: str) -> QuickCrawlResult:
+        """
+        Match page or script source against the CMP patterns.
+        Cookiebot takes precedence over OneTrust, OneTrust over Termly.
+        
+        @param psource: HTML or JavaScript source
+        @return: CMP result code, or NOCMP if no pattern matched
+        """
+        if cookiebot_referenced(psource):
+            return QuickCrawlResult.COOKIEBOT
+        if onetrust_referenced(psource):
+            return QuickCrawlResult.ONETRUST
+        if termly_referenced(psource):
+            return QuickCrawlResult.TERMLY
+        return QuickCrawlResult.NOCMP
+    
+    def fetch_script_verdict(self, script_url: str) -> QuickCrawlResult:
+        """
+        Download an external script (up to max_script_bytes) and match it against the CMP patterns.
+        
+        @param script_url: absolute script url
+        @return: CMP result code, NOCMP if nothing matched or the script could not be retrieved
+        """
+        try:
+            with requests.get(script_url, timeout=(connect_timeout, script_timeout),
+                              headers=request_headers, stream=True) as r:
+                if not r.ok:
+                    return QuickCrawlResult.NOCMP
+                content = r.raw.read(max_script_bytes, decode_content=True)
+        except Exception as ex:
+            if debug_mode:
+                logger.debug(f"Failed to retrieve script '{script_url}': {ex}")
+            return QuickCrawlResult.NOCMP
+        return self.classify_source(content.decode("utf-8", errors="ignore"))
+    
+    def scan_external_scripts(self, psource: str, base_url: str) -> QuickCrawlResult:
+        """
+        Second-level presence check: look for CMP loaders inside the external scripts of a page,
+        such as tag manager containers or bundled libraries. At most self.scan_scripts scripts
+        are checked per page, and verdicts are cached by script url for the whole run.
+        
+        @param psource: HTML of the page
+        @param base_url: final url of the page, to resolve relative script paths
+        @return: CMP result code, or NOCMP if no script references a supported CMP
+        """
+        # Tag manager containers first, they are the most common indirect CMP loaders
+        candidates = [gtm_container_url.format(gtm_id) for gtm_id in gtm_id_pattern.findall(psource)]
+        for src in script_src_pattern.findall(psource):
+            candidates.append(urljoin(base_url, html.unescape(src.strip())))
+        
+        script_urls = []
+        for url in candidates:
+            if url.startswith(("http://", "https://")) and url not in script_urls:
+                script_urls.append(url)
+        
+        for script_url in script_urls[:self.scan_scripts]:
+            verdict = self._script_cache.get(script_url)
+            if verdict is None:
+                verdict = self.fetch_script_verdict(script_url)
+                self._script_cache[script_url] = int(verdict)
+            if verdict != QuickCrawlResult.NOCMP:
+                if debug_mode:
+                    logger.debug(f"CMP found in external script '{script_url}'")
+                return QuickCrawlResult(verdict)
+        
+        return QuickCrawlResult.NOCMP
+    
+    def extract_site_id(self, psource: str, verdict: QuickCrawlResult) -> Optional[str]:
+        """
+        Extract the site ID of a Cookiebot (cbid) or OneTrust (data-domain-script) loader tag,
+        under which the CMP's CDN serves the cookie declaration of the site.
+        
+        @param psource: HTML of the page
+        @param verdict: CMP detected on the page
+        @return: site ID, or None if the CMP has none or it is not in the page source
+        """
+        pattern = {QuickCrawlResult.COOKIEBOT: cb_site_id_pattern,
+                   QuickCrawlResult.ONETRUST: onetrust_site_id_pattern}.get(verdict)
+        match = pattern.search(psource) if pattern is not None else None
+        return match.group(1).lower() if match else None
+    
+    def run_reachability_check(self, input_domain: str) -> Tuple[Optional[str], int, List[Dict[str, Any]], Optional[str]]:
         """
         Try to retrieve the webpage at the given domain and detect CMP presence.
         
         @param input_domain: domain to attempt to connect to
-        @return: Tuple of (final_url, status_code)
+        @return: Tuple of (final_url, status_code, cookies, site_id), where cookies holds the parsed
+                 Set-Cookie headers of the redirect chain if harvest_cookies is enabled, and
+                 site_id the Cookiebot or OneTrust site ID found in the page, if any
         """
         # Handle URL prefixes
         component_tuple = urlparse(input_domain)
@@ -116,15 +331,12 @@ class PresenceCrawler:
             completed_url = prefix + url_suffix
             
             try:
-                headers = {
-                    'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"
-                }
-                r = requests.get(completed_url, timeout=(connect_timeout, load_timeout), headers=headers)
+                r = requests.get(completed_url, timeout=(connect_timeout, load_timeout), headers=request_headers)
             except (rexcepts.TooManyRedirects, rexcepts.SSLError, 
                     rexcepts.URLRequired, rexcepts.MissingSchema):
                 if debug_mode:
                     logger.debug(f"SSL/Schema error for: '{completed_url}'")
-                return input_domain, QuickCrawlResult.CONNECT_FAIL
+                return input_domain, QuickCrawlResult.CONNECT_FAIL, [], None
             except (rexcepts.ConnectionError, rexcepts.Timeout):
                 if debug_mode:
                     logger.debug(f"Connection/timeout error for: '{completed_url}'")
@@ -132,42 +344,46 @@ class PresenceCrawler:
             except Exception as ex:
                 if debug_mode:
                     logger.error(f"Unexpected error for '{completed_url}': {ex}")
-                return input_domain, QuickCrawlResult.CONNECT_FAIL
+                return input_domain, QuickCrawlResult.CONNECT_FAIL, [], None
             
             if r is None:
                 continue
-            elif not r.ok:
+            
+            cookies = harvest_set_cookies(r) if self.harvest_cookies else []
+            if not r.ok:
                 # Bot detection responses
                 if r.status_code in (403, 406):
-                    return completed_url, QuickCrawlResult.BOT
+                    return completed_url, QuickCrawlResult.BOT, cookies, None
                 else:
-                    return completed_url, QuickCrawlResult.HTTP_ERROR
+                    return completed_url, QuickCrawlResult.HTTP_ERROR, cookies, None
             else:
                 final_url = r.url
                 break
         
         # Check for CMP presence if we got a successful response
         if final_url is not None and check_cmp and r is not None:
-            # Check each CMP type
-            if self.check_cookiebot_presence(r):
-                return final_url, QuickCrawlResult.COOKIEBOT
-            elif self.check_onetrust_presence(r):
-                return final_url, QuickCrawlResult.ONETRUST
-            elif self.check_termly_presence(r):
-                return final_url, QuickCrawlResult.TERMLY
-            else:
-                return final_url, QuickCrawlResult.NOCMP
+            # Check each CMP type, then fall back to the external scripts if enabled
+            verdict = self.classify_source(r.text)
+            if verdict == QuickCrawlResult.NOCMP and self.scan_scripts > 0:
+                verdict = self.scan_external_scripts(r.text, final_url)
+            return final_url, verdict, cookies, self.extract_site_id(r.text, verdict)
         elif final_url is not None:
-            return final_url, QuickCrawlResult.OK
+            return final_url, QuickCrawlResult.OK, cookies, None
         else:
-            return input_domain, QuickCrawlResult.CONNECT_FAIL
+            return input_domain, QuickCrawlResult.CONNECT_FAIL, [], None
     
-    def crawl_domains(self, domains: List[str], batches: int = 1) -> Dict[str, List[str]]:
+    def crawl_domains(self, domains: List[str], batches: int = 1,
+                      seen_filter: Optional[SeenDomainFilter] = None,
+                      defer_seen: bool = False,
+                      time_budget: Optional[float] = None) -> Dict[str, List[str]]:
         """
-        Crawl a list of domains using multiprocessing.
+        Crawl a list of domains using multiprocessing, in the given order.
         
         @param domains: list of domains to crawl
         @param batches: number of batches to split processing into
+        @param seen_filter: cross-run filter of recently crawled domains, updated with reachable domains
+        @param defer_seen: crawl recently crawled domains last instead of skipping them
+        @param time_budget: stop after this many seconds, remaining domains are reported as uncrawled
         @return: dictionary mapping result types to lists of URLs
         """
         results = {
@@ -181,8 +397,12 @@ class PresenceCrawler:
             'timeout': []
         }
         
+        domains = apply_seen_filter(domains, seen_filter, defer_seen)
+        
         logger.info(f"Starting crawl of {len(domains)} domains with {self.num_threads} threads")
         start_time = time.time()
+        deadline = start_time + time_budget if time_budget else None
+        budget_exhausted = False
         
         # Split into batches
         num_sites = len(domains)
@@ -190,6 +410,20 @@ class PresenceCrawler:
         chunks = [domains[i:min(i+chunksize, num_sites)] for i in range(0, num_sites, chunksize)]
         
         finished_domains = set()
+        site_ids: Dict[str, Tuple[str, str]] = {}
+        self.site_ids = {}
+        
+        # Share the script verdict cache between worker processes
+        manager = None
+        if self.scan_scripts > 0:
+            manager = Manager()
+            self._script_cache = manager.dict()
+        
+        if self.harvest_cookies:
+            self.cookie_db_path = os.path.join(
+                self.output_dir, f"presence_cookies_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sqlite")
+            os.makedirs(self.output_dir, exist_ok=True)
+            init_crawl_database(self.cookie_db_path)
         
         try:
             with ProcessPool(self.num_threads) as pool:
@@ -200,10 +434,11 @@ class PresenceCrawler:
                     it = future.result()
                     
                     processed = 0
+                    harvested = []
                     try:
                         while True:
                             try:
-                                final_domain, status_code = next(it)
+                                final_domain, status_code, cookies, site_id = next(it)
                             except (CTimeoutError, ProcessExpired) as ex:
                                 logger.error(f"Process timeout/crash for domain {processed}: {ex}")
                                 results['timeout'].append(chunk[processed])
@@ -212,20 +447,14 @@ class PresenceCrawler:
                                 continue
                             
                             # Categorize results
-                            if status_code == QuickCrawlResult.COOKIEBOT:
-                                results['cookiebot'].append(final_domain)
-                            elif status_code == QuickCrawlResult.ONETRUST:
-                                results['onetrust'].append(final_domain)
-                            elif status_code == QuickCrawlResult.TERMLY:
-                                results['termly'].append(final_domain)
-                            elif status_code == QuickCrawlResult.NOCMP:
-                                results['nocmp'].append(final_domain)
-                            elif status_code == QuickCrawlResult.BOT:
-                                results['bot'].append(final_domain)
-                            elif status_code == QuickCrawlResult.HTTP_ERROR:
-                                results['http_error'].append(final_domain)
-                            else:
-                                results['failed'].append(final_domain)
+                            category = RESULT_CATEGORIES.get(status_code, 'failed')
+                            results[category].append(final_domain)
+                            if site_id is not None:
+                                site_ids[final_domain] = (category, site_id)
+                            if self.harvest_cookies and category != 'failed':
+                                harvested.append((final_domain, category, cookies))
+                            if seen_filter is not None and category != 'failed':
+                                seen_filter.add(chunk[processed])
                             
                             finished_domains.add(chunk[processed])
                             processed += 1
@@ -233,37 +462,76 @@ class PresenceCrawler:
                             # Progress reporting
                             if processed % 50 == 0:
                                 logger.info(f"Batch {batch_num}: {processed}/{len(chunk)} completed")
+                            
+                            # Stop handing out work once the time budget is spent
+                            if deadline is not None and time.time() >= deadline:
+                                budget_exhausted = True
+                                future.cancel()
+                                break
                     
                     except StopIteration:
                         logger.info(f"Completed batch {batch_num}: {processed} domains processed")
+                    finally:
+                        if harvested:
+                            self.save_harvested_cookies(harvested)
+                    
+                    if budget_exhausted:
+                        break
+            
+            if budget_exhausted:
+                results['uncrawled'] = [d for d in domains if d not in finished_domains]
+                logger.warning(f"Time budget of {time_budget}s reached. "
+                               f"{len(results['uncrawled'])} domains not processed.")
         
         except KeyboardInterrupt:
             remaining = set(domains) - finished_domains
             logger.warning(f"Crawl interrupted. {len(remaining)} domains not processed.")
             results['uncrawled'] = list(remaining)
+        finally:
+            if manager is not None:
+                logger.info(f"Script cache: {len(self._script_cache)} external scripts scanned")
+                self._script_cache = {}
+                manager.shutdown()
+            if seen_filter is not None and seen_filter.path:
+                seen_filter.save()
+        self.site_ids = site_ids
         
         elapsed = time.time() - start_time
         logger.info(f"Crawl completed in {elapsed:.2f}s")
         
         return results
     
+    def save_harvested_cookies(self, harvested: List[Tuple[str, str, List[Dict[str, Any]]]]) -> None:
+        """
+        Bulk insert harvested Set-Cookie data into the cookie database, using the
+        same schema as the consent crawler. Each crawled url gets a crawl_results row,
+        bot and HTTP error responses are recorded as unsuccessful.
+        
+        @param harvested: list of (final_url, category, cookies)
+        """
+        conn = sqlite3.connect(self.cookie_db_path)
+        cursor = conn.cursor()
+        
+        rows = []
+        for final_url, category, cookies in harvested:
+            error_message = category if category in ('bot', 'http_error') else None
+            cursor.execute("""
+                INSERT INTO crawl_results (domain, success, cmp_type, cookies_collected, error_message)
+                VALUES (?, ?, ?, ?, ?)
+            """, (final_url, error_message is None, category, len(cookies), error_message))
+            rows.extend(cookie_rows(cursor.lastrowid, cookies))
+        
+        cursor.executemany(COOKIE_INSERT_SQL, rows)
+        conn.commit()
+        conn.close()
+        
+        logger.info(f"Saved {len(rows)} Set-Cookie records for {len(harvested)} domains to {self.cookie_db_path}")
+    
     def save_results(self, results: Dict[str, List[str]]) -> None:
         """Save crawl results to output files"""
-        import os
         os.makedirs(self.output_dir, exist_ok=True)
         
-        file_mapping = {
-            'cookiebot': 'cookiebot_responses.txt',
-            'onetrust': 'onetrust_responses.txt', 
-            'termly': 'termly_responses.txt',
-            'nocmp': 'nocmp_responses.txt',
-            'failed': 'failed_urls.txt',
-            'http_error': 'http_responses.txt',
-            'bot': 'bot_responses.txt',
-            'timeout': 'crawler_timeouts.txt'
-        }
-        
-        for result_type, filename in file_mapping.items():
+        for result_type, filename in PRESENCE_RESULT_FILES.items():
             if result_type in results:
                 filepath = os.path.join(self.output_dir, filename)
                 with open(filepath, 'w') as f:
@@ -271,6 +539,22 @@ class PresenceCrawler:
                         f.write(url + "\n")
                 logger.info(f"Saved {len(results[result_type])} {result_type} results to {filepath}")
         
+        # Save combined results table (url,category), consumable by the consent crawler
+        table_path = os.path.join(self.output_dir, "presence_results.csv")
+        with open(table_path, 'w') as f:
+            for result_type in PRESENCE_RESULT_FILES:
+                for url in results.get(result_type, []):
+                    f.write(f"{url},{result_type}\n")
+        logger.info(f"Saved presence results table to {table_path}")
+        
+        # Save CMP site IDs (url,category,site ID), consumable by the declaration fetcher
+        if self.site_ids:
+            ids_path = os.path.join(self.output_dir, CMP_SITE_IDS_FILE)
+            with open(ids_path, 'w') as f:
+                for url, (category, site_id) in self.site_ids.items():
+                    f.write(f"{url},{category},{site_id}\n")
+            logger.info(f"Saved {len(self.site_ids)} CMP site IDs to {ids_path}")
+        
         # Save summary
         summary_path = os.path.join(self.output_dir, "crawl_summary.txt")
         with open(summary_path, 'w') as f:
@@ -286,4 +570,5 @@ class PresenceCrawler:
 def run_reachability_check(input_domain: str) -> Tuple[Optional[str], int]:
     """Standalone function for multiprocessing compatibility"""
     crawler = PresenceCrawler()
-    return crawler.run_reachability_check(input_domain)
+    final_url, status_code, _, _ = crawler.run_reachability_check(input_domain)
+    return final_url, status_code
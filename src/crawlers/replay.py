@@ -0,0 +1,73 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from .consent_crawler import CMP_BANNER_SELECTORS, KNOWN_CMP_TYPES
+from .declaration_extractors import DECLARATION_EXTRACTORS, regions_soup
+from .snapshot_store import read_snapshots
+
+logger = logging.getLogger("consent-replay")
+
+
+def _keys(rows: List[Dict[str, Any]]) -> set:
+    return {(r.get("name"), r.get("domain"), r.get("category")) for r in rows}
+
+
+def replay_snapshot(snapshot: Dict[str, Any], map_label: Callable[[Optional[str]], int],
+                    with_cookies: bool = False) -> Dict[str, Any]:
+    """
+    Re-run the extractor of the visit's CMP and the label mapping over a recorded snapshot.
+
+    @param snapshot: snapshot as returned by snapshot_store.read_snapshots
+    @param map_label: maps a purpose category to its numeric label
+    @param with_cookies: include both cookie jars of the visit in the result
+    @return: replayed declarations (with labels), the banner found in the regions, and
+             the rows added and removed compared to the recorded declarations
+    """
+    cmp_type = snapshot["cmp_type"]
+    soup = regions_soup(snapshot["regions"])
+
+    consent_data = []
+    banner_found = False
+    if cmp_type in KNOWN_CMP_TYPES:
+        consent_data = DECLARATION_EXTRACTORS[cmp_type](soup)
+        banner_found = soup.select_one(CMP_BANNER_SELECTORS[cmp_type]) is not None
+    for row in consent_data:
+        row["label"] = map_label(row["category"])
+
+    replayed, recorded = _keys(consent_data), _keys(snapshot.get("consent_data") or [])
+    result = {
+        "crawl_id": snapshot["crawl_id"],
+        "domain": snapshot["domain"],
+        "profile": snapshot["profile"],
+        "cmp_type": cmp_type,
+        "consent_data": consent_data,
+        "recorded_rows": len(recorded),
+        "added": sorted(replayed - recorded, key=str),
+        "removed": sorted(recorded - replayed, key=str),
+        "banner_found": banner_found,
+        "verdicts": snapshot.get("verdicts") or {}
+    }
+    if with_cookies:
+        result["pre_consent_cookies"] = snapshot.get("pre_consent_cookies") or []
+        result["cookies"] = snapshot.get("cookies") or []
+    return result
+
+
+def replay_snapshots(store_path: str, map_label: Callable[[Optional[str]], int],
+                     crawl_ids: List[int], with_cookies: bool = False) -> List[Dict[str, Any]]:
+    """
+    Replay a batch of snapshots, run in a worker process of scripts/run_replay.py.
+
+    @param store_path: path to a snapshot store
+    @param map_label: maps a purpose category to its numeric label
+    @param crawl_ids: crawl ids of the snapshots to replay
+    @param with_cookies: include both cookie jars of each visit in the results
+    @return: results of replay_snapshot
+    """
+    results = []
+    for snapshot in read_snapshots(store_path, crawl_ids):
+        try:
+            results.append(replay_snapshot(snapshot, map_label, with_cookies))
+        except Exception as e:
+            logger.warning(f"Replay of {snapshot['domain']} (crawl {snapshot['crawl_id']}) failed: {e}")
+    return results
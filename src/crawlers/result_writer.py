@@ -0,0 +1,217 @@
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from typing import List, Callable, Optional
+
+from .shared_utils import COOKIE_INSERT_SQL, CrawlResult, cookie_snapshot_rows
+from .snapshot_store import write_snapshots
+
+logger = logging.getLogger("consent-crawl")
+
+CRAWL_RESULT_INSERT_SQL = """
+    INSERT INTO crawl_results (id, domain, success, cmp_type, cookies_collected, error_message, profile)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+CONSENT_INSERT_SQL = """
+    INSERT INTO consent_data (crawl_id, cookie_name, cookie_domain,
+                              purpose_category, purpose_description, cmp_type)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def connect_wal(db_path: str) -> sqlite3.Connection:
+    """
+    Open a connection in WAL mode, so that readers (e.g. CookieExtractor) do not block
+    the writer, with commits that do not wait for an fsync of the database file.
+    Writers of concurrent crawls into the same database wait for each other.
+    @param db_path: path to an initialized crawl database
+    @return: connection
+    """
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def next_crawl_id(conn: sqlite3.Connection) -> int:
+    """First crawl_results id not used yet, including ids of deleted rows"""
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM crawl_results").fetchone()[0]
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'crawl_results'").fetchone()
+    return max(max_id, seq[0] if seq else 0) + 1
+
+
+def write_results(conn: sqlite3.Connection, results: List[CrawlResult]) -> int:
+    """
+    Insert crawl results with their cookies and consent rows in one transaction.
+    Crawl ids are assigned here, once the write lock is held, so that all rows can be
+    inserted with executemany and several writers can share a database.
+
+    @param conn: connection owned by the caller
+    @param results: crawl results to insert
+    @return: crawl id of the first result
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        first_id = next_crawl_id(conn)
+
+        crawl_rows = []
+        cookie_batch = []
+        consent_rows = []
+        for crawl_id, result in enumerate(results, first_id):
+            crawl_rows.append((crawl_id, result.domain, result.success, result.cmp_type,
+                               result.cookies_collected, result.error_message, result.profile))
+            cookie_batch.extend(cookie_snapshot_rows(crawl_id, result.pre_consent_cookies, result.cookies))
+            consent_rows.extend((crawl_id, c.get("name"), c.get("domain"), c.get("category"),
+                                 c.get("purpose"), c.get("cmp"))
+                                for c in result.consent_data)
+
+        conn.executemany(CRAWL_RESULT_INSERT_SQL, crawl_rows)
+        conn.executemany(COOKIE_INSERT_SQL, cookie_batch)
+        conn.executemany(CONSENT_INSERT_SQL, consent_rows)
+    return first_id
+
+
+class ResultWriter:
+    """
+    Background writer of consent crawl results. Results are queued by the browser
+    workers and written by a single thread over one long-lived WAL connection,
+    in transactions of up to batch_rows rows or every flush_interval seconds.
+    A batch that cannot be written is retried with backoff; if it still fails, the
+    writer stops, keeps the error in `error` and calls on_failure.
+    """
+
+    def __init__(self, db_path: str, batch_rows: int = 1000, flush_interval: float = 2.0,
+                 on_result: Optional[Callable[[CrawlResult], None]] = None,
+                 snapshot_path: Optional[str] = None,
+                 on_failure: Optional[Callable[[], None]] = None,
+                 write_attempts: int = 5, retry_delay: float = 1.0):
+        """
+        @param db_path: path to an initialized crawl database
+        @param batch_rows: number of pending rows (results, cookies and consent rows) that triggers a write
+        @param flush_interval: maximum seconds a queued result waits before being written
+        @param on_result: called on the writer thread for each result once it is committed
+        @param snapshot_path: initialized snapshot store for the snapshots of the results, if recorded
+        @param on_failure: called on the writer thread once a batch could not be written, e.g. to stop the crawl
+        @param write_attempts: attempts to write a batch before giving up
+        @param retry_delay: seconds before the first retry, doubled for each further retry
+        """
+        self.db_path = db_path
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.on_result = on_result
+        self.snapshot_path = snapshot_path
+        self.on_failure = on_failure
+        self.write_attempts = write_attempts
+        self.retry_delay = retry_delay
+        self._queue: "queue.Queue[Optional[CrawlResult]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.unwritten = 0
+        self.error: Optional[sqlite3.Error] = None
+
+    def start(self) -> None:
+        """Start the writer thread"""
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, result: CrawlResult) -> None:
+        """Queue a result for writing, never blocks on disk I/O"""
+        self._queue.put(result)
+
+    def close(self) -> None:
+        """Write all queued results and stop the writer thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        # Results queued after a failed write are not written either
+        while not self._queue.empty():
+            self.unwritten += self._queue.get_nowait() is not None
+
+    def _run(self) -> None:
+        """Writer thread: batch queued results until the size or time limit, then write them"""
+        conn = connect_wal(self.db_path)
+        snapshot_conn = connect_wal(self.snapshot_path) if self.snapshot_path else None
+        pending: List[CrawlResult] = []
+        pending_rows = 0
+        batch_started = None
+        stopping = False
+
+        try:
+            while not stopping:
+                timeout = None
+                if batch_started is not None:
+                    timeout = max(0.0, batch_started + self.flush_interval - time.time())
+                try:
+                    result = self._queue.get(timeout=timeout)
+                    if result is None:
+                        stopping = True
+                    else:
+                        pending.append(result)
+                        pending_rows += (1 + len(result.pre_consent_cookies) + len(result.cookies)
+                                         + len(result.consent_data))
+                        batch_started = batch_started or time.time()
+                except queue.Empty:
+                    pass
+
+                due = batch_started is not None and time.time() - batch_started >= self.flush_interval
+                if pending and (stopping or due or pending_rows >= self.batch_rows):
+                    if not self._flush(conn, pending, snapshot_conn):
+                        self.unwritten += len(pending)
+                        break
+                    pending = []
+                    pending_rows = 0
+                    batch_started = None
+        finally:
+            conn.close()
+            if snapshot_conn is not None:
+                snapshot_conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, pending: List[CrawlResult],
+               snapshot_conn: Optional[sqlite3.Connection] = None) -> bool:
+        """
+        Write one batch and its snapshots, and report its results.
+        @return: False if the batch could not be written after write_attempts attempts
+        """
+        delay = self.retry_delay
+        for attempt in range(1, self.write_attempts + 1):
+            try:
+                first_id = write_results(conn, pending)
+                break
+            except sqlite3.OperationalError as e:
+                # e.g. the database is locked beyond the busy timeout or the disk is full
+                if attempt == self.write_attempts:
+                    return self._fail(pending, e)
+                logger.warning(f"Failed to write {len(pending)} crawl results (attempt {attempt}), "
+                               f"retrying in {delay:g}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+            except sqlite3.Error as e:
+                return self._fail(pending, e)
+
+        if snapshot_conn is not None:
+            try:
+                write_snapshots(snapshot_conn, first_id, pending)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write snapshots of {len(pending)} crawl results: {e}")
+
+        self.written += len(pending)
+        logger.debug(f"Wrote {len(pending)} crawl results")
+        if self.on_result is not None:
+            for result in pending:
+                try:
+                    self.on_result(result)
+                except Exception as e:
+                    logger.warning(f"Error handling result of {result.domain}: {e}")
+        return True
+
+    def _fail(self, pending: List[CrawlResult], error: sqlite3.Error) -> bool:
+        """Give up on writing: keep the error and let the owner stop the crawl"""
+        logger.error(f"Failed to write {len(pending)} crawl results, stopping the writer: {error}")
+        self.error = error
+        if self.on_failure is not None:
+            self.on_failure()
+        return False
@@ -0,0 +1,116 @@
+import math
+import logging
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Set
+
+from .seen_filter import domain_key
+
+logger = logging.getLogger("crawl-scheduler")
+
+# Country-code TLDs of the EU/EEA and the UK, for EU-focused studies
+EU_TLDS = {
+    "at", "be", "bg", "hr", "cy", "cz", "dk", "ee", "fi", "fr", "de", "gr", "hu", "ie",
+    "it", "lv", "lt", "lu", "mt", "nl", "pl", "pt", "ro", "sk", "si", "es", "se",
+    "is", "li", "no", "uk", "eu"
+}
+
+# Likelihood that a domain yields consent data, by previous presence verdict
+PRESENCE_PRIORS = {
+    "cookiebot": 1.0,
+    "onetrust": 1.0,
+    "termly": 1.0,
+    "nocmp": 0.1,
+    "http_error": 0.05,
+    "bot": 0.05,
+    "timeout": 0.05,
+    "failed": 0.0
+}
+UNKNOWN_PRIOR = 0.5
+
+# Second-level labels used under country-code TLDs, e.g. example.co.uk
+SECOND_LEVEL_LABELS = {"co", "com", "org", "net", "gov", "edu", "ac", "or", "ne", "go", "gob"}
+
+
+@dataclass
+class PriorityWeights:
+    """Weights of the score components, each component is in [0, 1]"""
+    rank: float = 1.0
+    prior: float = 1.0
+    tld: float = 0.5
+    cluster: float = 0.5
+
+
+def cluster_key(domain: str) -> str:
+    """
+    Name of a domain without its public suffix, so that example.com, example.de
+    and example.co.uk fall into the same cluster.
+    @param domain: domain or url
+    @return: cluster name
+    """
+    labels = domain_key(domain).split(".")
+    if len(labels) >= 3 and labels[-2] in SECOND_LEVEL_LABELS and len(labels[-1]) == 2:
+        labels = labels[:-2]
+    elif len(labels) >= 2:
+        labels = labels[:-1]
+    return labels[-1] if labels else ""
+
+
+class CrawlScheduler:
+    """Orders crawl targets by Tranco rank, prior CMP likelihood, TLD and cluster representatives"""
+
+    def __init__(self, ranks: Optional[Dict[str, int]] = None,
+                 verdicts: Optional[Dict[str, str]] = None,
+                 boosted_tlds: Optional[Set[str]] = None,
+                 weights: Optional[PriorityWeights] = None):
+        """
+        @param ranks: mapping of domain or url to Tranco rank (1 is best)
+        @param verdicts: mapping of domain or url to a previous presence category
+        @param boosted_tlds: TLDs that get the TLD bonus, e.g. EU_TLDS
+        @param weights: weights of the score components
+        """
+        self.ranks = {domain_key(d): r for d, r in (ranks or {}).items()}
+        self.verdicts = {domain_key(d): v for d, v in (verdicts or {}).items()}
+        self.boosted_tlds = boosted_tlds or set()
+        self.weights = weights or PriorityWeights()
+
+    def rank_score(self, key: str) -> float:
+        """Logarithmic rank score: 1.0 for rank 1, 0.5 for rank 10, 0 if unranked"""
+        rank = self.ranks.get(key)
+        if not rank or rank < 1:
+            return 0.0
+        return 1.0 / (1.0 + math.log10(rank))
+
+    def score(self, domain: str, representative: bool = True) -> float:
+        """
+        Priority score of a single domain, higher is crawled first.
+        @param domain: domain or url
+        @param representative: whether the domain is the representative of its cluster
+        @return: weighted score
+        """
+        key = domain_key(domain)
+        w = self.weights
+        prior = PRESENCE_PRIORS.get(self.verdicts.get(key), UNKNOWN_PRIOR)
+        tld = 1.0 if key.rsplit(".", 1)[-1] in self.boosted_tlds else 0.0
+        return (w.rank * self.rank_score(key) + w.prior * prior
+                + w.tld * tld + w.cluster * float(representative))
+
+    def order(self, domains: List[str]) -> List[str]:
+        """
+        Sort domains by descending priority score. The best-ranked domain of each
+        cluster is its representative, the others do not get the cluster bonus.
+        @param domains: domains or urls to crawl
+        @return: domains in crawl order
+        """
+        representatives: Dict[str, str] = {}
+        for domain in sorted(domains):
+            cluster = cluster_key(domain)
+            current = representatives.get(cluster)
+            if current is None or self.rank_score(domain_key(domain)) > self.rank_score(domain_key(current)):
+                representatives[cluster] = domain
+
+        scores = {d: self.score(d, representatives.get(cluster_key(d)) == d) for d in domains}
+        ordered = sorted(domains, key=lambda d: (-scores[d], d))
+
+        if ordered:
+            logger.info(f"Prioritized {len(ordered)} domains, scores {scores[ordered[0]]:.2f} to {scores[ordered[-1]]:.2f}")
+        return ordered
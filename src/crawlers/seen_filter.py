@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger("seen-filter")
+
+# File format: magic line, one JSON header line, then the bit arrays of all slices
+FILTER_MAGIC = b"SEENBLOOM1\n"
+
+
+def domain_key(domain: str) -> str:
+    """
+    Reduce a domain or url to a host key, so that
+    'example.com', 'www.example.com' and 'https://www.example.com/' match.
+    @param domain: domain or url
+    @return: lowercase hostname without www. prefix
+    """
+    domain = domain.strip()
+    if "://" not in domain:
+        domain = "http://" + domain
+    host = urlparse(domain).hostname or ""
+    return re.sub(r"^www\.", "", host.lower())
+
+
+class SeenDomainFilter:
+    """
+    Persistent Bloom filter of domains crawled within a freshness window.
+
+    The window is split into time slices, each with its own bit array sized for
+    `capacity` entries. New domains go into the current slice, lookups check all
+    slices still inside the window, and expired slices are dropped as a whole, so a
+    domain is remembered for between window_days and window_days * (1 + 1 / slices),
+    i.e. 30 to 45 days with the defaults. Beyond `capacity` domains in a slice the
+    false-positive rate rises above `error_rate`.
+    With the defaults (10M entries, 1% false positives, 2 slices) the file is ~28 MB.
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 10_000_000,
+                 error_rate: float = 0.01, window_days: float = 30, slices: int = 2):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.window_seconds = window_days * 86400
+        self.num_slices = slices
+        self.slice_seconds = self.window_seconds / slices
+
+        # Split the error rate between slices, since a lookup checks all of them
+        slice_error = error_rate / slices
+        self.num_bits = int(math.ceil(-capacity * math.log(slice_error) / (math.log(2) ** 2)))
+        self.num_bits += -self.num_bits % 8
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+
+        # Slices as {start timestamp, bit array, number of domains added}, oldest first
+        self.slices: List[Dict[str, Any]] = []
+        self.added = 0
+        # Crawls of several browser profiles share a filter, adding to and saving it concurrently
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load(path)
+        self.expire()
+
+    def _indices(self, key: str):
+        """Bit positions for a key, via double hashing of a 128-bit digest"""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """Drop slices that ended before the start of the freshness window"""
+        now = now or time.time()
+        self.slices = [s for s in self.slices
+                       if s["start"] + self.slice_seconds > now - self.window_seconds]
+
+    def _current_slice(self) -> Dict[str, Any]:
+        """Slice that new entries are added to, starting a new one when the last has ended"""
+        now = time.time()
+        if not self.slices or self.slices[-1]["start"] + self.slice_seconds <= now:
+            self.slices.append({"start": now, "bits": bytearray(self.num_bits // 8), "count": 0})
+            self.expire(now)
+        return self.slices[-1]
+
+    def add(self, domain: str) -> None:
+        """Record a domain as crawled now"""
+        indices = self._indices(domain_key(domain))
+        with self._lock:
+            current = self._current_slice()
+            bits = current["bits"]
+            for idx in indices:
+                bits[idx >> 3] |= 1 << (idx & 7)
+            current["count"] += 1
+            self.added += 1
+            if current["count"] == self.capacity + 1:
+                logger.warning(f"Seen-domain filter slice exceeds its capacity of {self.capacity} domains, "
+                               f"false positives will exceed {self.error_rate}")
+
+    def __contains__(self, domain: str) -> bool:
+        """Whether the domain was (probably) crawled within the freshness window"""
+        indices = self._indices(domain_key(domain))
+        for s in self.slices:
+            bits = s["bits"]
+            if all(bits[idx >> 3] & (1 << (idx & 7)) for idx in indices):
+                return True
+        return False
+
+    def load(self, path: str) -> None:
+        """Load slices from a filter file, taking the sizing parameters from its header"""
+        with open(path, "rb") as fd:
+            if fd.readline() != FILTER_MAGIC:
+                raise ValueError(f"Not a seen-domain filter file: {path}")
+            header = json.loads(fd.readline().decode("utf-8"))
+
+            self.capacity = header["capacity"]
+            self.error_rate = header["error_rate"]
+            self.num_bits = header["num_bits"]
+            self.num_hashes = header["num_hashes"]
+            self.slice_seconds = header["slice_seconds"]
+            self.num_slices = header["slices"]
+            self.window_seconds = self.slice_seconds * self.num_slices
+
+            # Files written before the counts were stored
+            counts = header.get("slice_counts", [0] * len(header["slice_starts"]))
+            self.slices = []
+            for start, count in zip(header["slice_starts"], counts):
+                self.slices.append({"start": start, "bits": bytearray(fd.read(self.num_bits // 8)), "count": count})
+
+        logger.info(f"Loaded seen-domain filter {path} ({len(self.slices)} active slices)")
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the filter to disk, replacing the previous file atomically"""
+        path = path or self.path
+        tmp_path = path + ".tmp"
+        with self._lock:
+            self.expire()
+            header = {
+                "capacity": self.capacity,
+                "error_rate": self.error_rate,
+                "num_bits": self.num_bits,
+                "num_hashes": self.num_hashes,
+                "slice_seconds": self.slice_seconds,
+                "slices": self.num_slices,
+                "slice_starts": [s["start"] for s in self.slices],
+                "slice_counts": [s["count"] for s in self.slices]
+            }
+            with open(tmp_path, "wb") as fd:
+                fd.write(FILTER_MAGIC)
+                fd.write(json.dumps(header).encode("utf-8") + b"\n")
+                for s in self.slices:
+                    fd.write(s["bits"])
+            os.replace(tmp_path, path)
+
+        logger.info(f"Saved seen-domain filter to {path} ({self.added} domains added this run)")
+
+
+def apply_seen_filter(domains: List[str], seen_filter: Optional[SeenDomainFilter],
+                      defer: bool = False) -> List[str]:
+    """
+    Skip or deprioritize domains crawled within the filter's freshness window.
+    @param domains: domains to crawl, in crawl order
+    @param seen_filter: filter to consult, or None to keep all domains
+    @param defer: move recently crawled domains to the end instead of skipping them
+    @return: filtered or reordered domains
+    """
+    if seen_filter is None:
+        return domains
+
+    fresh = []
+    seen = []
+    for domain in domains:
+        (seen if domain in seen_filter else fresh).append(domain)
+
+    if seen:
+        action = "Deferring" if defer else "Skipping"
+        logger.info(f"{action} {len(seen)} domains crawled within the freshness window")
+
+    return fresh + seen if defer else fresh
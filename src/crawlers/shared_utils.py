@@ -2,15 +2,82 @@ import os
 import sys
 import pickle
 import re
-from typing import List, Set, Dict
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, List, Set, Dict, Optional, Tuple
 
+from .seen_filter import SeenDomainFilter, domain_key
 
-def retrieve_cmdline_urls(cargs: Dict) -> Set[str]:
+# Presence crawl output files, by result category
+PRESENCE_RESULT_FILES = {
+    'cookiebot': 'cookiebot_responses.txt',
+    'onetrust': 'onetrust_responses.txt',
+    'termly': 'termly_responses.txt',
+    'nocmp': 'nocmp_responses.txt',
+    'failed': 'failed_urls.txt',
+    'http_error': 'http_responses.txt',
+    'bot': 'bot_responses.txt',
+    'timeout': 'crawler_timeouts.txt'
+}
+
+# Presence categories that indicate a supported CMP
+CMP_CATEGORIES = ('cookiebot', 'onetrust', 'termly')
+
+# Presence crawl output file of the CMP site IDs (url,category,site ID per line)
+CMP_SITE_IDS_FILE = 'cmp_site_ids.csv'
+
+# Profile of the crawl results written by the declaration fetcher. They hold no cookies
+# and are not browser visits, so they never count as finished or crawled domains.
+DECLARATION_PROFILE = 'declaration'
+
+# Headers of the plain HTTP requests of the presence crawl and the declaration fetcher
+request_headers = {
+    'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"
+}
+
+# Browser visits among the crawl results, excluding the declarations fetched without a browser
+BROWSER_VISITS = f"COALESCE(profile, '') != '{DECLARATION_PROFILE}'"
+
+# Post-consent cookie jar of each visit, rebuilt from the cookie snapshot rows (see
+# cookie_snapshot_rows): the pre-consent cookies that were not changed or removed by the
+# consent interaction, plus those added or changed by it. Rows of databases from before
+# the snapshots were split form the jar unchanged.
+POST_CONSENT_COOKIES_VIEW = """
+    CREATE VIEW IF NOT EXISTS post_consent_cookies AS
+    SELECT c.* FROM cookies c
+    WHERE (c.phase = 'pre' AND NOT EXISTS (
+              SELECT 1 FROM cookies p
+              WHERE p.crawl_id = c.crawl_id AND p.phase = 'post' AND p.change IN ('changed', 'removed')
+                AND p.name = c.name AND p.domain = c.domain AND p.path IS c.path
+                AND p.partition_key IS c.partition_key))
+       OR (c.phase = 'post' AND c.change IN ('added', 'changed'))
+"""
+
+
+@dataclass
+class CrawlResult:
+    """Result of a single domain crawl"""
+    domain: str
+    success: bool
+    cmp_type: str
+    cookies_collected: int
+    consent_data: List[Dict]
+    error_message: Optional[str] = None
+    cookies: List[Dict] = field(default_factory=list)
+    pre_consent_cookies: List[Dict] = field(default_factory=list)
+    profile: Optional[str] = None
+    # Recorded banner/declaration regions and in-browser verdicts, see ConsentCrawler.record_snapshots
+    snapshot: Optional[Dict[str, Any]] = None
+
+
+def retrieve_cmdline_urls(cargs: Dict, seen_filter: Optional[SeenDomainFilter] = None) -> Set[str]:
     """
     Retrieve URLs to be crawled from the docopt input arguments.
     Expected keys are: --url, --pkl and --file
     Will not verify whether the input is a valid URL.
     @param cargs: docopt arguments
+    @param seen_filter: if given, domains crawled within its freshness window are skipped
     @return: set of unique strings, assumed to be URLs
     """
     sites: Set[str] = set()
@@ -56,9 +123,62 @@ def retrieve_cmdline_urls(cargs: Dict) -> Set[str]:
             else:
                 print(f"Provided csv path is invalid: \"{csvfn}\"", file=sys.stderr)
 
+    # Skip domains crawled recently in previous runs
+    if seen_filter is not None:
+        recent = {s for s in sites if s in seen_filter}
+        if recent:
+            print(f"Skipping {len(recent)} domains crawled within the freshness window", file=sys.stderr)
+            sites -= recent
+
     return sites
 
 
+def normalize_input_url(url: str) -> str:
+    """
+    Prefix bare domains with a scheme, the same way crawl inputs are normalized.
+    @param url: domain or url
+    @return: url with scheme
+    """
+    if not re.match("^http[s]?://", url, re.IGNORECASE):
+        return "https://www." + url
+    return url
+
+
+def retrieve_csv_ranks(cargs: Dict) -> Dict[str, int]:
+    """
+    Retrieve the ranking column of the csv inputs (ranking,domain per line), e.g. Tranco lists.
+    @param cargs: docopt arguments
+    @return: mapping of domain to rank
+    """
+    ranks: Dict[str, int] = {}
+    for csvfn in cargs.get("--csv") or []:
+        if not os.path.exists(csvfn):
+            continue
+        with open(csvfn, 'r') as fd:
+            for line in fd:
+                fields = line.split(sep=",")
+                if len(fields) < 2 or not fields[0].strip().isdigit():
+                    continue
+                domain = fields[1].strip()
+                rank = int(fields[0])
+                ranks[domain] = min(rank, ranks.get(domain, rank))
+    return ranks
+
+
+def retrieve_seen_filter(cargs: Dict) -> Optional[SeenDomainFilter]:
+    """
+    Open the cross-run seen-domain filter given by --seen, creating it if needed.
+    --seen-days and --seen-fpr only apply when a new filter file is created.
+    @param cargs: docopt arguments
+    @return: the filter, or None if no filter path was given
+    """
+    if not cargs.get("--seen"):
+        return None
+    return SeenDomainFilter(cargs["--seen"],
+                            error_rate=float(cargs.get("--seen-fpr") or 0.01),
+                            window_days=float(cargs.get("--seen-days") or 30))
+
+
 def filter_bad_urls_and_sort(sites: Set[str]) -> List[str]:
     """
     Filters out bad urls and comments, sorts the result.
@@ -69,16 +189,281 @@ def filter_bad_urls_and_sort(sites: Set[str]) -> List[str]:
     for url in sites:
         if not url or len(url.strip()) == 0 or url.startswith("#"):
             continue
-        elif not re.match("^http[s]?://", url, re.IGNORECASE):
-            to_sort.append("https://www." + url)
-        else:
-            to_sort.append(url)
+        to_sort.append(normalize_input_url(url))
     return sorted(to_sort)
 
 
+def retrieve_presence_verdicts(paths: List[str]) -> Dict[str, str]:
+    """
+    Load the output of a presence crawl, either a results directory containing
+    the per-category response files or a presence results table (url,category per line).
+    @param paths: results directories or table files
+    @return: mapping of normalized url to presence category
+    """
+    verdicts: Dict[str, str] = {}
+
+    for path in paths:
+        if os.path.isdir(path):
+            for category, filename in PRESENCE_RESULT_FILES.items():
+                fpath = os.path.join(path, filename)
+                if not os.path.exists(fpath):
+                    continue
+                with open(fpath, 'r', encoding="utf-8") as fd:
+                    for line in fd:
+                        url = line.strip()
+                        if url and not url.startswith("#"):
+                            verdicts[normalize_input_url(url)] = category
+        elif os.path.exists(path):
+            with open(path, 'r', encoding="utf-8") as fd:
+                for line in fd:
+                    line = line.strip()
+                    if not line or line.startswith("#") or "," not in line:
+                        continue
+                    url, category = line.rsplit(",", 1)
+                    verdicts[normalize_input_url(url.strip())] = category.strip()
+        else:
+            print(f"Provided presence results path is invalid: \"{path}\"", file=sys.stderr)
+
+    return verdicts
+
+
+def retrieve_cmp_site_ids(paths: List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    Load the CMP site IDs found by a presence crawl, from results directories
+    or from site ID files directly (url,category,site ID per line).
+    @param paths: results directories or site ID files
+    @return: mapping of normalized url to (presence category, site ID)
+    """
+    site_ids: Dict[str, Tuple[str, str]] = {}
+
+    for path in paths:
+        fpath = os.path.join(path, CMP_SITE_IDS_FILE) if os.path.isdir(path) else path
+        if not os.path.exists(fpath):
+            print(f"No CMP site IDs found at \"{path}\"", file=sys.stderr)
+            continue
+        with open(fpath, 'r', encoding="utf-8") as fd:
+            for line in fd:
+                line = line.strip()
+                if not line or line.startswith("#") or line.count(",") < 2:
+                    continue
+                url, category, site_id = line.rsplit(",", 2)
+                site_ids[normalize_input_url(url.strip())] = (category.strip(), site_id.strip())
+
+    return site_ids
+
+
+def retrieve_finished_domains(db_path: str, retry_failed: bool = False,
+                              retryable_patterns: Optional[List[str]] = None,
+                              profile: Optional[str] = None) -> Set[str]:
+    """
+    Domains already finished in an existing crawl database, to be skipped when resuming.
+    Domains whose last attempt failed are finished too, unless retry_failed is set and
+    the error message matches one of the retryable patterns.
+    @param db_path: path to an existing crawl database
+    @param retry_failed: crawl failed domains again if their error is retryable
+    @param retryable_patterns: regular expressions of retryable error messages
+    @param profile: only consider results of this browser profile, otherwise those of all
+                    browser profiles (fetched declarations are never considered)
+    @return: domain keys (see seen_filter.domain_key) of finished domains
+    """
+    retryable = re.compile("|".join(retryable_patterns), re.IGNORECASE) if retryable_patterns else None
+
+    if profile:
+        where, params = "AND profile = ?", (profile,)
+    else:
+        where, params = "AND COALESCE(profile, '') != ?", (DECLARATION_PROFILE,)
+    conn = sqlite3.connect(db_path)
+    try:
+        # Covered by idx_crawl_results_domain
+        succeeded = {domain_key(row[0]) for row in
+                     conn.execute(f"SELECT DISTINCT domain FROM crawl_results WHERE success = 1 {where}", params)}
+        last_errors = {}
+        for domain, error in conn.execute("SELECT domain, error_message FROM crawl_results "
+                                          f"WHERE success = 0 {where} ORDER BY id", params):
+            last_errors[domain_key(domain)] = error or ""
+    finally:
+        conn.close()
+
+    finished = set(succeeded)
+    retried = 0
+    for key, error in last_errors.items():
+        if key in succeeded:
+            continue
+        if retry_failed and retryable is not None and retryable.search(error):
+            retried += 1
+        else:
+            finished.add(key)
+
+    print(f"Loaded {len(finished)} finished domains from {db_path}"
+          + (f" for profile {profile}" if profile else "")
+          + (f", retrying {retried} failed" if retry_failed else ""), file=sys.stderr)
+    return finished
+
+
 def setup_output_directory(output_dir: str = "./data/results") -> str:
     """
     Create output directory if it doesn't exist and return the path.
     """
     os.makedirs(output_dir, exist_ok=True)
     return output_dir
+
+
+def init_crawl_database(db_path: str) -> None:
+    """
+    Create the crawl_results, cookies and consent_data tables shared by the crawlers.
+    @param db_path: path to the SQLite database, created if missing
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    # Create tables for storing crawl results
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            domain TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            success BOOLEAN NOT NULL,
+            cmp_type TEXT,
+            cookies_collected INTEGER DEFAULT 0,
+            error_message TEXT,
+            profile TEXT
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cookies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            crawl_id INTEGER,
+            name TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            value TEXT,
+            path TEXT,
+            expiry DATETIME,
+            secure BOOLEAN,
+            http_only BOOLEAN,
+            same_site TEXT,
+            partition_key TEXT,
+            phase TEXT NOT NULL DEFAULT 'pre',
+            change TEXT NOT NULL DEFAULT 'base',
+            FOREIGN KEY (crawl_id) REFERENCES crawl_results (id)
+        )
+    """)
+
+    # Lookup of finished domains when resuming a crawl
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_results_domain ON crawl_results (domain, success)")
+
+    # Databases created before results were stored per browser profile
+    if "profile" not in {row[1] for row in cursor.execute("PRAGMA table_info(crawl_results)")}:
+        cursor.execute("ALTER TABLE crawl_results ADD COLUMN profile TEXT")
+
+    # Databases created before cookie snapshots were stored as deltas
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(cookies)")}
+    if "phase" not in columns:
+        cursor.execute("ALTER TABLE cookies ADD COLUMN phase TEXT NOT NULL DEFAULT 'pre'")
+    if "change" not in columns:
+        cursor.execute("ALTER TABLE cookies ADD COLUMN change TEXT NOT NULL DEFAULT 'base'")
+
+    # Databases created before partitioned cookies were told apart, whose view
+    # matches the change rows without the partition key
+    if "partition_key" not in columns:
+        cursor.execute("ALTER TABLE cookies ADD COLUMN partition_key TEXT")
+        cursor.execute("DROP VIEW IF EXISTS post_consent_cookies")
+
+    # Lookup of the change rows of a visit by the post_consent_cookies view
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cookies_crawl_name ON cookies (crawl_id, name)")
+    cursor.execute(POST_CONSENT_COOKIES_VIEW)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS consent_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            crawl_id INTEGER,
+            cookie_name TEXT NOT NULL,
+            cookie_domain TEXT NOT NULL,
+            purpose_category TEXT,
+            purpose_description TEXT,
+            cmp_type TEXT,
+            FOREIGN KEY (crawl_id) REFERENCES crawl_results (id)
+        )
+    """)
+
+    conn.commit()
+    conn.close()
+
+
+def connect_crawl_database(db_path: str) -> sqlite3.Connection:
+    """
+    Open a crawl database read-only for analysis.
+    Databases are migrated to the current schema by init_crawl_database only, so the
+    post_consent_cookies view is missing from those not opened by a crawler since.
+    @param db_path: path to an existing crawl database
+    @return: read-only connection
+    """
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' "
+                    "AND name = 'post_consent_cookies'").fetchone() is None:
+        conn.close()
+        raise ValueError(f"{db_path} predates the cookie snapshot schema, "
+                         "migrate it first with post_process.py --migrate")
+    return conn
+
+
+COOKIE_INSERT_SQL = """
+    INSERT INTO cookies (crawl_id, name, domain, value, path, expiry, secure, http_only, same_site,
+                         partition_key, phase, change)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Cookie attributes compared between snapshots
+COOKIE_DELTA_ATTRIBUTES = ("value", "expiry", "secure", "httpOnly", "sameSite")
+
+
+def cookie_rows(crawl_id: int, cookies: List[Dict], phase: str = "pre", change: str = "base") -> List[tuple]:
+    """
+    Convert cookies in WebDriver format (name, value, domain, path, expiry, secure,
+    httpOnly, sameSite, and partitionKey for partitioned cookies) to rows for the cookies table.
+    @param crawl_id: id of the crawl_results row the cookies belong to
+    @param cookies: cookie dictionaries
+    @param phase: consent phase of the snapshot, "pre" or "post"
+    @param change: "base" for a full snapshot, or "added", "changed" or "removed" for a delta
+    @return: list of row tuples in cookies table column order
+    """
+    return [(crawl_id, c.get("name"), c.get("domain"), c.get("value"), c.get("path"),
+             c.get("expiry"), c.get("secure"), c.get("httpOnly"), c.get("sameSite"), c.get("partitionKey"),
+             phase, change)
+            for c in cookies]
+
+
+def cookie_delta(before: List[Dict], after: List[Dict]) -> Dict[str, List[Dict]]:
+    """
+    Difference between two cookie snapshots, with cookies identified by name, domain, path
+    and partition key.
+    Removed cookies are reported with their last known attributes.
+    @param before: cookies of the earlier snapshot
+    @param after: cookies of the later snapshot
+    @return: {"added": [...], "changed": [...], "removed": [...]}
+    """
+    def key(c):
+        return c.get("name"), c.get("domain"), c.get("path"), c.get("partitionKey")
+
+    earlier = {key(c): c for c in before}
+    later = {key(c): c for c in after}
+    return {
+        "added": [c for k, c in later.items() if k not in earlier],
+        "changed": [c for k, c in later.items() if k in earlier and
+                    any(c.get(a) != earlier[k].get(a) for a in COOKIE_DELTA_ATTRIBUTES)],
+        "removed": [c for k, c in earlier.items() if k not in later]
+    }
+
+
+def cookie_snapshot_rows(crawl_id: int, pre_consent: List[Dict], post_consent: List[Dict]) -> List[tuple]:
+    """
+    Rows storing the pre-consent cookie jar in full and the post-consent jar as a delta on it.
+    @param crawl_id: id of the crawl_results row the cookies belong to
+    @param pre_consent: cookies before the consent interaction
+    @param post_consent: cookies after the consent interaction
+    @return: list of row tuples in cookies table column order
+    """
+    rows = cookie_rows(crawl_id, pre_consent, "pre", "base")
+    for change, cookies in cookie_delta(pre_consent, post_consent).items():
+        rows.extend(cookie_rows(crawl_id, cookies, "post", change))
+    return rows
@@ -0,0 +1,133 @@
+import os
+import json
+import zlib
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional
+
+from .shared_utils import DECLARATION_PROFILE, CrawlResult
+
+SNAPSHOT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        crawl_id INTEGER PRIMARY KEY,
+        domain TEXT,
+        profile TEXT,
+        cmp_type TEXT,
+        data BLOB
+    )
+"""
+
+SNAPSHOT_INSERT_SQL = """
+    INSERT OR REPLACE INTO snapshots (crawl_id, domain, profile, cmp_type, data)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def snapshot_store_path(db_path: str) -> str:
+    """Path of the snapshot store that belongs to a crawl database"""
+    return os.path.splitext(db_path)[0] + "_snapshots.sqlite"
+
+
+def crawl_database_path(store_path: str) -> str:
+    """Path of the crawl database a snapshot store belongs to, if it has the .sqlite extension"""
+    return store_path[:-len("_snapshots.sqlite")] + ".sqlite" if store_path.endswith("_snapshots.sqlite") else ""
+
+
+def missing_snapshot_ids(store_path: str, db_path: str) -> List[int]:
+    """
+    Crawl ids of successful browser visits without a stored snapshot, from the first
+    recorded visit on, e.g. because writing their snapshots failed.
+    @param store_path: path to a snapshot store
+    @param db_path: path to the crawl database of the store
+    @return: sorted crawl ids
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS store", (f"file:{store_path}?mode=ro",))
+        return [row[0] for row in conn.execute("""
+            SELECT id FROM crawl_results
+            WHERE success = 1 AND COALESCE(profile, '') != ?
+              AND id >= (SELECT MIN(crawl_id) FROM store.snapshots)
+              AND id NOT IN (SELECT crawl_id FROM store.snapshots)
+            ORDER BY id
+        """, (DECLARATION_PROFILE,))]
+    finally:
+        conn.close()
+
+
+def init_snapshot_store(path: str) -> None:
+    """
+    Create the snapshot store of a crawl if needed.
+    @param path: path to the SQLite file, created if missing
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(SNAPSHOT_SCHEMA)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def write_snapshots(conn: sqlite3.Connection, first_id: int, results: List[CrawlResult]) -> int:
+    """
+    Store the snapshots of crawl results written with write_results, keyed by their
+    crawl ids. Each snapshot is stored as zlib-compressed JSON together with both
+    cookie jars and the recorded declarations of the visit.
+
+    @param conn: connection to the snapshot store, owned by the caller
+    @param first_id: crawl id of the first result, as returned by write_results
+    @param results: the results passed to write_results, in the same order
+    @return: number of snapshots stored
+    """
+    rows = []
+    for crawl_id, result in enumerate(results, first_id):
+        if result.snapshot is None:
+            continue
+        data = {
+            **result.snapshot,
+            "consent_data": result.consent_data,
+            "pre_consent_cookies": result.pre_consent_cookies,
+            "cookies": result.cookies
+        }
+        rows.append((crawl_id, result.domain, result.profile, result.cmp_type,
+                     zlib.compress(json.dumps(data).encode("utf-8"))))
+    with conn:
+        conn.executemany(SNAPSHOT_INSERT_SQL, rows)
+    return len(rows)
+
+
+def snapshot_ids(path: str, cmp_type: Optional[str] = None) -> List[int]:
+    """
+    Crawl ids of the stored snapshots, optionally only of one CMP type.
+    @param path: path to a snapshot store
+    @param cmp_type: CMP type of the visits to select
+    @return: sorted crawl ids
+    """
+    where, params = ("WHERE cmp_type = ?", (cmp_type,)) if cmp_type else ("", ())
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return [row[0] for row in conn.execute(f"SELECT crawl_id FROM snapshots {where} ORDER BY crawl_id", params)]
+    finally:
+        conn.close()
+
+
+def read_snapshots(path: str, crawl_ids: List[int]) -> Iterator[Dict[str, Any]]:
+    """
+    Decompress stored snapshots.
+    @param path: path to a snapshot store
+    @param crawl_ids: crawl ids of the snapshots to read
+    @return: snapshots with crawl_id, domain, profile, cmp_type, regions, verdicts,
+             consent_data, pre_consent_cookies and cookies
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for start in range(0, len(crawl_ids), 500):
+            batch = crawl_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for crawl_id, domain, profile, cmp_type, data in conn.execute(
+                    f"SELECT crawl_id, domain, profile, cmp_type, data FROM snapshots "
+                    f"WHERE crawl_id IN ({placeholders}) ORDER BY crawl_id", batch):
+                snapshot = json.loads(zlib.decompress(data).decode("utf-8"))
+                snapshot.update(crawl_id=crawl_id, domain=domain, profile=profile, cmp_type=cmp_type)
+                yield snapshot
+    finally:
+        conn.close()
@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Any, Callable, List, Optional, Tuple
+
+import psutil
+
+logger = logging.getLogger("consent-crawl")
+
+# Process names of browsers started by a crawl worker
+BROWSER_PROCESS_NAMES = ("geckodriver", "firefox", "firefox-bin", "firefox-esr")
+
+# Environment variable set in the worker subprocesses of a crawl, inherited by the
+# browsers they start, to tell the processes of a crawl apart from all others
+CRAWL_MARKER_ENV = "CONSENT_CRAWL_MARKER"
+
+
+def process_tree(pid: int) -> List[psutil.Process]:
+    """A process and all of its descendants, empty if the process is gone"""
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.Error:
+        return []
+
+
+def tree_memory_mb(pid: int) -> float:
+    """Resident memory of a process tree in MB"""
+    total = 0
+    for process in process_tree(pid):
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+
+def kill_process_tree(pid: int, timeout: float = 5) -> None:
+    """Kill a process and all of its descendants, children first"""
+    processes = process_tree(pid)
+    for process in reversed(processes):
+        try:
+            process.kill()
+        except psutil.Error:
+            pass
+    psutil.wait_procs(processes, timeout=timeout)
+
+
+def crawl_marker(process: psutil.Process) -> Optional[str]:
+    """Crawl marker in the environment of a process, None if unmarked or not readable"""
+    try:
+        return process.environ().get(CRAWL_MARKER_ENV)
+    except psutil.Error:
+        return None
+
+
+def reap_orphaned_browsers(since: float, marker: str) -> int:
+    """
+    Kill geckodriver and Firefox processes of a crawl, started after `since`, that are
+    no longer owned by it, e.g. left behind by a killed or crashed worker. Processes of
+    the crawl are recognized by its marker, which the worker subprocesses pass on to the
+    browsers they start. A browser is orphaned when its parent has exited or is not
+    marked, such as init or a subreaper that adopted it. Processes of other crawls and
+    browsers of the user are never touched.
+
+    @param since: start time of the crawl, as a timestamp
+    @param marker: marker of the crawl, see SupervisedProcess
+    @return: number of processes killed
+    """
+    killed = 0
+    for process in psutil.process_iter(["name", "ppid", "create_time"]):
+        info = process.info
+        if info["name"] not in BROWSER_PROCESS_NAMES or (info["create_time"] or 0) < since:
+            continue
+        if crawl_marker(process) != marker:
+            continue
+        try:
+            # Still run by a live worker subprocess or geckodriver of the crawl
+            if crawl_marker(psutil.Process(info["ppid"])) == marker:
+                continue
+        except psutil.Error:
+            pass
+        try:
+            process.kill()
+            killed += 1
+        except psutil.Error:
+            pass
+
+    if killed:
+        logger.info(f"Killed {killed} orphaned browser processes")
+    return killed
+
+
+def _run_marked(marker: Optional[str], target: Callable[..., None], *args: Any) -> None:
+    """Subprocess entry point: mark the environment inherited by the browsers, then run the target"""
+    if marker is not None:
+        os.environ[CRAWL_MARKER_ENV] = marker
+    target(*args)
+
+
+class SupervisedProcess:
+    """
+    Worker subprocess that runs tasks one at a time under a wall-clock deadline and a
+    memory ceiling for its whole process tree (including the browsers it starts).
+
+    The target is called in the subprocess as target(*args, conn) and must answer
+    each task received on conn with exactly one result, and stop on a None task.
+    """
+
+    def __init__(self, target: Callable[..., None], args: Tuple[Any, ...],
+                 task_timeout: float, max_memory_mb: float, poll_interval: float = 1.0,
+                 marker: Optional[str] = None):
+        """
+        @param target: worker loop to run in the subprocess, must be importable by module path
+        @param args: arguments of the worker loop, must be picklable
+        @param task_timeout: seconds after which a task counts as hung
+        @param max_memory_mb: resident memory of the process tree above which it is killed
+        @param poll_interval: seconds between deadline and memory checks
+        @param marker: crawl marker set in the environment of the subprocess, see reap_orphaned_browsers
+        """
+        self.target = target
+        self.args = args
+        self.task_timeout = task_timeout
+        self.max_memory_mb = max_memory_mb
+        self.poll_interval = poll_interval
+        self.marker = marker
+        self._process: Optional[multiprocessing.Process] = None
+        self._conn: Optional[Connection] = None
+        self.kills = 0
+
+    def _start(self) -> None:
+        """Start a fresh subprocess"""
+        # Spawn rather than fork, the parent runs writer and supervisor threads
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_run_marked, daemon=True,
+                                        args=(self.marker, self.target) + self.args + (child_conn,))
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+    def run(self, task: Any) -> Tuple[Any, Optional[str]]:
+        """
+        Run one task in the subprocess, starting it if needed. A subprocess that exceeds
+        the deadline or the memory ceiling, or dies, is killed with its process tree.
+
+        @param task: picklable task for the worker loop
+        @return: (result, None) on success, or (None, reason) if the subprocess was killed or died
+        """
+        if self._process is None or not self._process.is_alive():
+            self._start()
+
+        try:
+            self._conn.send(task)
+        except (OSError, ValueError) as e:
+            self.kill()
+            return None, f"worker unreachable: {e}"
+
+        deadline = time.time() + self.task_timeout
+        while True:
+            try:
+                if self._conn.poll(self.poll_interval):
+                    return self._conn.recv(), None
+            except (EOFError, OSError):
+                self._process.join(timeout=1)
+                reason = f"worker exited with code {self._process.exitcode}"
+                break
+
+            if not self._process.is_alive():
+                reason = f"worker exited with code {self._process.exitcode}"
+                break
+            if time.time() > deadline:
+                reason = f"no result within {self.task_timeout:.0f}s"
+                break
+            memory_mb = tree_memory_mb(self._process.pid)
+            if memory_mb > self.max_memory_mb:
+                reason = f"{memory_mb:.0f} MB resident, above {self.max_memory_mb:.0f} MB"
+                break
+
+        self.kills += 1
+        self.kill()
+        return None, reason
+
+    def kill(self) -> None:
+        """Kill the subprocess and everything it started"""
+        if self._process is not None:
+            kill_process_tree(self._process.pid)
+            self._process.join(timeout=5)
+        if self._conn is not None:
+            self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def close(self, timeout: float = 30) -> None:
+        """Ask the subprocess to shut down its browsers and exit, killing it if it does not"""
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+            self._process.join(timeout=timeout)
+        except (OSError, ValueError):
+            pass
+        if self._process.is_alive():
+            logger.warning(f"Worker process {self._process.pid} did not exit, killing it")
+        self.kill()
@@ -1,9 +1,16 @@
+import os
+import sys
 import sqlite3
 import json
 import logging
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 
+# Add src to path when run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from crawlers.shared_utils import BROWSER_VISITS, connect_crawl_database
+
 logger = logging.getLogger("cookie-extractor")
 
 
@@ -30,7 +37,7 @@ class CookieExtractor:
         @param include_unmatched: Include cookies without consent data
         @return: Dictionary with extracted cookie data
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = connect_crawl_database(self.db_path)
         conn.row_factory = sqlite3.Row  # Access columns by name
         cursor = conn.cursor()
         
@@ -41,6 +48,7 @@ class CookieExtractor:
             cr.domain,
             cr.cmp_type,
             cr.success,
+            cr.profile,
             c.name as cookie_name,
             c.domain as cookie_domain,
             c.value as cookie_value,
@@ -52,7 +60,7 @@ class CookieExtractor:
             cd.purpose_category,
             cd.purpose_description
         FROM crawl_results cr
-        LEFT JOIN cookies c ON cr.id = c.crawl_id
+        LEFT JOIN post_consent_cookies c ON cr.id = c.crawl_id
         LEFT JOIN consent_data cd ON (
             cr.id = cd.crawl_id AND 
             c.name = cd.cookie_name AND 
@@ -102,7 +110,8 @@ class CookieExtractor:
                     "expiry": row['cookie_expiry'] or "",
                     "secure": bool(row['cookie_secure']),
                     "http_only": bool(row['cookie_http_only']),
-                    "same_site": row['cookie_same_site'] or "no_restriction"
+                    "same_site": row['cookie_same_site'] or "no_restriction",
+                    "profile": row['profile']
                 }]
             }
             
@@ -128,6 +137,101 @@ class CookieExtractor:
             }
         }
     
+    def get_pre_consent_cookies(self, domain: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        List the cookies that were set before the consent interaction, per crawled site.
+        
+        @param domain: only return cookies of this crawled site
+        @return: mapping of crawled site to its pre-consent cookies
+        """
+        conn = connect_crawl_database(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        query = """
+        SELECT cr.domain as crawl_domain, c.name, c.domain, c.value, c.path, c.expiry,
+               c.secure, c.http_only, c.same_site
+        FROM crawl_results cr
+        JOIN cookies c ON cr.id = c.crawl_id
+        WHERE cr.success = 1 AND c.phase = 'pre'
+        """
+        params = ()
+        if domain is not None:
+            query += " AND cr.domain = ?"
+            params = (domain,)
+        cursor.execute(query + " ORDER BY cr.domain, c.domain, c.name", params)
+        
+        cookies_by_site = {}
+        for row in cursor.fetchall():
+            cookies_by_site.setdefault(row['crawl_domain'], []).append({
+                "name": row['name'],
+                "domain": row['domain'],
+                "value": row['value'] or "",
+                "path": row['path'] or "/",
+                "expiry": row['expiry'] or "",
+                "secure": bool(row['secure']),
+                "http_only": bool(row['http_only']),
+                "same_site": row['same_site'] or "no_restriction"
+            })
+        
+        conn.close()
+        return cookies_by_site
+    
+    def get_consent_changes(self, domain: Optional[str] = None) -> Dict[str, Dict[str, List[str]]]:
+        """
+        List the cookies added, changed and removed by the consent interaction, per crawled site.
+        
+        @param domain: only return changes of this crawled site
+        @return: mapping of crawled site to {"added": [...], "changed": [...], "removed": [...]}
+                 lists of "domain/name" cookie identifiers
+        """
+        conn = connect_crawl_database(self.db_path)
+        cursor = conn.cursor()
+        
+        query = """
+        SELECT cr.domain, c.change, c.domain || '/' || c.name
+        FROM crawl_results cr
+        JOIN cookies c ON cr.id = c.crawl_id
+        WHERE cr.success = 1 AND c.phase = 'post'
+        """
+        params = ()
+        if domain is not None:
+            query += " AND cr.domain = ?"
+            params = (domain,)
+        cursor.execute(query, params)
+        
+        changes = {}
+        for site, change, cookie_id in cursor.fetchall():
+            site_changes = changes.setdefault(site, {"added": [], "changed": [], "removed": []})
+            site_changes.setdefault(change, []).append(cookie_id)
+        
+        conn.close()
+        return changes
+    
+    def get_profile_comparison(self) -> Dict[str, Dict[str, int]]:
+        """
+        Compare the number of cookies collected per browser profile (e.g. accept_all
+        against accept_none), for sites crawled successfully under more than one profile.
+        
+        @return: mapping of crawled site to {profile: cookies collected}, from the latest
+                 successful crawl of each profile
+        """
+        conn = connect_crawl_database(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT domain, profile, cookies_collected
+        FROM crawl_results
+        WHERE success = 1 AND profile IS NOT NULL AND {BROWSER_VISITS}
+        ORDER BY id
+        """.format(BROWSER_VISITS=BROWSER_VISITS))
+        
+        by_site = {}
+        for site, profile, count in cursor.fetchall():
+            by_site.setdefault(site, {})[profile] = count
+        
+        conn.close()
+        return {site: counts for site, counts in by_site.items() if len(counts) > 1}
+    
     def _map_cmp_type(self, cmp_type: Optional[str]) -> int:
         """Map CMP type string to numeric code"""
         mapping = {
@@ -137,7 +241,8 @@ class CookieExtractor:
         }
         return mapping.get(cmp_type, -1)
     
-    def _map_purpose_category(self, category: Optional[str]) -> int:
+    @staticmethod
+    def _map_purpose_category(category: Optional[str]) -> int:
         """Map purpose category to numeric label"""
         if not category:
             return -1
@@ -170,40 +275,53 @@ class CookieExtractor:
     
     def get_database_statistics(self) -> Dict[str, Any]:
         """Get general statistics about the database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = connect_crawl_database(self.db_path)
         cursor = conn.cursor()
         
         stats = {}
         
         # Total crawls
-        cursor.execute("SELECT COUNT(*) FROM crawl_results")
+        cursor.execute(f"SELECT COUNT(*) FROM crawl_results WHERE {BROWSER_VISITS}")
         stats["total_crawls"] = cursor.fetchone()[0]
         
         # Successful crawls
-        cursor.execute("SELECT COUNT(*) FROM crawl_results WHERE success = 1")
+        cursor.execute(f"SELECT COUNT(*) FROM crawl_results WHERE success = 1 AND {BROWSER_VISITS}")
         stats["successful_crawls"] = cursor.fetchone()[0]
         
         # Failed crawls
-        cursor.execute("SELECT COUNT(*) FROM crawl_results WHERE success = 0")
+        cursor.execute(f"SELECT COUNT(*) FROM crawl_results WHERE success = 0 AND {BROWSER_VISITS}")
         stats["failed_crawls"] = cursor.fetchone()[0]
         
         # CMP type distribution
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT cmp_type, COUNT(*) 
             FROM crawl_results 
-            WHERE success = 1 
+            WHERE success = 1 AND {BROWSER_VISITS}
             GROUP BY cmp_type
         """)
         stats["cmp_distribution"] = dict(cursor.fetchall())
         
-        # Total cookies
-        cursor.execute("SELECT COUNT(*) FROM cookies")
+        # Successful crawls per browser profile, for multi-profile runs
+        cursor.execute(f"""
+            SELECT profile, COUNT(*)
+            FROM crawl_results
+            WHERE success = 1 AND profile IS NOT NULL AND {BROWSER_VISITS}
+            GROUP BY profile
+        """)
+        stats["profile_distribution"] = dict(cursor.fetchall())
+        
+        # Total cookies (removal records of post-consent deltas excluded)
+        cursor.execute("SELECT COUNT(*) FROM post_consent_cookies")
         stats["total_cookies"] = cursor.fetchone()[0]
         
         # Unique cookies (by name + domain)
-        cursor.execute("SELECT COUNT(DISTINCT name || domain) FROM cookies")
+        cursor.execute("SELECT COUNT(DISTINCT name || domain) FROM post_consent_cookies")
         stats["unique_cookies"] = cursor.fetchone()[0]
         
+        # Cookies set before any consent interaction
+        cursor.execute("SELECT COUNT(*) FROM cookies WHERE phase = 'pre'")
+        stats["pre_consent_cookies"] = cursor.fetchone()[0]
+        
         # Consent data entries
         cursor.execute("SELECT COUNT(*) FROM consent_data")
         stats["consent_data_entries"] = cursor.fetchone()[0]
@@ -1,3 +1,5 @@
+import os
+import sys
 import sqlite3
 import json
 import logging
@@ -6,6 +8,11 @@ from pathlib import Path
 from typing import Dict, Any, List, Tuple
 from datetime import datetime
 
+# Add src to path when run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from crawlers.shared_utils import BROWSER_VISITS, connect_crawl_database, init_crawl_database
+
 logger = logging.getLogger("db-processor")
 
 
@@ -35,8 +42,14 @@ class DatabaseProcessor:
         
         return str(backup_path)
     
+    def migrate_database(self) -> None:
+        """Bring a database written by an older crawler version to the current schema"""
+        init_crawl_database(self.db_path)
+        logger.info(f"Database migrated: {self.db_path}")
+    
     def clean_database(self) -> Dict[str, int]:
         """Clean the database by removing invalid entries"""
+        self.migrate_database()
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
@@ -72,12 +85,15 @@ class DatabaseProcessor:
     
     def create_analysis_views(self) -> None:
         """Create SQL views for easier data analysis"""
+        self.migrate_database()
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # View: Cookie summary with consent data
+        # View: Cookie summary with consent data, replacing views that counted each
+        # snapshot row of a cookie
+        cursor.execute("DROP VIEW IF EXISTS cookie_summary")
         cursor.execute("""
-            CREATE VIEW IF NOT EXISTS cookie_summary AS
+            CREATE VIEW cookie_summary AS
             SELECT 
                 c.name as cookie_name,
                 c.domain as cookie_domain,
@@ -90,7 +106,7 @@ class DatabaseProcessor:
                 cd.purpose_category,
                 cd.purpose_description,
                 COUNT(*) as occurrence_count
-            FROM cookies c
+            FROM post_consent_cookies c
             JOIN crawl_results cr ON c.crawl_id = cr.id
             LEFT JOIN consent_data cd ON (
                 c.crawl_id = cd.crawl_id AND 
@@ -102,7 +118,7 @@ class DatabaseProcessor:
         """)
         
         # View: Crawl success summary
-        cursor.execute("""
+        cursor.execute(f"""
             CREATE VIEW IF NOT EXISTS crawl_summary AS
             SELECT 
                 cmp_type,
@@ -111,6 +127,7 @@ class DatabaseProcessor:
                 SUM(CASE WHEN success = 0 THEN 1 ELSE 0 END) as failed_crawls,
                 ROUND(AVG(cookies_collected), 2) as avg_cookies_per_crawl
             FROM crawl_results
+            WHERE {BROWSER_VISITS}
             GROUP BY cmp_type
         """)
         
@@ -134,7 +151,7 @@ class DatabaseProcessor:
     
     def generate_statistics_report(self) -> Dict[str, Any]:
         """Generate comprehensive statistics report"""
-        conn = sqlite3.connect(self.db_path)
+        conn = connect_crawl_database(self.db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -144,13 +161,13 @@ class DatabaseProcessor:
         }
         
         # Basic crawl statistics
-        cursor.execute("SELECT COUNT(*) FROM crawl_results")
+        cursor.execute(f"SELECT COUNT(*) FROM crawl_results WHERE {BROWSER_VISITS}")
         report["total_crawls"] = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM crawl_results WHERE success = 1")
+        cursor.execute(f"SELECT COUNT(*) FROM crawl_results WHERE success = 1 AND {BROWSER_VISITS}")
         report["successful_crawls"] = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM crawl_results WHERE success = 0")
+        cursor.execute(f"SELECT COUNT(*) FROM crawl_results WHERE success = 0 AND {BROWSER_VISITS}")
         report["failed_crawls"] = cursor.fetchone()[0]
         
         # Success rate
@@ -160,22 +177,25 @@ class DatabaseProcessor:
             report["success_rate"] = 0
         
         # CMP distribution
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT cmp_type, COUNT(*) 
             FROM crawl_results 
-            WHERE success = 1 
+            WHERE success = 1 AND {BROWSER_VISITS}
             GROUP BY cmp_type
         """)
         report["cmp_distribution"] = dict(cursor.fetchall())
         
         # Cookie statistics
-        cursor.execute("SELECT COUNT(*) FROM cookies")
+        cursor.execute("SELECT COUNT(*) FROM post_consent_cookies")
         report["total_cookies"] = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(DISTINCT name || domain) FROM cookies")
+        cursor.execute("SELECT COUNT(DISTINCT name || domain) FROM post_consent_cookies")
         report["unique_cookies"] = cursor.fetchone()[0]
         
-        cursor.execute("SELECT AVG(cookies_collected) FROM crawl_results WHERE success = 1")
+        cursor.execute("SELECT COUNT(*) FROM cookies WHERE phase = 'pre'")
+        report["pre_consent_cookies"] = cursor.fetchone()[0]
+        
+        cursor.execute(f"SELECT AVG(cookies_collected) FROM crawl_results WHERE success = 1 AND {BROWSER_VISITS}")
         avg_cookies = cursor.fetchone()[0]
         report["average_cookies_per_crawl"] = round(avg_cookies, 2) if avg_cookies else 0
         
@@ -196,10 +216,10 @@ class DatabaseProcessor:
         report["purpose_categories"] = dict(cursor.fetchall())
         
         # Error analysis
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT error_message, COUNT(*) 
             FROM crawl_results 
-            WHERE success = 0 AND error_message IS NOT NULL
+            WHERE success = 0 AND error_message IS NOT NULL AND {BROWSER_VISITS}
             GROUP BY error_message 
             ORDER BY COUNT(*) DESC
             LIMIT 10
@@ -207,16 +227,16 @@ class DatabaseProcessor:
         report["common_errors"] = dict(cursor.fetchall())
         
         # Cookie attributes analysis
-        cursor.execute("SELECT COUNT(*) FROM cookies WHERE secure = 1")
+        cursor.execute("SELECT COUNT(*) FROM post_consent_cookies WHERE secure = 1")
         report["secure_cookies"] = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM cookies WHERE http_only = 1")
+        cursor.execute("SELECT COUNT(*) FROM post_consent_cookies WHERE http_only = 1")
         report["http_only_cookies"] = cursor.fetchone()[0]
         
         cursor.execute("""
             SELECT same_site, COUNT(*) 
-            FROM cookies 
-            WHERE same_site IS NOT NULL 
+            FROM post_consent_cookies 
+            WHERE same_site IS NOT NULL
             GROUP BY same_site
         """)
         report["same_site_distribution"] = dict(cursor.fetchall())
@@ -228,7 +248,7 @@ class DatabaseProcessor:
     
     def analyze_cookie_consent_matching(self) -> Dict[str, Any]:
         """Analyze how well cookies match with consent declarations"""
-        conn = sqlite3.connect(self.db_path)
+        conn = connect_crawl_database(self.db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -238,7 +258,7 @@ class DatabaseProcessor:
                 COUNT(DISTINCT c.name || c.domain) as total_unique_cookies,
                 COUNT(DISTINCT CASE WHEN cd.cookie_name IS NOT NULL 
                       THEN c.name || c.domain END) as matched_cookies
-            FROM cookies c
+            FROM post_consent_cookies c
             JOIN crawl_results cr ON c.crawl_id = cr.id
             LEFT JOIN consent_data cd ON (
                 c.crawl_id = cd.crawl_id AND 
@@ -266,7 +286,7 @@ class DatabaseProcessor:
                 COUNT(DISTINCT c.name || c.domain) as total_cookies,
                 COUNT(DISTINCT CASE WHEN cd.cookie_name IS NOT NULL 
                       THEN c.name || c.domain END) as matched_cookies
-            FROM cookies c
+            FROM post_consent_cookies c
             JOIN crawl_results cr ON c.crawl_id = cr.id
             LEFT JOIN consent_data cd ON (
                 c.crawl_id = cd.crawl_id AND 
@@ -315,6 +335,8 @@ def main():
     parser.add_argument("database", help="Path to SQLite database file")
     parser.add_argument("--backup", action="store_true",
                        help="Create backup before processing")
+    parser.add_argument("--migrate", action="store_true",
+                       help="Migrate a database of an older crawler version to the current schema")
     parser.add_argument("--clean", action="store_true",
                        help="Clean invalid data from database")
     parser.add_argument("--views", action="store_true",
@@ -333,6 +355,9 @@ def main():
         if args.backup:
             processor.backup_database()
         
+        if args.migrate:
+            processor.migrate_database()
+        
         if args.clean:
             processor.clean_database()
         